@@ -0,0 +1,147 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+try:
+    # aiobotocore is not part of the Lambda runtime; bundle it with the function to use it.
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session
+except ImportError:
+    get_session = None
+
+
+# ---------------------------------------------------------------------
+#                        Async Cognito Client
+# ---------------------------------------------------------------------
+class AsyncCognitoClient:
+    """
+    Async context manager exposing Cognito Identity Provider operations as coroutines,
+    e.g. `await client.admin_get_user(UserPoolId=..., Username=...)`.
+
+    Uses aiobotocore when it is installed. Otherwise each call runs the regular boto3
+    client on a thread pool of its own, which still lets independent calls overlap.
+    'max_workers' sizes that pool and the HTTP connection pool; the event loop's
+    default executor has only a handful of threads on Lambda.
+    """
+
+    def __init__(self, region_name=None, max_workers=10):
+        self.region_name = region_name
+        self.max_workers = max_workers
+        self._client = None
+        self._client_context = None
+        self._executor = None
+
+    async def __aenter__(self):
+        if get_session is not None:
+            self._client_context = get_session().create_client(
+                'cognito-idp',
+                region_name=self.region_name,
+                config=AioConfig(max_pool_connections=self.max_workers)
+            )
+            self._client = await self._client_context.__aenter__()
+        else:
+            self._client = boto3.client(
+                'cognito-idp',
+                region_name=self.region_name,
+                config=Config(max_pool_connections=self.max_workers)
+            )
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._client_context is not None:
+            await self._client_context.__aexit__(exc_type, exc, tb)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._client = None
+        self._client_context = None
+        self._executor = None
+
+    def __getattr__(self, operation):
+        if operation.startswith('_') or self._client is None:
+            raise AttributeError(operation)
+        method = getattr(self._client, operation)
+
+        async def call(**kwargs):
+            if self._client_context is not None:
+                return await method(**kwargs)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(method, **kwargs))
+
+        return call
+
+
+# ---------------------------------------------------------------------
+#                       Local Stub (for tests)
+# ---------------------------------------------------------------------
+class StubAsyncCognitoClient:
+    """
+    In-memory stand-in for AsyncCognitoClient, for local tests.
+
+    'users' maps each sub to {'attributes': {name: value}, 'groups': [group names]}.
+    'latency' is the simulated round trip, in seconds, of every call.
+    Errors are raised as botocore ClientErrors with Cognito's error codes.
+    """
+
+    def __init__(self, users=None, latency=0.0):
+        self.users = {
+            sub: {'attributes': dict(user.get('attributes', {})), 'groups': list(user.get('groups', []))}
+            for sub, user in (users or {}).items()
+        }
+        self.latency = latency
+        self.calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return None
+
+    async def _round_trip(self, operation):
+        self.calls.append(operation)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _get_user(self, operation, username):
+        user = self.users.get(username)
+        if user is None:
+            raise ClientError(
+                {'Error': {'Code': 'UserNotFoundException', 'Message': 'User does not exist.'}},
+                operation
+            )
+        return user
+
+    async def admin_get_user(self, UserPoolId, Username):
+        await self._round_trip('AdminGetUser')
+        user = self._get_user('AdminGetUser', Username)
+        attributes = dict(user['attributes'], sub=Username)
+        return {
+            'Username': Username,
+            'UserAttributes': [{'Name': k, 'Value': v} for k, v in attributes.items()]
+        }
+
+    async def admin_list_groups_for_user(self, UserPoolId, Username, **kwargs):
+        await self._round_trip('AdminListGroupsForUser')
+        user = self._get_user('AdminListGroupsForUser', Username)
+        return {'Groups': [{'GroupName': group} for group in user['groups']]}
+
+    async def admin_update_user_attributes(self, UserPoolId, Username, UserAttributes):
+        await self._round_trip('AdminUpdateUserAttributes')
+        user = self._get_user('AdminUpdateUserAttributes', Username)
+        for attribute in UserAttributes:
+            user['attributes'][attribute['Name']] = attribute['Value']
+        return {}
+
+    async def list_users_in_group(self, UserPoolId, GroupName, Limit=60, NextToken=None):
+        await self._round_trip('ListUsersInGroup')
+        members = [sub for sub, user in self.users.items() if GroupName in user['groups']]
+        start = int(NextToken) if NextToken else 0
+        page = members[start:start + Limit]
+        response = {'Users': [{'Username': sub, 'Attributes': [{'Name': 'sub', 'Value': sub}]} for sub in page]}
+        if start + Limit < len(members):
+            response['NextToken'] = str(start + Limit)
+        return response
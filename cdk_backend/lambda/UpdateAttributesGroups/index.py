@@ -1,11 +1,31 @@
+import asyncio
 import json
-import boto3
+import multiprocessing
+import os
 import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import boto3
 from botocore.exceptions import ClientError
 
+from async_cognito import AsyncCognitoClient
+from domain_rules import DomainRuleLoader
+from sharding import (
+    RateLimiter,
+    merge_shard_reports,
+    plan_page_range_shards,
+    plan_sub_prefix_shards,
+    split_rate_budget,
+)
+
 # Initialize Cognito Identity Provider client
 cognito_client = boto3.client('cognito-idp')
 
+# Used by the orchestrator to fan out shard workers and collect their reports
+lambda_client = boto3.client('lambda')
+s3_client = boto3.client('s3')
+
 # ======== Hardcoded Configuration ========
 ###########################################
 USER_POOL_ID = 'us-east-1_zXnwKoQ8k'  # Replace with your Cognito User Pool ID
@@ -43,17 +63,53 @@ GROUP_LIMITS = {
 # Define a precedence: The first match in this list is considered "highest" precedence.
 GROUP_PRECEDENCE = ['AdminUsers', 'AmazonUsers', 'DefaultUsers']
 
+# Groups without limits of their own (e.g. partner groups) take those of the tier given
+# to them by the sign-up domain rules document (see postConfirmation).
+DOMAIN_RULES_LOCATION = os.environ.get('DOMAIN_RULES_LOCATION')
+domain_rules = DomainRuleLoader(
+    DOMAIN_RULES_LOCATION,
+    default_group='DefaultUsers',
+    fallback_rules=[],
+    known_groups=GROUP_LIMITS
+)
+
+# ---- Orchestrated (sharded) pool-wide runs ----
+# Invoke with {"mode": "orchestrate"} to split the whole pool into shards. Each user
+# gets the limits of their highest-precedence group, as for EventBridge invocations.
+SHARD_STRATEGY = 'sub_prefix'  # 'sub_prefix' | 'page_ranges'
+SHARD_PREFIX_LENGTH = 1  # 1 -> 16 shards, 2 -> 256 shards
+EXPORT_LOCATION = None  # 's3://bucket/key' or local path with one sub per line (see mode 'export')
+EXPORT_PAGE_SIZE = 1000  # Users per shard for 'page_ranges'
+GLOBAL_RATE_LIMIT = 20  # Cognito requests per second, shared by all shards
+LOCAL_MAX_WORKERS = 8  # Process pool size when orchestrating locally
+
 #XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
 # Do not change below for normal usage
 ###########################################
 MAX_RETRIES = 5  # Maximum number of retries for throttling
 BASE_DELAY = 1   # Base delay in seconds for exponential backoff
 
+# 'async' runs EventBridge and manual invocations on asyncio: the user and group lookups
+# are issued concurrently and bulk updates run as a semaphore-bounded task pool.
+EXECUTION_MODE = os.environ.get('EXECUTION_MODE', 'sync')  # 'sync' | 'async'
+ASYNC_MAX_CONCURRENCY = 10  # Max in-flight Cognito calls for async bulk updates
+
+ORCHESTRATION_MODES = ['orchestrate', 'shard_worker', 'merge', 'export']
+RESULTS_BUCKET = os.environ.get('RESULTS_BUCKET')  # Where Lambda shard workers write their reports
+RESULTS_PREFIX = 'jobs/update-attributes-groups/'
+RESULT_POLL_INTERVAL = 10  # Seconds between checks for finished shard reports
+SHARD_TIME_RESERVE = 60  # Seconds left when a Lambda shard worker hands the rest of its shard to a new invocation
+
+# Set per shard worker so every Cognito call draws from its share of GLOBAL_RATE_LIMIT
+rate_limiter = None
+
 def handler(event, context):
     """
     AWS Lambda function that either:
         1) Is triggered by EventBridge for group changes (AdminAddUserToGroup / AdminRemoveUserFromGroup).
-        2) Is manually invoked (e.g., with the Hardcoded Configuration above).
+        2) Is invoked with a 'mode' of 'orchestrate', 'shard_worker', 'merge' or 'export'
+           to run a pool-wide job split into shards.
+        3) Is manually invoked (e.g., with the Hardcoded Configuration above).
     
     Depending on invocation type, this function:
         - Fetches the user(s)
@@ -65,10 +121,19 @@ def handler(event, context):
         if is_eventbridge_invocation(event):
             print("[INFO] EventBridge invocation detected.")
             print(event)
+            if EXECUTION_MODE == 'async':
+                return asyncio.run(handle_eventbridge_invocation_async(event))
             return handle_eventbridge_invocation(event)
+
+        # 2) Orchestrated pool-wide runs and their shard workers
+        if isinstance(event, dict) and event.get('mode') in ORCHESTRATION_MODES:
+            print(f"[INFO] Orchestration invocation detected (mode={event['mode']}).")
+            return handle_orchestration_invocation(event, context)
         
-        # 2) Otherwise, assume manual invocation
+        # 3) Otherwise, assume manual invocation
         print("[INFO] Manual invocation detected.")
+        if EXECUTION_MODE == 'async':
+            return asyncio.run(handle_manual_invocation_async())
         return handle_manual_invocation()
 
     except Exception as e:
@@ -114,11 +179,8 @@ def handle_manual_invocation():
 
     # Update each user based on the group's configured limits.
     # For manual usage, we *know* the user(s) are in GROUP_NAME, 
-    # so pick that group's dictionary or fallback to default.
-    if GROUP_NAME in GROUP_LIMITS:
-        attributes_to_apply = GROUP_LIMITS[GROUP_NAME]
-    else:
-        attributes_to_apply = GROUP_LIMITS['DefaultUsers']  # fallback
+    # so pick that group's (or its tier's) dictionary or fallback to default.
+    attributes_to_apply = GROUP_LIMITS.get(get_group_tier(GROUP_NAME), GROUP_LIMITS['DefaultUsers'])
 
     updated_users = []
     failed_updates = []
@@ -197,6 +259,566 @@ def handle_eventbridge_invocation(event):
         return format_response(500, message)
 
 
+# ---------------------------------------------------------------------
+#                        Async Execution Path
+# ---------------------------------------------------------------------
+async def handle_eventbridge_invocation_async(event, client=None):
+    """
+    Async equivalent of handle_eventbridge_invocation. The user lookup and the
+    group lookup are independent, so both requests are in flight at once.
+    """
+    detail = event.get('detail', {})
+    event_name = detail.get('eventName')
+    request_params = detail.get('requestParameters', {})
+
+    user_pool_id = request_params.get('userPoolId')
+    username_or_sub = detail.get('additionalEventData', {}).get('sub')
+
+    if not user_pool_id or not username_or_sub:
+        return format_response(400, "Missing userPoolId or username in EventBridge detail.")
+
+    if user_pool_id != USER_POOL_ID:
+        return format_response(200, "Event is for a different user pool; skipping.")
+
+    async with (client or AsyncCognitoClient(max_workers=ASYNC_MAX_CONCURRENCY)) as cognito:
+        user, user_groups = await asyncio.gather(
+            get_user_by_sub_async(cognito, username_or_sub),
+            get_user_groups_async(cognito, username_or_sub)
+        )
+        if user is None:
+            return format_response(404, f"User with sub/username '{username_or_sub}' not found in user pool.")
+        if user_groups is None:
+            return format_response(500, f"Failed to retrieve user groups for sub '{username_or_sub}'.")
+
+        highest_group = get_highest_precedence_group(user_groups)
+        attributes_to_apply = GROUP_LIMITS.get(highest_group, GROUP_LIMITS['DefaultUsers'])
+
+        success = await update_user_attributes_async(cognito, username_or_sub, attributes_to_apply)
+
+    if success:
+        message = f"[{event_name}] Succeeded updating user '{username_or_sub}' with group '{highest_group}' attributes."
+        print(message)
+        return format_response(200, message)
+    else:
+        message = f"[{event_name}] Failed to update user '{username_or_sub}' with group '{highest_group}' attributes."
+        print(message)
+        return format_response(500, message)
+
+async def handle_manual_invocation_async(client=None):
+    """
+    Async equivalent of handle_manual_invocation, driving the updates through
+    a task pool bounded to ASYNC_MAX_CONCURRENCY in-flight calls.
+    """
+    if not isinstance(UPDATE_ALL, bool):
+        return format_response(400, "Parameter 'UPDATE_ALL' must be a boolean.")
+
+    if not UPDATE_ALL and not USER_SUB:
+        return format_response(400, "Parameter 'USER_SUB' is required when 'UPDATE_ALL' is False.")
+
+    async with (client or AsyncCognitoClient(max_workers=ASYNC_MAX_CONCURRENCY)) as cognito:
+        if UPDATE_ALL:
+            users_to_update = await get_all_users_in_group_async(cognito, GROUP_NAME)
+            if users_to_update is None:
+                return format_response(500, f"Failed to retrieve users from group '{GROUP_NAME}'.")
+            if not users_to_update:
+                return format_response(200, f"No users found in group '{GROUP_NAME}' to update.")
+            print(f"Found {len(users_to_update)} users in group '{GROUP_NAME}' for update.")
+        else:
+            user, user_groups = await asyncio.gather(
+                get_user_by_sub_async(cognito, USER_SUB),
+                get_user_groups_async(cognito, USER_SUB)
+            )
+            if user is None:
+                return format_response(404, f"User with sub '{USER_SUB}' not found.")
+            if user_groups is None:
+                return format_response(500, f"Failed to retrieve user groups for sub '{USER_SUB}'.")
+            if GROUP_NAME not in user_groups:
+                return format_response(400, f"User with sub '{USER_SUB}' is not a member of group '{GROUP_NAME}'.")
+            users_to_update = [USER_SUB]
+            print(f"User '{USER_SUB}' confirmed in group '{GROUP_NAME}' for update.")
+
+        attributes_to_apply = GROUP_LIMITS.get(get_group_tier(GROUP_NAME), GROUP_LIMITS['DefaultUsers'])
+        updated_users, failed_updates = await update_users_async(cognito, users_to_update, attributes_to_apply)
+
+    response_message = {
+        "mode": "Update_ALL" if UPDATE_ALL else "Specific User Updated",
+        "message": "User attribute updates completed.",
+        "total_users_processed": len(users_to_update),
+        "successful_updates": len(updated_users),
+        "failed_updates": failed_updates
+    }
+
+    return format_response(200, response_message)
+
+async def update_users_async(cognito, subs, attributes, max_concurrency=ASYNC_MAX_CONCURRENCY):
+    """
+    Updates many users concurrently, with at most 'max_concurrency' calls in flight.
+    Returns (updated_subs, failed_subs), both in input order.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def update_one(sub):
+        async with semaphore:
+            return await update_user_attributes_async(cognito, sub, attributes)
+
+    results = await asyncio.gather(*(update_one(sub) for sub in subs))
+
+    updated_users = [sub for sub, success in zip(subs, results) if success]
+    failed_updates = [sub for sub, success in zip(subs, results) if not success]
+    return updated_users, failed_updates
+
+async def call_with_retry_async(operation, **kwargs):
+    """
+    Awaits a Cognito coroutine, retrying throttling errors with exponential backoff.
+    Other errors, and throttling past MAX_RETRIES, are raised to the caller.
+    """
+    retries = 0
+
+    while True:
+        try:
+            return await operation(**kwargs)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ['TooManyRequestsException', 'ThrottlingException'] and retries < MAX_RETRIES:
+                delay = BASE_DELAY * (2 ** retries)
+                print(f"Throttled. Retrying in {delay} seconds...")
+                await asyncio.sleep(delay)
+                retries += 1
+                continue
+            raise
+
+async def get_all_users_in_group_async(cognito, group_name):
+    """
+    Async equivalent of get_all_users_in_group_with_retry.
+    """
+    users = []
+    next_token = None
+
+    try:
+        while True:
+            params = {'UserPoolId': USER_POOL_ID, 'GroupName': group_name, 'Limit': 60}
+            if next_token:
+                params['NextToken'] = next_token
+
+            response = await call_with_retry_async(cognito.list_users_in_group, **params)
+            batch_users = [get_user_sub(u) for u in response.get('Users', []) if u]
+            users.extend(sub for sub in batch_users if sub)
+
+            next_token = response.get('NextToken')
+            if not next_token:
+                return users
+    except ClientError as e:
+        print(f"ClientError: {e}")
+        return None
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        return None
+
+async def get_user_by_sub_async(cognito, user_sub):
+    """
+    Async equivalent of get_user_by_sub_with_retry.
+    """
+    try:
+        return await call_with_retry_async(cognito.admin_get_user, UserPoolId=USER_POOL_ID, Username=user_sub)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'UserNotFoundException':
+            print(f"User with sub '{user_sub}' not found.")
+        else:
+            print(f"ClientError: {e}")
+        return None
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        return None
+
+async def get_user_groups_async(cognito, user_sub):
+    """
+    Async equivalent of get_user_groups_with_retry.
+    """
+    try:
+        response = await call_with_retry_async(
+            cognito.admin_list_groups_for_user, UserPoolId=USER_POOL_ID, Username=user_sub
+        )
+        return [group['GroupName'] for group in response.get('Groups', [])]
+    except ClientError as e:
+        print(f"ClientError: {e}")
+        return None
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        return None
+
+async def update_user_attributes_async(cognito, user_sub, attributes):
+    """
+    Async equivalent of update_user_attributes_with_retry.
+    """
+    user_attributes = [{'Name': k, 'Value': v} for k, v in attributes.items()]
+
+    try:
+        await call_with_retry_async(
+            cognito.admin_update_user_attributes,
+            UserPoolId=USER_POOL_ID,
+            Username=user_sub,
+            UserAttributes=user_attributes
+        )
+        return True
+    except ClientError as e:
+        print(f"ClientError while updating user '{user_sub}': {e}")
+        return False
+    except Exception as e:
+        print(f"Unexpected error while updating user '{user_sub}': {e}")
+        return False
+
+
+# ---------------------------------------------------------------------
+#                  Handle Orchestration Invocation
+# ---------------------------------------------------------------------
+def handle_orchestration_invocation(event, context):
+    """
+    Dispatches the sharded pool-wide job modes:
+        - 'orchestrate':  plan shards, run them (local process pool or async Lambda
+                          invokes) and merge their reports.
+        - 'shard_worker': update the users of a single shard.
+        - 'merge':        merge the shard reports of an earlier Lambda-executed job.
+        - 'export':       write every sub in the pool to EXPORT_LOCATION for 'page_ranges'.
+    """
+    mode = event['mode']
+
+    if mode == 'orchestrate':
+        return orchestrate(event, context)
+
+    if mode == 'shard_worker':
+        shard = event.get('shard')
+        if not shard:
+            return format_response(400, "Parameter 'shard' is required for mode 'shard_worker'.")
+        report = event.get('report')
+        if report and report.get('partial_report_key'):
+            report = load_report(report['partial_report_key'])
+        report = run_shard(shard, event.get('rate_limit'), context, report)
+        continuation = report.pop('continuation', None)
+        if continuation:
+            # Out of time: hand the rest of the shard and the report so far to a new invocation
+            try:
+                payload = continue_shard(event, continuation, report)
+                invoke_shard_worker(context, payload)
+                return format_response(202, {"message": "Shard continued in a new invocation.",
+                                             "shard": payload['shard']})
+            except (ClientError, ValueError) as e:
+                print(f"Failed to continue shard {shard['shard_id']}: {e}")
+                report['error'] = f"Stopped before the end of the shard and could not continue: {e}"
+                continuation.pop('subs', None)
+                report['continuation'] = continuation
+        if event.get('job_id') and RESULTS_BUCKET:
+            save_shard_report(event['job_id'], report)
+        return format_response(200, report)
+
+    if mode == 'merge':
+        job_id = event.get('job_id')
+        if not job_id:
+            return format_response(400, "Parameter 'job_id' is required for mode 'merge'.")
+        reports = load_shard_reports(job_id)
+        return format_response(200, merge_shard_reports(reports, event.get('total_shards')))
+
+    location = event.get('export_location', EXPORT_LOCATION)
+    if not location:
+        return format_response(400, "Parameter 'export_location' is required for mode 'export'.")
+    subs = get_users_by_sub_prefix_with_retry('')
+    if subs is None:
+        return format_response(500, "Failed to list users for export.")
+    write_export(location, subs)
+    return format_response(200, {"message": "Export completed.", "export_location": location, "total_users": len(subs)})
+
+def plan_shards(event):
+    """
+    Builds the shard list for the configured (or event-supplied) strategy.
+    """
+    strategy = event.get('strategy', SHARD_STRATEGY)
+
+    if strategy == 'sub_prefix':
+        return plan_sub_prefix_shards(int(event.get('prefix_length', SHARD_PREFIX_LENGTH)))
+
+    if strategy == 'page_ranges':
+        location = event.get('export_location', EXPORT_LOCATION)
+        if not location:
+            raise ValueError("An export location is required for the 'page_ranges' strategy.")
+        total_users = len(read_export(location))
+        return plan_page_range_shards(total_users, int(event.get('page_size', EXPORT_PAGE_SIZE)), location)
+
+    raise ValueError(f"Unknown shard strategy '{strategy}'.")
+
+def orchestrate(event, context):
+    """
+    Splits the pool into shards and runs one worker per shard, either locally
+    in a process pool or as asynchronous invocations of this same Lambda.
+    """
+    try:
+        shards = plan_shards(event)
+    except ValueError as e:
+        return format_response(400, str(e))
+
+    if not shards:
+        return format_response(200, merge_shard_reports([], 0))
+
+    executor = event.get('executor') or ('lambda' if context is not None else 'local')
+    print(f"Planned {len(shards)} shards; executing with '{executor}'.")
+
+    if executor == 'local':
+        max_workers = min(len(shards), int(event.get('max_workers', LOCAL_MAX_WORKERS)))
+        rate_limit = split_rate_budget(GLOBAL_RATE_LIMIT, max_workers)
+        reports = run_shards_locally(shards, rate_limit, max_workers)
+        return format_response(200, merge_shard_reports(reports, len(shards)))
+
+    if executor != 'lambda':
+        return format_response(400, f"Unknown executor '{executor}'. Use 'local' or 'lambda'.")
+    if not RESULTS_BUCKET:
+        return format_response(500, "RESULTS_BUCKET must be set to run shards as Lambda workers.")
+
+    # Async invokes all run at once, so the budget is split across every shard.
+    job_id = event.get('job_id') or uuid.uuid4().hex
+    rate_limit = split_rate_budget(GLOBAL_RATE_LIMIT, len(shards))
+    if shards[0]['strategy'] == 'page_ranges':
+        shards = split_export(job_id, shards)
+
+    for shard in shards:
+        payload = {'mode': 'shard_worker', 'job_id': job_id, 'shard': shard, 'rate_limit': rate_limit}
+        try:
+            invoke_shard_worker(context, payload)
+        except ClientError as e:
+            print(f"Failed to dispatch shard {shard['shard_id']}: {e}")
+            save_shard_report(job_id, {'shard_id': shard['shard_id'], 'error': f"Dispatch failed: {e}"})
+
+    print(f"Dispatched job '{job_id}' with {len(shards)} shards.")
+
+    if wait_for_shard_reports(job_id, len(shards), context):
+        return format_response(200, merge_shard_reports(load_shard_reports(job_id), len(shards)))
+
+    return format_response(202, {
+        "mode": "Orchestrated",
+        "message": "Shards are still running. Invoke with mode 'merge' to collect the results.",
+        "job_id": job_id,
+        "total_shards": len(shards)
+    })
+
+def run_shards_locally(shards, rate_limit, max_workers):
+    """
+    Runs every shard in a local process pool and returns their reports.
+    """
+    reports = []
+    # 'spawn' gives each worker a fresh boto3 client instead of a forked copy.
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {pool.submit(run_shard, shard, rate_limit): shard for shard in shards}
+        for future in as_completed(futures):
+            shard = futures[future]
+            try:
+                reports.append(future.result())
+            except Exception as e:
+                print(f"Shard {shard['shard_id']} raised: {e}")
+                reports.append({'shard_id': shard['shard_id'], 'error': str(e)})
+    return reports
+
+def invoke_shard_worker(context, payload):
+    """
+    Runs a shard worker as an asynchronous invocation of this same Lambda.
+    """
+    lambda_client.invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType='Event',
+        Payload=json.dumps(payload)
+    )
+
+def run_shard(shard, rate_limit=None, context=None, report=None):
+    """
+    Updates every user in one shard to the limits of their highest-precedence group.
+
+    Given a Lambda context, stops once fewer than SHARD_TIME_RESERVE seconds remain
+    and returns the report so far with a 'continuation': the shard to run next,
+    starting at the first user not processed. A 'sub_prefix' shard's continuation
+    also holds the shard's 'subs', for continue_shard to store, so that later parts
+    read the list instead of listing the shard in Cognito again. 'report' is the
+    report of the earlier parts of the shard, if any.
+    """
+    global rate_limiter
+    rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+
+    report = dict(report) if report else {
+        'shard_id': shard['shard_id'],
+        'total_users_processed': 0,
+        'successful_updates': 0,
+        'failed_updates': []
+    }
+    report['failed_updates'] = list(report['failed_updates'])
+
+    subs = get_shard_user_subs(shard)
+    if subs is None:
+        report['error'] = "Failed to list users for shard."
+        return report
+
+    processed = 0
+    for sub in subs:
+        if processed and context is not None \
+                and context.get_remaining_time_in_millis() < SHARD_TIME_RESERVE * 1000:
+            if 'export_location' in shard:
+                report['continuation'] = dict(shard, start=shard['start'] + processed)
+            else:
+                report['continuation'] = dict(shard, subs=subs, start=processed, end=len(subs))
+            break
+
+        user_groups = get_user_groups_with_retry(sub)
+        if user_groups is None:
+            report['failed_updates'].append(sub)
+        else:
+            highest_group = get_highest_precedence_group(user_groups)
+            attributes_to_apply = GROUP_LIMITS.get(highest_group, GROUP_LIMITS['DefaultUsers'])
+            if update_user_attributes_with_retry(sub, attributes_to_apply):
+                report['successful_updates'] += 1
+            else:
+                report['failed_updates'].append(sub)
+
+        processed += 1
+
+    report['total_users_processed'] += processed
+    print(f"Shard {shard['shard_id']}: {report['successful_updates']}/{report['total_users_processed']} users updated"
+          f"{' so far' if 'continuation' in report else ''}.")
+    return report
+
+def get_shard_user_subs(shard):
+    """
+    Returns the subs covered by a shard, in the order they are processed, or None
+    if they could not be listed. A shard with an 'export_location' (every
+    'page_ranges' shard, and a 'sub_prefix' shard once continued) reads its range
+    of that list.
+    """
+    if 'export_location' in shard:
+        return read_export(shard['export_location'])[shard['start']:shard['end']]
+    subs = get_users_by_sub_prefix_with_retry(shard['prefix'])
+    if subs is None:
+        return None
+    # A continuation that could not be stored (see continue_shard) still has its range
+    return sorted(subs)[shard.get('start', 0):shard.get('end')]
+
+def continue_shard(event, continuation, report):
+    """
+    Stores what a new invocation needs to run the rest of a shard, and returns its
+    payload. The async invoke payload is limited to 256 KB, so the report so far
+    is saved under the job's reports and the payload carries only its key and
+    counters; a 'sub_prefix' shard's list is saved under the job's exports.
+    """
+    job_id = event.get('job_id')
+    if not job_id or not RESULTS_BUCKET:
+        raise ValueError("A job_id and RESULTS_BUCKET are required to continue a shard.")
+
+    if 'subs' in continuation:
+        location = shard_export_location(job_id, continuation['shard_id'])
+        write_export(location, continuation.pop('subs'))
+        continuation['export_location'] = location
+
+    report_key = partial_report_key(job_id, report['shard_id'])
+    s3_client.put_object(
+        Bucket=RESULTS_BUCKET,
+        Key=report_key,
+        Body=json.dumps(report).encode('utf-8'),
+        ContentType='application/json'
+    )
+    counters = {
+        'shard_id': report['shard_id'],
+        'total_users_processed': report['total_users_processed'],
+        'successful_updates': report['successful_updates'],
+        'failed_count': len(report['failed_updates']),
+        'partial_report_key': report_key,
+    }
+    return dict(event, shard=continuation, report=counters)
+
+def wait_for_shard_reports(job_id, expected_shards, context):
+    """
+    Polls the results bucket until every shard has reported or this invocation
+    is about to time out. Returns True if all shards reported.
+    """
+    while True:
+        if count_shard_reports(job_id) >= expected_shards:
+            return True
+        if context.get_remaining_time_in_millis() < (RESULT_POLL_INTERVAL + 5) * 1000:
+            return False
+        time.sleep(RESULT_POLL_INTERVAL)
+
+def shard_report_prefix(job_id):
+    return f"{RESULTS_PREFIX}{job_id}/reports/"
+
+def partial_report_key(job_id, shard_id):
+    # Under reports/partial/, which list_shard_report_keys leaves out
+    return f"{shard_report_prefix(job_id)}partial/shard-{shard_id:05d}.json"
+
+def shard_export_location(job_id, shard_id):
+    return f"s3://{RESULTS_BUCKET}/{RESULTS_PREFIX}{job_id}/exports/shard-{shard_id:05d}.txt"
+
+def split_export(job_id, shards):
+    """
+    Writes each 'page_ranges' shard's slice of the export to its own object under
+    the job, so that shard workers read only their own users. Returns the shards
+    pointed at their slices.
+    """
+    subs = read_export(shards[0]['export_location'])
+    sliced = []
+    for shard in shards:
+        location = shard_export_location(job_id, shard['shard_id'])
+        shard_subs = subs[shard['start']:shard['end']]
+        write_export(location, shard_subs)
+        sliced.append(dict(shard, export_location=location, start=0, end=len(shard_subs)))
+    return sliced
+
+def save_shard_report(job_id, report):
+    s3_client.put_object(
+        Bucket=RESULTS_BUCKET,
+        Key=f"{shard_report_prefix(job_id)}shard-{report['shard_id']:05d}.json",
+        Body=json.dumps(report).encode('utf-8'),
+        ContentType='application/json'
+    )
+
+def list_shard_report_keys(job_id):
+    """
+    Returns the keys of the job's final shard reports.
+    """
+    keys = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=RESULTS_BUCKET, Prefix=shard_report_prefix(job_id), Delimiter='/'):
+        keys.extend(obj['Key'] for obj in page.get('Contents', []))
+    return keys
+
+def count_shard_reports(job_id):
+    return len(list_shard_report_keys(job_id))
+
+def load_report(key):
+    response = s3_client.get_object(Bucket=RESULTS_BUCKET, Key=key)
+    return json.loads(response['Body'].read())
+
+def load_shard_reports(job_id):
+    return [load_report(key) for key in list_shard_report_keys(job_id)]
+
+def split_s3_location(location):
+    """
+    Splits 's3://bucket/key' into (bucket, key).
+    """
+    bucket, _, key = location[len('s3://'):].partition('/')
+    return bucket, key
+
+def read_export(location):
+    """
+    Reads a sub export (one sub per line) from S3 or the local filesystem.
+    """
+    if location.startswith('s3://'):
+        bucket, key = split_s3_location(location)
+        content = s3_client.get_object(Bucket=bucket, Key=key)['Body'].read().decode('utf-8')
+    else:
+        with open(location, encoding='utf-8') as f:
+            content = f.read()
+    return [line.strip() for line in content.splitlines() if line.strip()]
+
+def write_export(location, subs):
+    content = '\n'.join(subs) + '\n'
+    if location.startswith('s3://'):
+        bucket, key = split_s3_location(location)
+        s3_client.put_object(Bucket=bucket, Key=key, Body=content.encode('utf-8'), ContentType='text/plain')
+    else:
+        with open(location, 'w', encoding='utf-8') as f:
+            f.write(content)
+
+
 # ---------------------------------------------------------------------
 #                   Utility / Helper Functions
 # ---------------------------------------------------------------------
@@ -222,6 +844,13 @@ def format_response(status_code, body):
         "body": body
     }
 
+def acquire_rate_budget():
+    """
+    Waits for this worker's share of the global rate budget, if one is set.
+    """
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+
 def get_user_sub(user):
     """
     Extracts the 'sub' attribute from a Cognito user object.
@@ -250,6 +879,7 @@ def get_all_users_in_group_with_retry(group_name):
             if next_token:
                 params['NextToken'] = next_token
 
+            acquire_rate_budget()
             response = cognito_client.list_users_in_group(**params)
             batch_users = [get_user_sub(u) for u in response.get('Users', []) if u]
             batch_users = [sub for sub in batch_users if sub]  # Filter out None
@@ -279,6 +909,56 @@ def get_all_users_in_group_with_retry(group_name):
 
     return users
 
+def get_users_by_sub_prefix_with_retry(prefix):
+    """
+    Retrieves the subs of all users whose 'sub' starts with 'prefix' (all users
+    if the prefix is empty) with exponential backoff.
+    """
+    users = []
+    next_token = None
+    retries = 0
+
+    while True:
+        try:
+            params = {
+                'UserPoolId': USER_POOL_ID,
+                'AttributesToGet': ['sub'],
+                'Limit': 60  # Max allowed by Cognito per request
+            }
+            if prefix:
+                params['Filter'] = f'sub ^= "{prefix}"'
+            if next_token:
+                params['PaginationToken'] = next_token
+
+            acquire_rate_budget()
+            response = cognito_client.list_users(**params)
+            batch_users = [get_user_sub(u) for u in response.get('Users', []) if u]
+            users.extend(sub for sub in batch_users if sub)
+
+            next_token = response.get('PaginationToken')
+            if not next_token:
+                break
+
+        except ClientError as e:
+            if e.response['Error']['Code'] in ['TooManyRequestsException', 'ThrottlingException']:
+                if retries < MAX_RETRIES:
+                    delay = BASE_DELAY * (2 ** retries)
+                    print(f"Throttled. Retrying in {delay} seconds...")
+                    time.sleep(delay)
+                    retries += 1
+                    continue
+                else:
+                    print("Max retries reached. Exiting.")
+                    return None
+            else:
+                print(f"ClientError: {e}")
+                return None
+        except Exception as e:
+            print(f"Unexpected error: {e}")
+            return None
+
+    return users
+
 def get_user_by_sub_with_retry(user_sub):
     """
     Retrieves a Cognito user by their 'sub' identifier with exponential backoff.
@@ -287,6 +967,7 @@ def get_user_by_sub_with_retry(user_sub):
 
     while True:
         try:
+            acquire_rate_budget()
             response = cognito_client.admin_get_user(
                 UserPoolId=USER_POOL_ID,
                 Username=user_sub
@@ -321,6 +1002,7 @@ def get_user_groups_with_retry(user_sub):
 
     while True:
         try:
+            acquire_rate_budget()
             response = cognito_client.admin_list_groups_for_user(
                 UserPoolId=USER_POOL_ID,
                 Username=user_sub
@@ -354,6 +1036,7 @@ def update_user_attributes_with_retry(user_sub, attributes):
 
     while True:
         try:
+            acquire_rate_budget()
             cognito_client.admin_update_user_attributes(
                 UserPoolId=USER_POOL_ID,
                 Username=user_sub,
@@ -378,13 +1061,25 @@ def update_user_attributes_with_retry(user_sub, attributes):
             print(f"Unexpected error while updating user '{user_sub}': {e}")
             return False
 
+def get_group_tier(group):
+    """
+    Returns the group whose limits apply to members of 'group': the group itself,
+    or for partner groups the tier the domain rules document gives them.
+    """
+    return domain_rules.get_index().tier(group)
+
 def get_highest_precedence_group(user_groups):
     """
-    Given a list of group names, returns the group that appears first
-    in GROUP_PRECEDENCE. If none found, default to 'DefaultUsers'.
+    Given a list of group names, returns the group (or partner group's tier)
+    that appears first in GROUP_PRECEDENCE. If none found, default to 'DefaultUsers'.
     """
+    tiers = {get_group_tier(group) for group in user_groups}
     for group in GROUP_PRECEDENCE:
-        if group in user_groups:
+        if group in tiers:
             return group
     # Fallback if none are in the precedence list
     return 'DefaultUsers'
+
+if __name__ == '__main__':
+    # Local pool-wide run: `python index.py` from this directory with AWS credentials configured.
+    print(handler({'mode': 'orchestrate', 'executor': 'local'}, None))
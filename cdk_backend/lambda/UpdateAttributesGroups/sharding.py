@@ -0,0 +1,122 @@
+import threading
+import time
+
+# Cognito 'sub' values are UUIDs, so their first characters are lowercase hex.
+HEX_DIGITS = '0123456789abcdef'
+
+
+# ---------------------------------------------------------------------
+#                         Shard Planning
+# ---------------------------------------------------------------------
+def plan_sub_prefix_shards(prefix_length=1):
+    """
+    Splits the user pool into shards by the leading characters of each user's 'sub'.
+    A prefix length of 1 yields 16 shards, 2 yields 256 shards.
+    """
+    if prefix_length < 1:
+        raise ValueError("prefix_length must be at least 1.")
+
+    prefixes = ['']
+    for _ in range(prefix_length):
+        prefixes = [p + c for p in prefixes for c in HEX_DIGITS]
+
+    return [
+        {'shard_id': index, 'strategy': 'sub_prefix', 'prefix': prefix}
+        for index, prefix in enumerate(prefixes)
+    ]
+
+def plan_page_range_shards(total_users, page_size, export_location):
+    """
+    Splits a pre-exported list of subs (one per line) into contiguous [start, end) ranges.
+    """
+    if page_size < 1:
+        raise ValueError("page_size must be at least 1.")
+
+    return [
+        {
+            'shard_id': index,
+            'strategy': 'page_ranges',
+            'export_location': export_location,
+            'start': start,
+            'end': min(start + page_size, total_users)
+        }
+        for index, start in enumerate(range(0, total_users, page_size))
+    ]
+
+def split_rate_budget(global_rate, concurrent_workers):
+    """
+    Returns the per-worker share of a global requests/second budget,
+    so that all concurrently running shards together stay within it.
+    """
+    return global_rate / max(1, concurrent_workers)
+
+
+# ---------------------------------------------------------------------
+#                          Rate Limiting
+# ---------------------------------------------------------------------
+class RateLimiter:
+    """
+    Token bucket limiting calls to 'rate' per second, with bursts up to 'burst' calls.
+    Each shard worker owns one, sized to its share of the global rate budget.
+    """
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError("rate must be positive.")
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a token is available, then consumes it.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# ---------------------------------------------------------------------
+#                          Result Merging
+# ---------------------------------------------------------------------
+def merge_shard_reports(reports, expected_shards=None):
+    """
+    Merges per-shard reports into the same shape as a single-Lambda manual run:
+    'successful_updates' is a count and 'failed_updates' is a list of subs.
+    """
+    total_users = 0
+    successful_updates = 0
+    failed_updates = []
+    failed_shards = []
+
+    for report in sorted(reports, key=lambda r: r.get('shard_id', 0)):
+        total_users += report.get('total_users_processed', 0)
+        successful_updates += report.get('successful_updates', 0)
+        failed_updates.extend(report.get('failed_updates', []))
+        if report.get('error'):
+            failed_shards.append({'shard_id': report.get('shard_id'), 'error': report['error']})
+
+    if expected_shards is not None:
+        seen = {report.get('shard_id') for report in reports}
+        for shard_id in range(expected_shards):
+            if shard_id not in seen:
+                failed_shards.append({'shard_id': shard_id, 'error': 'No result reported.'})
+
+    return {
+        "mode": "Orchestrated",
+        "message": "User attribute updates completed.",
+        "total_shards": expected_shards if expected_shards is not None else len(reports),
+        "total_users_processed": total_users,
+        "successful_updates": successful_updates,
+        "failed_updates": failed_updates,
+        "failed_shards": failed_shards
+    }
@@ -0,0 +1,185 @@
+import asyncio
+import importlib.util
+import io
+import json
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..', 'shared', 'python'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+from async_cognito import StubAsyncCognitoClient  # noqa: E402
+
+# Every Lambda's handler module is named 'index', so load this one under its own name
+_spec = importlib.util.spec_from_file_location('update_attributes_groups_index', os.path.join(HERE, 'index.py'))
+index = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(index)
+
+ATTRIBUTES = {'custom:max_files_allowed': '5'}
+
+
+class InFlightStub(StubAsyncCognitoClient):
+    """
+    Records the most attribute updates in flight at once.
+    """
+
+    def __init__(self, users, latency):
+        super().__init__(users, latency)
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def admin_update_user_attributes(self, **kwargs):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return await super().admin_update_user_attributes(**kwargs)
+        finally:
+            self.in_flight -= 1
+
+
+def users(subs):
+    return {sub: {'attributes': {}, 'groups': ['AmazonUsers']} for sub in subs}
+
+
+def test_update_users_async_bounds_calls_in_flight():
+    subs = [f'user-{i:02d}' for i in range(25)]
+    cognito = InFlightStub(users(subs), latency=0.01)
+
+    updated, failed = asyncio.run(index.update_users_async(cognito, subs, ATTRIBUTES, max_concurrency=4))
+
+    assert updated == subs
+    assert failed == []
+    assert cognito.max_in_flight == 4
+    assert all(cognito.users[sub]['attributes'] == ATTRIBUTES for sub in subs)
+
+
+def test_update_users_async_isolates_failures():
+    subs = ['user-a', 'missing-b', 'user-c', 'missing-d']
+    cognito = StubAsyncCognitoClient(users(['user-a', 'user-c']))
+
+    updated, failed = asyncio.run(index.update_users_async(cognito, subs, ATTRIBUTES, max_concurrency=2))
+
+    assert updated == ['user-a', 'user-c']
+    assert failed == ['missing-b', 'missing-d']
+    assert cognito.calls.count('AdminUpdateUserAttributes') == 4
+
+
+def test_partner_groups_get_their_tiers_limits(monkeypatch, tmp_path):
+    rules = tmp_path / 'domain-rules.json'
+    rules.write_text(json.dumps({'groups': {'PartnerTier1': {'tier': 'AmazonUsers'}}, 'rules': []}))
+    monkeypatch.setattr(index, 'domain_rules', index.DomainRuleLoader(
+        str(rules), 'DefaultUsers', fallback_rules=[], known_groups=index.GROUP_LIMITS
+    ))
+    cognito = StubAsyncCognitoClient({'user-a': {'attributes': {}, 'groups': ['DefaultUsers', 'PartnerTier1']}})
+    event = {
+        'detail': {
+            'eventName': 'AdminAddUserToGroup',
+            'requestParameters': {'userPoolId': index.USER_POOL_ID, 'groupName': 'PartnerTier1'},
+            'additionalEventData': {'sub': 'user-a'},
+        }
+    }
+
+    response = asyncio.run(index.handle_eventbridge_invocation_async(event, cognito))
+
+    assert response['statusCode'] == 200
+    assert cognito.users['user-a']['attributes'] == index.GROUP_LIMITS['AmazonUsers']
+
+
+class MemoryS3:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+    def get_object(self, Bucket, Key):
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Bucket, Prefix, Delimiter=None):
+        keys = [key for key in self.objects if key.startswith(Prefix)]
+        if Delimiter:
+            keys = [key for key in keys if Delimiter not in key[len(Prefix):]]
+        yield {'Contents': [{'Key': key} for key in sorted(keys)]}
+
+
+class RecordingLambda:
+    def __init__(self):
+        self.payloads = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        self.payloads.append(Payload)
+
+
+class ShortContext:
+    """
+    Has time for 'users' users per invocation.
+    """
+    invoked_function_arn = 'arn:aws:lambda:us-east-1:123456789012:function:UpdateAttributesGroups'
+
+    def __init__(self, users):
+        self.remaining = users
+
+    def get_remaining_time_in_millis(self):
+        self.remaining -= 1
+        return 10 ** 6 if self.remaining > 0 else 0
+
+
+def run_shard_worker_until_done(monkeypatch, subs, failing, users_per_invocation):
+    s3 = MemoryS3()
+    lambda_client = RecordingLambda()
+    listings = []
+    monkeypatch.setattr(index, 's3_client', s3)
+    monkeypatch.setattr(index, 'lambda_client', lambda_client)
+    monkeypatch.setattr(index, 'RESULTS_BUCKET', 'results')
+    monkeypatch.setattr(index, 'get_users_by_sub_prefix_with_retry', lambda prefix: listings.append(prefix) or subs)
+    monkeypatch.setattr(index, 'get_user_groups_with_retry', lambda sub: ['DefaultUsers'])
+    monkeypatch.setattr(index, 'update_user_attributes_with_retry', lambda sub, attributes: sub not in failing)
+
+    event = {'mode': 'shard_worker', 'job_id': 'job-1',
+             'shard': {'shard_id': 3, 'strategy': 'sub_prefix', 'prefix': 'a'}}
+    while True:
+        response = index.handle_orchestration_invocation(event, ShortContext(users_per_invocation))
+        if response['statusCode'] != 202:
+            return response, s3, lambda_client.payloads, listings
+        event = json.loads(lambda_client.payloads[-1])
+
+
+def test_shard_continuations_carry_the_report_key_and_list_the_shard_once(monkeypatch):
+    subs = [f'a{i:03d}' for i in range(10)]
+    failing = {'a001', 'a004', 'a008'}
+
+    response, s3, payloads, listings = run_shard_worker_until_done(monkeypatch, subs, failing, 4)
+
+    assert len(payloads) == 2
+    assert listings == ['a']
+    for payload in map(json.loads, payloads):
+        assert 'failed_updates' not in payload['report']
+        assert payload['report']['partial_report_key'].startswith('jobs/update-attributes-groups/job-1/reports/partial/')
+        assert payload['shard']['export_location'].endswith('/job-1/exports/shard-00003.txt')
+        assert 'subs' not in payload['shard']
+    report = json.loads(response['body'])
+    assert report['total_users_processed'] == 10
+    assert report['successful_updates'] == 7
+    assert report['failed_updates'] == sorted(failing)
+    assert index.list_shard_report_keys('job-1') == ['jobs/update-attributes-groups/job-1/reports/shard-00003.json']
+
+
+def test_a_continuation_that_cannot_be_stored_keeps_its_range(monkeypatch):
+    subs = ['a000', 'a001', 'a002']
+    monkeypatch.setattr(index, 'RESULTS_BUCKET', None)
+    monkeypatch.setattr(index, 'get_users_by_sub_prefix_with_retry', lambda prefix: subs)
+    monkeypatch.setattr(index, 'get_user_groups_with_retry', lambda sub: ['DefaultUsers'])
+    monkeypatch.setattr(index, 'update_user_attributes_with_retry', lambda sub, attributes: True)
+    shard = {'shard_id': 0, 'strategy': 'sub_prefix', 'prefix': 'a'}
+
+    response = index.handle_orchestration_invocation({'mode': 'shard_worker', 'shard': shard}, ShortContext(2))
+
+    report = json.loads(response['body'])
+    assert report['total_users_processed'] == 2
+    assert report['continuation'] == dict(shard, start=2, end=3)
+    assert index.get_shard_user_subs(report['continuation']) == ['a002']
@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import OrderedDict
+
+import boto3
+from botocore.exceptions import ClientError
+
+STATUS_IN_PROGRESS = 'IN_PROGRESS'
+STATUS_COMPLETED = 'COMPLETED'
+
+# A claim left behind by a crashed invocation stops blocking retries after this long.
+IN_PROGRESS_TTL_SECONDS = 60
+
+
+# ---------------------------------------------------------------------
+#                      Local (in-process) Store
+# ---------------------------------------------------------------------
+class LocalIdempotencyStore:
+    """
+    Bounded, TTL-evicted store of idempotency keys kept in process memory.
+
+    Only duplicates that reach the same Lambda container are detected, so this is
+    meant for local runs and tests; deployed functions use DynamoDBIdempotencyStore.
+    """
+
+    def __init__(self, max_entries=1000, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.records = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _evict(self, now):
+        # Oldest records are at the front; expired claims further back are skipped by begin().
+        while self.records:
+            key, record = next(iter(self.records.items()))
+            if record['expires_at'] > now and len(self.records) <= self.max_entries:
+                break
+            self.records.pop(key)
+
+    def begin(self, key):
+        """
+        Claims 'key' for a new request. Returns None if the claim succeeded,
+        otherwise the existing record ({'status': ..., 'response': ...}).
+        """
+        with self.lock:
+            now = time.time()
+            self._evict(now)
+            record = self.records.pop(key, None)
+            if record is not None and record['expires_at'] > now:
+                self.records[key] = record
+                return {'status': record['status'], 'response': record['response']}
+            self.records[key] = {'status': STATUS_IN_PROGRESS, 'response': None, 'expires_at': now + IN_PROGRESS_TTL_SECONDS}
+            self._evict(now)
+            return None
+
+    def complete(self, key, response):
+        """
+        Stores the final response body (a string) for a claimed key.
+        """
+        with self.lock:
+            self.records[key] = {
+                'status': STATUS_COMPLETED,
+                'response': response,
+                'expires_at': time.time() + self.ttl_seconds
+            }
+            self.records.move_to_end(key)
+
+    def release(self, key):
+        """
+        Drops the claim on a key whose request failed, so that a retry can proceed.
+        """
+        with self.lock:
+            self.records.pop(key, None)
+
+
+# ---------------------------------------------------------------------
+#                          DynamoDB Store
+# ---------------------------------------------------------------------
+class DynamoDBIdempotencyStore:
+    """
+    Idempotency store backed by a DynamoDB table with partition key 'idempotency_key'.
+    Records carry an 'expires_at' epoch attribute for the table's TTL eviction.
+    """
+
+    def __init__(self, table_name, ttl_seconds=3600):
+        self.table = boto3.resource('dynamodb').Table(table_name)
+        self.ttl_seconds = ttl_seconds
+
+    def begin(self, key):
+        now = int(time.time())
+        try:
+            # Expired records may linger until DynamoDB's TTL sweep, so they can be reclaimed.
+            self.table.put_item(
+                Item={'idempotency_key': key, 'status': STATUS_IN_PROGRESS, 'expires_at': now + IN_PROGRESS_TTL_SECONDS},
+                ConditionExpression='attribute_not_exists(idempotency_key) OR expires_at < :now',
+                ExpressionAttributeValues={':now': now}
+            )
+            return None
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+        item = self.table.get_item(Key={'idempotency_key': key}, ConsistentRead=True).get('Item', {})
+        return {'status': item.get('status', STATUS_IN_PROGRESS), 'response': item.get('response')}
+
+    def complete(self, key, response):
+        self.table.put_item(Item={
+            'idempotency_key': key,
+            'status': STATUS_COMPLETED,
+            'response': response,
+            'expires_at': int(time.time()) + self.ttl_seconds
+        })
+
+    def release(self, key):
+        self.table.delete_item(Key={'idempotency_key': key})
@@ -1,10 +1,51 @@
 import json
 import os
+import uuid
 import boto3
 
+from idempotency import STATUS_COMPLETED, DynamoDBIdempotencyStore, LocalIdempotencyStore
+from request_schema import UPLOAD_QUOTA_SCHEMA, format_errors
+from upload_index import DynamoDBUploadIndex, SQLiteUploadIndex, parse_upload_key, upload_owner_for_email
+from usage_counters import DynamoDBUsageCounterStore, LocalUsageCounterStore
+
 # Initialize Cognito client
 cognito_client = boto3.client('cognito-idp')
 
+# Completed 'increment' requests by idempotency key. Without a table, duplicates
+# are only recognised when they reach the same Lambda container.
+IDEMPOTENCY_TABLE = os.environ.get("IDEMPOTENCY_TABLE")
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "3600"))
+
+if IDEMPOTENCY_TABLE:
+    idempotency_store = DynamoDBIdempotencyStore(IDEMPOTENCY_TABLE, ttl_seconds=IDEMPOTENCY_TTL_SECONDS)
+else:
+    idempotency_store = LocalIdempotencyStore(ttl_seconds=IDEMPOTENCY_TTL_SECONDS)
+
+# 'cognito' stores the usage count in custom:total_files_uploaded on every increment.
+# 'write_behind' keeps the authoritative count in USAGE_COUNTER_TABLE; the
+# syncUsageCounters job copies it to the Cognito attribute in batches.
+# 'object_arrival' charges uploads when processUploadEvents indexes them in
+# UPLOAD_INDEX_TABLE as they arrive in S3; an increment reserves a slot in the
+# index until its object arrives (or the reservation expires).
+# In every mode, an increment whose idempotencyKey is the user's upload key claims
+# that key in the index, so the upload is indexed under the user's sub rather
+# than the email prefix that other addresses can share.
+USAGE_COUNTER_MODE = os.environ.get("USAGE_COUNTER_MODE", "cognito")  # 'cognito' | 'write_behind' | 'object_arrival'
+USAGE_COUNTER_TABLE = os.environ.get("USAGE_COUNTER_TABLE")
+UPLOAD_INDEX_TABLE = os.environ.get("UPLOAD_INDEX_TABLE")
+UPLOAD_INDEX_DB = os.environ.get("UPLOAD_INDEX_DB", ":memory:")  # SQLite stand-in when no table is set
+
+if USAGE_COUNTER_TABLE:
+    usage_store = DynamoDBUsageCounterStore(USAGE_COUNTER_TABLE)
+else:
+    usage_store = LocalUsageCounterStore()
+
+if UPLOAD_INDEX_TABLE:
+    upload_index = DynamoDBUploadIndex(UPLOAD_INDEX_TABLE)
+else:
+    upload_index = SQLiteUploadIndex(UPLOAD_INDEX_DB)
+
+
 def handler(event, context):
     """
     AWS Lambda handler to either:
@@ -14,9 +55,22 @@ def handler(event, context):
     Expects a POST request with a JSON body containing:
     {
       "sub": "<User's unique Cognito identifier>",
-      "mode": "check" or "increment"
+      "mode": "check" or "increment",
+      "idempotencyKey": "<optional, e.g. the S3 key of the upload>"
     }
 
+    A retried 'increment' with an idempotencyKey that already succeeded returns
+    the original result without charging the user again.
+
+    With USAGE_COUNTER_MODE='write_behind', usage is read from and incremented in
+    the usage counter store instead of Cognito; limits are still read from Cognito.
+    With USAGE_COUNTER_MODE='object_arrival', usage is the number of the user's
+    uploads in the upload index plus the uploads reserved but not yet arrived, and
+    'increment' reserves one.
+
+    An 'increment' whose idempotencyKey is an upload key under the user's email
+    prefix claims the key for the user's sub; 403 if another user claimed it.
+
     Returns:
       {
         "currentUsage": <int>,        # Always returned for mode='check'
@@ -27,6 +81,7 @@ def handler(event, context):
       }
       or an error message, e.g., 403 if limit reached.
     """
+    idempotency_record_key = None
     try:
         print("Received event:", json.dumps(event))
 
@@ -71,23 +126,10 @@ def handler(event, context):
                 "body": json.dumps({"message": "Invalid JSON in request body."}),
             }
 
-        # Extract required fields
-        user_sub = body.get("sub")
-        mode = body.get("mode")
-
-        if not user_sub:
-            print("Missing required field: sub")
-            return {
-                "statusCode": 400,
-                "headers": {
-                    "Access-Control-Allow-Origin": "*",
-                    "Access-Control-Allow-Methods": "POST,OPTIONS",
-                    "Access-Control-Allow-Headers": "Content-Type,Authorization",
-                },
-                "body": json.dumps({"message": "Missing required field: sub"}),
-            }
-        if not mode or mode not in ["check", "increment"]:
-            print("Missing or invalid mode. Must be 'check' or 'increment'.")
+        # Validate the fields locally with the shared request schema
+        fields, errors = UPLOAD_QUOTA_SCHEMA.validate(body)
+        if errors:
+            print("Invalid request fields:", errors)
             return {
                 "statusCode": 400,
                 "headers": {
@@ -95,9 +137,16 @@ def handler(event, context):
                     "Access-Control-Allow-Methods": "POST,OPTIONS",
                     "Access-Control-Allow-Headers": "Content-Type,Authorization",
                 },
-                "body": json.dumps({"message": "Missing or invalid mode. Use 'check' or 'increment'."}),
+                "body": json.dumps({
+                    "message": format_errors(errors),
+                    "errors": errors
+                }),
             }
 
+        user_sub = fields["sub"]
+        mode = fields["mode"]
+        idempotency_key = fields.get("idempotencyKey")
+
         # Retrieve User Pool ID from environment variables
         user_pool_id = os.environ.get("USER_POOL_ID")
         if not user_pool_id:
@@ -114,6 +163,34 @@ def handler(event, context):
 
         print("User Pool ID:", user_pool_id)
 
+        # 0) A retried increment replays the first result without reading or writing Cognito
+        if mode == "increment" and idempotency_key:
+            idempotency_record_key = f"{user_sub}#{idempotency_key}"
+            existing = idempotency_store.begin(idempotency_record_key)
+            if existing is not None:
+                idempotency_record_key = None  # Owned by the original request
+                if existing["status"] == STATUS_COMPLETED:
+                    print("Duplicate increment for idempotency key; returning cached result:", idempotency_key)
+                    return {
+                        "statusCode": 200,
+                        "headers": {
+                            "Access-Control-Allow-Origin": "*",
+                            "Access-Control-Allow-Methods": "POST,OPTIONS",
+                            "Access-Control-Allow-Headers": "Content-Type,Authorization",
+                        },
+                        "body": existing["response"],
+                    }
+                print("Increment with this idempotency key is still in progress:", idempotency_key)
+                return {
+                    "statusCode": 409,
+                    "headers": {
+                        "Access-Control-Allow-Origin": "*",
+                        "Access-Control-Allow-Methods": "POST,OPTIONS",
+                        "Access-Control-Allow-Headers": "Content-Type,Authorization",
+                    },
+                    "body": json.dumps({"message": "A request with this idempotency key is already in progress."}),
+                }
+
         # 1) Fetch existing user to read current attributes
         try:
             response = cognito_client.admin_get_user(
@@ -122,6 +199,7 @@ def handler(event, context):
             )
         except cognito_client.exceptions.UserNotFoundException:
             print("User not found in Cognito:", user_sub)
+            release_idempotency_key(idempotency_record_key)
             return {
                 "statusCode": 404,
                 "headers": {
@@ -133,6 +211,7 @@ def handler(event, context):
             }
         except Exception as e:
             print("Error fetching user from Cognito:", str(e))
+            release_idempotency_key(idempotency_record_key)
             return {
                 "statusCode": 500,
                 "headers": {
@@ -170,6 +249,17 @@ def handler(event, context):
         except ValueError:
             max_size_allowed_mb = 25  # Default value
 
+        # The counter store is ahead of the lazily synced Cognito attribute
+        cognito_count = current_count
+        if USAGE_COUNTER_MODE == "write_behind":
+            stored_count = usage_store.get(user_sub)
+            if stored_count is not None:
+                current_count = stored_count
+        elif USAGE_COUNTER_MODE == "object_arrival":
+            # Uploads from before the index existed are only counted in Cognito
+            indexed_count, reserved_count = upload_index.usage(user_sub)
+            current_count = max(current_count, indexed_count) + reserved_count
+
         print(f"Mode: {mode}, Current Usage: {current_count}, Max Files: {max_files_allowed}, Max Pages: {max_pages_allowed}, Max Size: {max_size_allowed_mb} MB")
 
         # If mode == check, return current usage and limits
@@ -194,6 +284,7 @@ def handler(event, context):
             # 3) Check if user is already at or above limit
             if current_count >= max_files_allowed:
                 print(f"User has already reached the {max_files_allowed} PDF upload limit.")
+                release_idempotency_key(idempotency_record_key)
                 return {
                     "statusCode": 403,
                     "headers": {
@@ -206,34 +297,118 @@ def handler(event, context):
                     }),
                 }
 
-            # 4) If they have not reached the limit, increment usage
-            new_count = current_count + 1
-
-            try:
-                cognito_client.admin_update_user_attributes(
-                    UserPoolId=user_pool_id,
-                    Username=user_sub,
-                    UserAttributes=[
-                        {
-                            "Name": "custom:total_files_uploaded",
-                            "Value": str(new_count)
-                        }
-                    ]
-                )
-                print(f"Successfully updated 'custom:total_files_uploaded' to {new_count} for user {user_sub}.")
-            except Exception as e:
-                print("Error updating user attribute in Cognito:", str(e))
-                return {
-                    "statusCode": 500,
-                    "headers": {
-                        "Access-Control-Allow-Origin": "*",
-                        "Access-Control-Allow-Methods": "POST,OPTIONS",
-                        "Access-Control-Allow-Headers": "Content-Type,Authorization",
-                    },
-                    "body": json.dumps({"message": "Failed to update user attribute."}),
-                }
+            # 4) Claim the upload key, so processUploadEvents indexes the object under this user
+            upload = parse_upload_key(idempotency_key) if idempotency_key else None
+            if upload and upload["owner"] == upload_owner_for_email(user_attributes.get("email")):
+                try:
+                    claimed = upload_index.claim_upload(idempotency_key, user_sub)
+                except Exception as e:
+                    print("Error claiming upload key:", str(e))
+                    release_idempotency_key(idempotency_record_key)
+                    return {
+                        "statusCode": 500,
+                        "headers": {
+                            "Access-Control-Allow-Origin": "*",
+                            "Access-Control-Allow-Methods": "POST,OPTIONS",
+                            "Access-Control-Allow-Headers": "Content-Type,Authorization",
+                        },
+                        "body": json.dumps({"message": "Failed to claim the upload key."}),
+                    }
+                if not claimed:
+                    print("Upload key is claimed by another user:", idempotency_key)
+                    release_idempotency_key(idempotency_record_key)
+                    return {
+                        "statusCode": 403,
+                        "headers": {
+                            "Access-Control-Allow-Origin": "*",
+                            "Access-Control-Allow-Methods": "POST,OPTIONS",
+                            "Access-Control-Allow-Headers": "Content-Type,Authorization",
+                        },
+                        "body": json.dumps({"message": "This upload key belongs to another user."}),
+                    }
+
+            # 5) If they have not reached the limit, increment usage
+            if USAGE_COUNTER_MODE in ("write_behind", "object_arrival"):
+                try:
+                    if USAGE_COUNTER_MODE == "write_behind":
+                        new_count = usage_store.increment(user_sub, limit=max_files_allowed, seed=cognito_count)
+                    else:
+                        # Charged by processUploadEvents when the object arrives in S3
+                        new_count = upload_index.reserve(
+                            user_sub, idempotency_key or f"#request#{uuid.uuid4().hex}",
+                            limit=max_files_allowed, floor=cognito_count
+                        )
+                except Exception as e:
+                    print("Error incrementing usage counter:", str(e))
+                    release_idempotency_key(idempotency_record_key)
+                    return {
+                        "statusCode": 500,
+                        "headers": {
+                            "Access-Control-Allow-Origin": "*",
+                            "Access-Control-Allow-Methods": "POST,OPTIONS",
+                            "Access-Control-Allow-Headers": "Content-Type,Authorization",
+                        },
+                        "body": json.dumps({"message": "Failed to update usage counter."}),
+                    }
+                if new_count is None:
+                    # A concurrent increment reached the limit first
+                    print(f"User has already reached the {max_files_allowed} PDF upload limit.")
+                    release_idempotency_key(idempotency_record_key)
+                    return {
+                        "statusCode": 403,
+                        "headers": {
+                            "Access-Control-Allow-Origin": "*",
+                            "Access-Control-Allow-Methods": "POST,OPTIONS",
+                            "Access-Control-Allow-Headers": "Content-Type,Authorization",
+                        },
+                        "body": json.dumps({
+                            "message": f"You have already reached the limit of {max_files_allowed} PDF uploads."
+                        }),
+                    }
+                print(f"Incremented usage to {new_count} for user {user_sub} without a Cognito write ({USAGE_COUNTER_MODE}).")
+            else:
+                new_count = current_count + 1
 
-            # 5) Return success with the new usage count and limits
+                try:
+                    cognito_client.admin_update_user_attributes(
+                        UserPoolId=user_pool_id,
+                        Username=user_sub,
+                        UserAttributes=[
+                            {
+                                "Name": "custom:total_files_uploaded",
+                                "Value": str(new_count)
+                            }
+                        ]
+                    )
+                    print(f"Successfully updated 'custom:total_files_uploaded' to {new_count} for user {user_sub}.")
+                except Exception as e:
+                    print("Error updating user attribute in Cognito:", str(e))
+                    release_idempotency_key(idempotency_record_key)
+                    return {
+                        "statusCode": 500,
+                        "headers": {
+                            "Access-Control-Allow-Origin": "*",
+                            "Access-Control-Allow-Methods": "POST,OPTIONS",
+                            "Access-Control-Allow-Headers": "Content-Type,Authorization",
+                        },
+                        "body": json.dumps({"message": "Failed to update user attribute."}),
+                    }
+
+            # 6) Return success with the new usage count and limits
+            response_body = json.dumps({
+                "message": f"Upload allowed. New count = {new_count}.",
+                "newCount": new_count,
+                "currentUsage": new_count,
+                "maxFilesAllowed": max_files_allowed,
+                "maxPagesAllowed": max_pages_allowed,
+                "maxSizeAllowedMB": max_size_allowed_mb
+            })
+            if idempotency_record_key:
+                try:
+                    idempotency_store.complete(idempotency_record_key, response_body)
+                except Exception as e:
+                    # The user has been charged already; only retry protection is lost.
+                    print("Error recording idempotency key:", str(e))
             return {
                 "statusCode": 200,
                 "headers": {
@@ -241,19 +416,13 @@ def handler(event, context):
                     "Access-Control-Allow-Methods": "POST,OPTIONS",
                     "Access-Control-Allow-Headers": "Content-Type,Authorization",
                 },
-                "body": json.dumps({
-                    "message": f"Upload allowed. New count = {new_count}.",
-                    "newCount": new_count,
-                    "currentUsage": new_count,
-                    "maxFilesAllowed": max_files_allowed,
-                    "maxPagesAllowed": max_pages_allowed,
-                    "maxSizeAllowedMB": max_size_allowed_mb
-                }),
+                "body": response_body,
             }
 
     except Exception as e:
         # Catch any unexpected errors
         print("Unhandled exception:", str(e))
+        release_idempotency_key(idempotency_record_key)
         return {
             "statusCode": 500,
             "headers": {
@@ -263,3 +432,16 @@ def handler(event, context):
             },
             "body": json.dumps({"message": "Internal server error."}),
         }
+
+
+def release_idempotency_key(record_key):
+    """
+    Frees a claimed idempotency key after a failed increment, so that a retry is not
+    rejected as a duplicate. Does nothing if no key was claimed.
+    """
+    if not record_key:
+        return
+    try:
+        idempotency_store.release(record_key)
+    except Exception as e:
+        print("Error releasing idempotency key:", str(e))
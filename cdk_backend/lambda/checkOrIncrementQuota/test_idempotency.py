@@ -0,0 +1,202 @@
+import importlib.util
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+from botocore.exceptions import ClientError
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..', 'shared', 'python'))
+sys.path.insert(0, os.path.join(HERE, '..', '..', 'tools'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import idempotency  # noqa: E402
+from idempotency import (  # noqa: E402
+    STATUS_COMPLETED, STATUS_IN_PROGRESS, DynamoDBIdempotencyStore, LocalIdempotencyStore
+)
+from local_cognito import LocalCognitoClient  # noqa: E402
+from usage_counters import LocalUsageCounterStore  # noqa: E402
+
+# Every Lambda's handler module is named 'index', so load this one under its own name
+_spec = importlib.util.spec_from_file_location('check_or_increment_quota_index', os.path.join(HERE, 'index.py'))
+index = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(index)
+
+SUB = '0f8fad5b-d9cb-469f-a165-70867728950e'
+KEY = 'pdf/someone_example_com_20250101123045123_report.pdf'
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(idempotency, 'time', clock)
+    return clock
+
+
+# ---------------------------------------------------------------------
+#                               Stores
+# ---------------------------------------------------------------------
+def test_local_store_evicts_the_oldest_records_beyond_max_entries(clock):
+    store = LocalIdempotencyStore(max_entries=2)
+    for key in ('a', 'b', 'c'):
+        assert store.begin(key) is None
+
+    assert list(store.records) == ['b', 'c']
+    assert store.begin('a') is None
+
+
+def test_local_store_evicts_expired_records(clock):
+    store = LocalIdempotencyStore(ttl_seconds=10)
+    store.begin('a')
+    store.complete('a', 'body')
+    assert store.begin('a') == {'status': STATUS_COMPLETED, 'response': 'body'}
+
+    clock.now += 11
+    store._evict(clock.now)
+
+    assert 'a' not in store.records
+    assert store.begin('a') is None
+
+
+def test_local_store_reclaims_an_abandoned_claim(clock):
+    store = LocalIdempotencyStore()
+    store.begin('a')
+    assert store.begin('a') == {'status': STATUS_IN_PROGRESS, 'response': None}
+
+    clock.now += idempotency.IN_PROGRESS_TTL_SECONDS + 1
+
+    assert store.begin('a') is None
+
+
+class ConditionalTable:
+    """
+    Stands in for the boto3 Table, applying the store's put condition:
+    the key must be new or its record expired before ':now'.
+    """
+
+    def __init__(self):
+        self.items = {}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeValues=None):
+        existing = self.items.get(Item['idempotency_key'])
+        if ConditionExpression and existing and existing['expires_at'] >= ExpressionAttributeValues[':now']:
+            raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem')
+        self.items[Item['idempotency_key']] = Item
+
+    def get_item(self, Key, ConsistentRead=False):
+        item = self.items.get(Key['idempotency_key'])
+        return {'Item': item} if item else {}
+
+    def delete_item(self, Key):
+        self.items.pop(Key['idempotency_key'], None)
+
+
+@pytest.fixture
+def table(monkeypatch):
+    table = ConditionalTable()
+    monkeypatch.setattr(idempotency, 'boto3', SimpleNamespace(resource=lambda service: SimpleNamespace(
+        Table=lambda name: table
+    )))
+    return table
+
+
+def test_dynamodb_store_reclaims_an_expired_record(table, clock):
+    store = DynamoDBIdempotencyStore('Idempotency', ttl_seconds=10)
+    assert store.begin('a') is None
+    store.complete('a', 'body')
+    assert store.begin('a') == {'status': STATUS_COMPLETED, 'response': 'body'}
+
+    # DynamoDB's TTL sweep has not removed the record yet
+    clock.now += 11
+
+    assert store.begin('a') is None
+    assert table.items['a']['status'] == STATUS_IN_PROGRESS
+
+
+def test_dynamodb_store_release_frees_the_key(table, clock):
+    store = DynamoDBIdempotencyStore('Idempotency')
+    store.begin('a')
+    assert store.begin('a') == {'status': STATUS_IN_PROGRESS, 'response': None}
+
+    store.release('a')
+
+    assert store.begin('a') is None
+
+
+# ---------------------------------------------------------------------
+#                        Handler Duplicates
+# ---------------------------------------------------------------------
+@pytest.fixture
+def cognito(monkeypatch):
+    monkeypatch.setenv('USER_POOL_ID', 'us-east-1_test')
+    client = LocalCognitoClient({SUB: {'attributes': {
+        'email': 'someone@example.com', 'custom:total_files_uploaded': '0', 'custom:max_files_allowed': '3'
+    }}})
+    monkeypatch.setattr(index, 'cognito_client', client)
+    monkeypatch.setattr(index, 'idempotency_store', LocalIdempotencyStore())
+    return client
+
+
+def increment(key=KEY):
+    response = index.handler({
+        'httpMethod': 'POST',
+        'resource': '/upload-quota',
+        'body': json.dumps({'sub': SUB, 'mode': 'increment', 'idempotencyKey': key}),
+    }, None)
+    return response['statusCode'], response['body']
+
+
+def test_completed_duplicate_replays_the_first_response(cognito):
+    first = increment()
+    calls = dict(cognito.calls)
+
+    assert increment() == first
+    assert first[0] == 200
+    assert cognito.calls == calls
+    assert cognito.users[SUB]['attributes']['custom:total_files_uploaded'] == '1'
+
+
+def test_completed_duplicate_makes_no_counter_write(monkeypatch, cognito):
+    monkeypatch.setattr(index, 'USAGE_COUNTER_MODE', 'write_behind')
+    monkeypatch.setattr(index, 'usage_store', LocalUsageCounterStore())
+
+    first = increment()
+    assert increment() == first
+    assert index.usage_store.get(SUB) == 1
+    assert 'AdminUpdateUserAttributes' not in cognito.calls
+
+
+def test_in_progress_duplicate_is_rejected(cognito):
+    index.idempotency_store.begin(f'{SUB}#{KEY}')
+
+    status, _ = increment()
+
+    assert status == 409
+    assert cognito.calls == {}
+
+
+def test_a_failed_increment_releases_its_key(monkeypatch, cognito):
+    update = cognito.admin_update_user_attributes
+
+    def fail(**kwargs):
+        raise ClientError({'Error': {'Code': 'InternalErrorException'}}, 'AdminUpdateUserAttributes')
+
+    monkeypatch.setattr(cognito, 'admin_update_user_attributes', fail)
+    assert increment()[0] == 500
+
+    monkeypatch.setattr(cognito, 'admin_update_user_attributes', update)
+    status, body = increment()
+
+    assert status == 200
+    assert json.loads(body)['newCount'] == 1
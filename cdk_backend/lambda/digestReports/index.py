@@ -0,0 +1,165 @@
+import json
+import re
+import time
+from urllib.parse import unquote_plus
+
+import boto3
+from botocore.exceptions import ClientError
+
+from report_digest import compare_digests, digest_report, rule_entry, rule_keys
+
+s3_client = boto3.client('s3')
+
+# Report keys written by the remediation pipeline (the misspellings are theirs):
+#   temp/{name}/accessability-report/{name}_accessibility_report_before_remidiation.json
+#   temp/{name}/accessability-report/COMPLIANT_{name}_accessibility_report_after_remidiation.json
+REPORT_KEY_PATTERN = re.compile(
+    r'^temp/(?P<name>[^/]+)/accessability-report/(?:COMPLIANT_)?(?P=name)'
+    r'_accessibility_report_(?P<phase>before|after)_remidiation\.json$'
+)
+
+SUMMARY_SUFFIX = '_summary.json'
+COMPARISON_SUFFIX = '_accessibility_report_comparison.json'
+# A summary is rewritten if its report is replaced, and a comparison when either
+# report lands, so clients revalidate with the ETag rather than caching blindly.
+CACHE_CONTROL = 'no-cache'
+
+METRICS_NAMESPACE = 'PDFAccessibility/ReportDigests'
+
+
+def handler(event, context):
+    """
+    Summarises accessibility reports as they land in S3.
+
+    For each before/after report, writes '<report key without .json>_summary.json'
+    next to it with per-rule and per-category status counts. Once both summaries
+    of a document exist, also writes '{name}_accessibility_report_comparison.json'
+    with the before/after delta, so the UI can fetch a few KB instead of the raw
+    reports.
+
+    Accepts EventBridge 'Object Created' events or S3 event notifications.
+    """
+    digested = []
+    for bucket, key in extract_created_objects(event):
+        match = REPORT_KEY_PATTERN.match(key)
+        if not match:
+            print(f'Skipping object that is not an accessibility report: {key}')
+            continue
+
+        started_at = time.perf_counter()
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        digest = digest_report(response['Body'])
+        digest['source'] = {'key': key, 'etag': response.get('ETag')}
+        put_json(bucket, summary_key(key), digest)
+
+        comparison = write_comparison(bucket, match.group('name'), match.group('phase'), digest)
+        emit_metrics(match.group('phase'), response.get('ContentLength', 0),
+                     round((time.perf_counter() - started_at) * 1000, 2))
+        digested.append({'key': key, 'summaryKey': summary_key(key), 'comparisonKey': comparison})
+
+    return {'digested': digested}
+
+
+def report_keys(name):
+    """
+    Returns the (before, after) report keys of a document.
+    """
+    prefix = f'temp/{name}/accessability-report/'
+    return (
+        f'{prefix}{name}_accessibility_report_before_remidiation.json',
+        f'{prefix}COMPLIANT_{name}_accessibility_report_after_remidiation.json',
+    )
+
+
+def summary_key(report_key):
+    return report_key[:-len('.json')] + SUMMARY_SUFFIX
+
+
+def comparison_key(name):
+    return f'temp/{name}/accessability-report/{name}{COMPARISON_SUFFIX}'
+
+
+def write_comparison(bucket, name, phase, digest):
+    """
+    Writes the before/after comparison if the other report's summary exists.
+    Returns the comparison key, or None if the other report has not been digested yet.
+    """
+    before_key, after_key = report_keys(name)
+    other_key = summary_key(after_key if phase == 'before' else before_key)
+    # A listing is allowed under temp/ only; a GetObject of a missing key would be denied
+    listing = s3_client.list_objects_v2(Bucket=bucket, Prefix=other_key, MaxKeys=1)
+    if not any(obj['Key'] == other_key for obj in listing.get('Contents', [])):
+        return None
+    try:
+        other = json.loads(s3_client.get_object(Bucket=bucket, Key=other_key)['Body'].read())
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+
+    before, after = (digest, other) if phase == 'before' else (other, digest)
+    rules = {}
+    for category, rule in rule_keys(before, after):
+        before_entry = rule_entry(before, category, rule) or {}
+        after_entry = rule_entry(after, category, rule) or {}
+        rules.setdefault(category, {})[rule] = {
+            'description': after_entry.get('description', before_entry.get('description')),
+            'before': before_entry.get('status'),
+            'after': after_entry.get('status'),
+        }
+    comparison = {
+        'before': {'summary': before['summary'], 'totals': before['totals'], 'source': before.get('source')},
+        'after': {'summary': after['summary'], 'totals': after['totals'], 'source': after.get('source')},
+        'delta': compare_digests(before, after),
+        # {category: {rule: {"description", "before", "after"}}}
+        'rules': rules,
+    }
+    key = comparison_key(name)
+    put_json(bucket, key, comparison)
+    return key
+
+
+def put_json(bucket, key, document):
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=json.dumps(document, separators=(',', ':')).encode('utf-8'),
+        ContentType='application/json',
+        CacheControl=CACHE_CONTROL
+    )
+
+
+def extract_created_objects(event):
+    """
+    Yields (bucket, key) for each created object in an EventBridge event or an S3
+    event notification. S3 notification keys are URL-encoded and are decoded here.
+    """
+    if 'detail' in event:
+        yield event['detail']['bucket']['name'], event['detail']['object']['key']
+        return
+
+    for record in event.get('Records', []):
+        if record.get('eventName', '').startswith('ObjectCreated:'):
+            yield record['s3']['bucket']['name'], unquote_plus(record['s3']['object']['key'])
+
+
+def emit_metrics(phase, report_bytes, duration_ms):
+    """
+    Logs the report size and digest time in CloudWatch Embedded Metric Format.
+    """
+    print(json.dumps({
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [['Phase']],
+                'Metrics': [
+                    {'Name': 'ReportBytes', 'Unit': 'Bytes'},
+                    {'Name': 'DigestTime', 'Unit': 'Milliseconds'},
+                ]
+            }]
+        },
+        'Phase': phase,
+        'ReportBytes': report_bytes,
+        'DigestTime': duration_ms
+    }))
@@ -0,0 +1,213 @@
+import json
+import re
+
+# Bytes read from the report stream at a time
+CHUNK_SIZE = 64 * 1024
+
+_NON_WHITESPACE = re.compile(r'[^ \t\n\r]')
+
+
+# ---------------------------------------------------------------------
+#                      Incremental JSON Reading
+# ---------------------------------------------------------------------
+class StreamReader:
+    """
+    Reads JSON from a binary stream, holding only the value being decoded in memory.
+    The caller walks the containers it cares about with expect()/next_member() and
+    decodes the small values inside them with read_value().
+    """
+
+    def __init__(self, stream, chunk_size=CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+        # Chunks can split a multi-byte character, so decode incrementally
+        self.pending_bytes = b''
+
+    def _fill(self):
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            if self.pending_bytes:
+                raise ValueError('Report ends in the middle of a character')
+            return False
+        data = self.pending_bytes + chunk
+        try:
+            text = data.decode('utf-8')
+            self.pending_bytes = b''
+        except UnicodeDecodeError as e:
+            if e.start < len(data) - 3:
+                raise
+            text = data[:e.start].decode('utf-8')
+            self.pending_bytes = data[e.start:]
+        # Drop what has been consumed so the buffer stays small
+        self.buffer = self.buffer[self.position:] + text
+        self.position = 0
+        return True
+
+    def peek(self):
+        """
+        Returns the next non-whitespace character without consuming it, or '' at the end.
+        """
+        while True:
+            match = _NON_WHITESPACE.search(self.buffer, self.position)
+            if match:
+                self.position = match.start()
+                return self.buffer[self.position]
+            self.position = len(self.buffer)
+            if not self._fill():
+                return ''
+
+    def expect(self, character):
+        found = self.peek()
+        if found != character:
+            raise ValueError(f"Expected '{character}' in report, found '{found or 'end of file'}'")
+        self.position += 1
+
+    def read_value(self):
+        """
+        Decodes the next complete JSON value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and not self.eof and self._fill():
+                continue
+            self.position = end
+            return value
+
+    def next_member(self, closing):
+        """
+        Steps to the next member of the open object or array. Returns False, having
+        consumed 'closing', when there are no more members.
+        """
+        character = self.peek()
+        if character == closing:
+            self.position += 1
+            return False
+        if character == ',':
+            self.position += 1
+        return True
+
+    def skip_value(self):
+        self.read_value()
+
+
+# ---------------------------------------------------------------------
+#                            Digesting
+# ---------------------------------------------------------------------
+def digest_report(stream, chunk_size=CHUNK_SIZE):
+    """
+    Streams an accessibility checker report and returns its compact summary:
+        {"summary":    the report's 'Summary' object,
+         "totals":     {status: count} over all rules,
+         "categories": {category: {status: count}},
+         "rules":      {category: {rule: {"description", "status", "counts": {status: count}}}}}
+    Rules are kept per category, as the same rule name can appear in more than one.
+    Only one rule entry of the report is held in memory at a time.
+    """
+    reader = StreamReader(stream, chunk_size)
+    digest = {'summary': None, 'totals': {}, 'categories': {}, 'rules': {}}
+
+    reader.expect('{')
+    while reader.next_member('}'):
+        key = reader.read_value()
+        reader.expect(':')
+        if key == 'Detailed Report':
+            _digest_detailed_report(reader, digest)
+        elif key == 'Summary':
+            digest['summary'] = reader.read_value()
+        else:
+            reader.skip_value()
+    return digest
+
+
+def _digest_detailed_report(reader, digest):
+    reader.expect('{')
+    while reader.next_member('}'):
+        category = reader.read_value()
+        reader.expect(':')
+        category_counts = digest['categories'].setdefault(category, {})
+        category_rules = digest['rules'].setdefault(category, {})
+        reader.expect('[')
+        while reader.next_member(']'):
+            item = reader.read_value()
+            if not isinstance(item, dict):
+                continue
+            status = item.get('Status') or 'Unknown'
+            rule = category_rules.setdefault(item.get('Rule') or 'Unknown', {
+                'description': item.get('Description'),
+                'status': status,
+                'counts': {},
+            })
+            # A rule listed more than once reports its worst status
+            if status == 'Failed' or (status != 'Passed' and rule['status'] == 'Passed'):
+                rule['status'] = status
+            _count(rule['counts'], status)
+            _count(category_counts, status)
+            _count(digest['totals'], status)
+
+
+def _count(counts, status):
+    counts[status] = counts.get(status, 0) + 1
+
+
+def rule_keys(*digests):
+    """
+    Returns the (category, rule) pairs of the digests, in the order they first appear.
+    """
+    keys = {}
+    for digest in digests:
+        for category, rules in digest['rules'].items():
+            for rule in rules:
+                keys[(category, rule)] = None
+    return list(keys)
+
+
+def rule_entry(digest, category, rule):
+    """
+    Returns the digest's entry for a rule in a category, or None if it has none.
+    """
+    return digest['rules'].get(category, {}).get(rule)
+
+
+def compare_digests(before, after):
+    """
+    Returns the before/after delta of two digests: the change in each status count,
+    and the rules whose status changed, grouped as fixed, regressed or other.
+    """
+    statuses = set(before['totals']) | set(after['totals'])
+    changes = {'fixed': [], 'regressed': [], 'changed': []}
+    for category, rule in sorted(rule_keys(before, after)):
+        before_status = (rule_entry(before, category, rule) or {}).get('status')
+        after_status = (rule_entry(after, category, rule) or {}).get('status')
+        if before_status == after_status:
+            continue
+        change = {'category': category, 'rule': rule, 'before': before_status, 'after': after_status}
+        if after_status == 'Passed':
+            changes['fixed'].append(change)
+        elif after_status == 'Failed':
+            changes['regressed'].append(change)
+        else:
+            changes['changed'].append(change)
+
+    return {
+        'totals': {
+            status: {
+                'before': before['totals'].get(status, 0),
+                'after': after['totals'].get(status, 0),
+                'delta': after['totals'].get(status, 0) - before['totals'].get(status, 0),
+            }
+            for status in sorted(statuses)
+        },
+        **changes,
+    }
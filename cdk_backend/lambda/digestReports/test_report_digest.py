@@ -0,0 +1,158 @@
+import importlib.util
+import io
+import json
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+from report_digest import StreamReader, compare_digests, digest_report  # noqa: E402
+
+# Every Lambda's handler module is named 'index', so load this one under its own name
+_spec = importlib.util.spec_from_file_location('digest_reports_index', os.path.join(HERE, 'index.py'))
+index = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(index)
+
+CHUNK_SIZES = [1, 2, 3, 7, 64 * 1024]
+
+
+def report(detailed, summary=None):
+    return {
+        'Summary': summary or {'Description': 'Résumé ✓ — 検査 🙂', 'Passed': 1, 'Failed': 1},
+        'Metadata': {'Pages': [1, 2.5, -3e2, None, True], 'Title': '“quoted” \\ "escaped"'},
+        'Detailed Report': detailed,
+    }
+
+
+def stream(document):
+    return io.BytesIO(json.dumps(document, ensure_ascii=False).encode('utf-8'))
+
+
+DETAILED = {
+    'Document': [
+        {'Rule': 'Title', 'Status': 'Passed', 'Description': 'Le titre du document ✓'},
+        {'Rule': 'Tagged content', 'Status': 'Failed', 'Description': 'すべての内容にタグ'},
+    ],
+    'Page Content': [
+        {'Rule': 'Tagged content', 'Status': 'Passed', 'Description': 'All page content is tagged'},
+        {'Rule': 'Tagged content', 'Status': 'Needs manual check', 'Description': 'All page content is tagged'},
+        'not a rule',
+    ],
+    'Forms': [],
+}
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_reader_decodes_the_same_values_at_any_chunk_size(chunk_size):
+    document = report(DETAILED)
+    reader = StreamReader(stream(document), chunk_size)
+
+    assert reader.read_value() == document
+    assert reader.peek() == ''
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_digest_is_the_same_at_any_chunk_size(chunk_size):
+    expected = digest_report(stream(report(DETAILED)))
+    assert digest_report(stream(report(DETAILED)), chunk_size) == expected
+
+
+def test_reader_rejects_a_truncated_character():
+    data = json.dumps({'Summary': 'é'}, ensure_ascii=False).encode('utf-8')
+    truncated = data[:data.index('é'.encode('utf-8')) + 1]
+
+    with pytest.raises(ValueError):
+        StreamReader(io.BytesIO(truncated), 2).read_value()
+
+
+def test_rules_are_kept_per_category():
+    digest = digest_report(stream(report(DETAILED)))
+
+    assert digest['rules']['Document']['Tagged content']['status'] == 'Failed'
+    assert digest['rules']['Page Content']['Tagged content'] == {
+        'description': 'All page content is tagged',
+        'status': 'Needs manual check',
+        'counts': {'Passed': 1, 'Needs manual check': 1},
+    }
+    assert digest['categories'] == {
+        'Document': {'Passed': 1, 'Failed': 1},
+        'Page Content': {'Passed': 1, 'Needs manual check': 1},
+        'Forms': {},
+    }
+    assert digest['totals'] == {'Passed': 2, 'Failed': 1, 'Needs manual check': 1}
+
+
+def test_compare_digests_tells_rules_apart_by_category():
+    before = digest_report(stream(report(DETAILED)))
+    after = digest_report(stream(report({
+        'Document': [
+            {'Rule': 'Title', 'Status': 'Passed', 'Description': 'Le titre du document ✓'},
+            {'Rule': 'Tagged content', 'Status': 'Passed', 'Description': 'すべての内容にタグ'},
+        ],
+        'Page Content': [
+            {'Rule': 'Tagged content', 'Status': 'Failed', 'Description': 'All page content is tagged'},
+        ],
+    })))
+
+    delta = compare_digests(before, after)
+
+    assert delta['fixed'] == [{'category': 'Document', 'rule': 'Tagged content', 'before': 'Failed', 'after': 'Passed'}]
+    assert delta['regressed'] == [
+        {'category': 'Page Content', 'rule': 'Tagged content', 'before': 'Needs manual check', 'after': 'Failed'}
+    ]
+    assert delta['totals']['Failed'] == {'before': 1, 'after': 1, 'delta': 0}
+
+
+class RecordingS3:
+    """
+    Keeps the objects written with put_object in memory, and lists them by prefix.
+    """
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = json.loads(Body)
+
+    def list_objects_v2(self, Bucket, Prefix, MaxKeys):
+        keys = sorted(key for key in self.objects if key.startswith(Prefix))[:MaxKeys]
+        return {'Contents': [{'Key': key} for key in keys]} if keys else {}
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise index.ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        return {'Body': io.BytesIO(json.dumps(self.objects[Key]).encode('utf-8'))}
+
+
+def test_comparison_keeps_both_categories_of_a_rule(monkeypatch):
+    s3 = RecordingS3()
+    monkeypatch.setattr(index, 's3_client', s3)
+    before = digest_report(stream(report(DETAILED)))
+    after = digest_report(stream(report({
+        'Page Content': [{'Rule': 'Tagged content', 'Status': 'Passed', 'Description': 'All page content is tagged'}],
+    })))
+    before_key, _ = index.report_keys('doc')
+    s3.objects[index.summary_key(before_key)] = before
+
+    key = index.write_comparison('bucket', 'doc', 'after', after)
+
+    assert key == index.comparison_key('doc')
+    rules = s3.objects[key]['rules']
+    assert rules['Document']['Tagged content'] == {
+        'description': 'すべての内容にタグ', 'before': 'Failed', 'after': None
+    }
+    assert rules['Page Content']['Tagged content'] == {
+        'description': 'All page content is tagged', 'before': 'Needs manual check', 'after': 'Passed'
+    }
+
+
+def test_no_comparison_until_both_summaries_exist(monkeypatch):
+    s3 = RecordingS3()
+    monkeypatch.setattr(index, 's3_client', s3)
+
+    assert index.write_comparison('bucket', 'doc', 'before', digest_report(stream(report(DETAILED)))) is None
+    assert s3.objects == {}
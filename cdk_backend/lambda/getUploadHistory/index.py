@@ -0,0 +1,178 @@
+import json
+import os
+import boto3
+
+from request_schema import UPLOAD_HISTORY_SCHEMA, format_errors
+from upload_index import (
+    DynamoDBUploadIndex, SQLiteUploadIndex, decode_cursor, encode_cursor,
+    format_upload_time, parse_upload_key
+)
+
+# Initialize Cognito client
+cognito_client = boto3.client('cognito-idp')
+
+UPLOAD_INDEX_TABLE = os.environ.get("UPLOAD_INDEX_TABLE")
+UPLOAD_INDEX_DB = os.environ.get("UPLOAD_INDEX_DB", ":memory:")  # SQLite stand-in when no table is set
+ADMIN_GROUP = os.environ.get("ADMIN_GROUP_NAME")
+DEFAULT_PAGE_SIZE = int(os.environ.get("DEFAULT_PAGE_SIZE", "20"))
+
+if UPLOAD_INDEX_TABLE:
+    upload_index = DynamoDBUploadIndex(UPLOAD_INDEX_TABLE)
+else:
+    upload_index = SQLiteUploadIndex(UPLOAD_INDEX_DB)
+
+HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "POST,OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type,Authorization",
+}
+
+
+def handler(event, context):
+    """
+    AWS Lambda handler returning one page of a user's uploads and results, newest
+    first, from the upload index maintained by processUploadEvents.
+
+    Expects a POST request with a JSON body containing:
+    {
+      "sub": "<User's unique Cognito identifier>",
+      "limit": <optional page size, 1-100>,
+      "cursor": "<optional nextCursor from the previous page>",
+      "email": "<optional, admins only: whose history to read>"
+    }
+
+    Uploads are indexed under the sub that claimed them through the quota API,
+    so users whose emails share a key prefix do not see each other's uploads.
+
+    Returns:
+      {
+        "items": [{"objectKey", "fileName", "uploadedAt", "size", "resultKey", "resultAt"}, ...],
+        "nextCursor": "<string, or null on the last page>",
+        "totalUploads": <int>
+      }
+    """
+    try:
+        print("Received event:", json.dumps(event))
+
+        if event.get("httpMethod") == "OPTIONS":
+            return {"statusCode": 200, "headers": HEADERS, "body": ""}
+
+        if event.get("httpMethod") != "POST":
+            print("Invalid HTTP method:", event.get("httpMethod"))
+            return {
+                "statusCode": 405,
+                "headers": HEADERS,
+                "body": json.dumps({"message": "Method Not Allowed. Use POST."}),
+            }
+
+        try:
+            body = json.loads(event.get("body") or "{}")
+        except json.JSONDecodeError:
+            print("Invalid JSON in request body.")
+            return {
+                "statusCode": 400,
+                "headers": HEADERS,
+                "body": json.dumps({"message": "Invalid JSON in request body."}),
+            }
+
+        fields, errors = UPLOAD_HISTORY_SCHEMA.validate(body)
+        if errors:
+            print("Invalid request fields:", errors)
+            return {
+                "statusCode": 400,
+                "headers": HEADERS,
+                "body": json.dumps({"message": format_errors(errors), "errors": errors}),
+            }
+
+        # Behind the Cognito authorizer, the token's claims identify the caller
+        claims = event.get("requestContext", {}).get("authorizer", {}).get("claims") or {}
+        if claims and claims.get("sub") != fields["sub"]:
+            print("Request sub does not match the caller's token.")
+            return {
+                "statusCode": 403,
+                "headers": HEADERS,
+                "body": json.dumps({"message": "You can only read your own upload history."}),
+            }
+
+        if "email" in fields:
+            if not ADMIN_GROUP or ADMIN_GROUP not in str(claims.get("cognito:groups", "")).split(","):
+                return {
+                    "statusCode": 403,
+                    "headers": HEADERS,
+                    "body": json.dumps({"message": "Only administrators can read another user's history."}),
+                }
+            owner = get_user_sub(fields["email"])
+            if owner is None:
+                return {
+                    "statusCode": 404,
+                    "headers": HEADERS,
+                    "body": json.dumps({"message": "User not found in Cognito."}),
+                }
+        else:
+            owner = fields["sub"]
+
+        after_key = None
+        if "cursor" in fields:
+            try:
+                after_key = decode_cursor(fields["cursor"])
+            except ValueError:
+                return {
+                    "statusCode": 400,
+                    "headers": HEADERS,
+                    "body": json.dumps({"message": "Invalid request: cursor is not valid.",
+                                        "errors": {"cursor": "is not valid"}}),
+                }
+
+        records, last_key = upload_index.list_history(owner, fields.get("limit", DEFAULT_PAGE_SIZE), after_key)
+
+        return {
+            "statusCode": 200,
+            "headers": HEADERS,
+            "body": json.dumps({
+                "items": [history_item(record) for record in records],
+                "nextCursor": encode_cursor(last_key) if last_key else None,
+                "totalUploads": upload_index.count(owner) or 0,
+            }),
+        }
+
+    except Exception as e:
+        print("Unhandled exception:", str(e))
+        return {
+            "statusCode": 500,
+            "headers": HEADERS,
+            "body": json.dumps({"message": "Internal server error."}),
+        }
+
+
+def get_user_sub(email):
+    """
+    Looks up the sub of the user with this exact email, or returns None if there is none.
+    """
+    escaped = email.replace("\\", "\\\\").replace('"', '\\"')
+    response = cognito_client.list_users(
+        UserPoolId=os.environ["USER_POOL_ID"],
+        AttributesToGet=["sub"],
+        Filter=f'email = "{escaped}"',
+        Limit=1
+    )
+    for user in response.get("Users", []):
+        attributes = {attr["Name"]: attr["Value"] for attr in user.get("Attributes", [])}
+        return attributes.get("sub")
+    return None
+
+
+def history_item(record):
+    """
+    Converts an index record to the API's camelCase shape. A result can be indexed
+    before its upload, so the upload time falls back to the one in the key.
+    """
+    uploaded_at = record.get("uploaded_at") or parse_upload_key(record["object_key"])["uploaded_at"]
+    size = record.get("size")
+    return {
+        "objectKey": record["object_key"],
+        "fileName": record.get("file_name"),
+        "uploadedAt": format_upload_time(uploaded_at),
+        "size": int(size) if size is not None else None,
+        "resultKey": record.get("result_key"),
+        "resultAt": record.get("result_at"),
+    }
@@ -0,0 +1,43 @@
+import json
+import queue
+
+import boto3
+
+
+# ---------------------------------------------------------------------
+#                           SQS Queue
+# ---------------------------------------------------------------------
+class SqsAttributeQueue:
+    """
+    Defers attribute initialisation to an SQS queue. The queue's messages are
+    delivered back to this Lambda, which applies them outside the sign-up path.
+    """
+
+    def __init__(self, queue_url):
+        self.queue_url = queue_url
+        self.sqs = boto3.client('sqs')
+
+    def send(self, message):
+        self.sqs.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(message))
+
+
+# ---------------------------------------------------------------------
+#                      Local (in-process) Queue
+# ---------------------------------------------------------------------
+class LocalAttributeQueue:
+    """
+    In-process stand-in for SqsAttributeQueue, for local runs and tests.
+    drain() returns the pending messages as an SQS-shaped event for the handler.
+    """
+
+    def __init__(self):
+        self.messages = queue.Queue()
+
+    def send(self, message):
+        self.messages.put(json.dumps(message))
+
+    def drain(self):
+        records = []
+        while not self.messages.empty():
+            records.append({'eventSource': 'aws:sqs', 'body': self.messages.get_nowait()})
+        return {'Records': records}
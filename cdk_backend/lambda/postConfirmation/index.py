@@ -1,79 +1,209 @@
 import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import boto3
 
-def handler(event, context):
-    print('Post Confirmation Trigger Event:', json.dumps(event, indent=2))
-
-    # Retrieve group names from environment variables
-    DEFAULT_GROUP = str(os.environ.get('DEFAULT_GROUP_NAME'))
-    AMAZON_GROUP = str(os.environ.get('AMAZON_GROUP_NAME'))
-    ADMIN_GROUP = str(os.environ.get('ADMIN_GROUP_NAME'))
-
-    # Define attribute defaults based on group
-    group_attributes = {
-        DEFAULT_GROUP: {
-            'custom:first_sign_in': 'true',
-            'custom:total_files_uploaded': '0',
-            'custom:max_files_allowed': '3',
-            'custom:max_pages_allowed': '10',
-            'custom:max_size_allowed_MB': '25'
-        },
-        AMAZON_GROUP: {
-            'custom:first_sign_in': 'true',
-            'custom:total_files_uploaded': '0',
-            'custom:max_files_allowed': '5',
-            'custom:max_pages_allowed': '10',
-            'custom:max_size_allowed_MB': '25'
-        },
-        ADMIN_GROUP: {
-            'custom:first_sign_in': 'true',
-            'custom:total_files_uploaded': '0',
-            'custom:max_files_allowed': '10000',
-            'custom:max_pages_allowed': '2500',
-            'custom:max_size_allowed_MB': '1000'
-        }
+from attribute_queue import SqsAttributeQueue
+from domain_rules import DomainRuleLoader
+
+# Created once per container and reused by every invocation
+cognito_idp = boto3.client('cognito-idp')
+
+# Retrieve group names from environment variables
+DEFAULT_GROUP = str(os.environ.get('DEFAULT_GROUP_NAME'))
+AMAZON_GROUP = str(os.environ.get('AMAZON_GROUP_NAME'))
+ADMIN_GROUP = str(os.environ.get('ADMIN_GROUP_NAME'))
+
+# Define attribute defaults based on group
+group_attributes = {
+    DEFAULT_GROUP: {
+        'custom:first_sign_in': 'true',
+        'custom:total_files_uploaded': '0',
+        'custom:max_files_allowed': '3',
+        'custom:max_pages_allowed': '10',
+        'custom:max_size_allowed_MB': '25'
+    },
+    AMAZON_GROUP: {
+        'custom:first_sign_in': 'true',
+        'custom:total_files_uploaded': '0',
+        'custom:max_files_allowed': '5',
+        'custom:max_pages_allowed': '10',
+        'custom:max_size_allowed_MB': '25'
+    },
+    ADMIN_GROUP: {
+        'custom:first_sign_in': 'true',
+        'custom:total_files_uploaded': '0',
+        'custom:max_files_allowed': '10000',
+        'custom:max_pages_allowed': '2500',
+        'custom:max_size_allowed_MB': '1000'
     }
+}
+
+# Cognito UserAttributes payloads per group, built once at cold start
+group_user_attributes = {
+    group: [{'Name': key, 'Value': value} for key, value in attributes.items()]
+    for group, attributes in group_attributes.items()
+}
+
+# Email domain -> group rules, from 's3://bucket/key' or a local JSON file (see domain_rules.py).
+# Without a rules document, only @amazon.com addresses are assigned to the Amazon group.
+DOMAIN_RULES_LOCATION = os.environ.get('DOMAIN_RULES_LOCATION')
+DOMAIN_RULES_REFRESH_SECONDS = int(os.environ.get('DOMAIN_RULES_REFRESH_SECONDS', '300'))
+DEFAULT_DOMAIN_RULES = [
+    {'domain': 'amazon.com', 'group': AMAZON_GROUP},
+]
+
+domain_rules = DomainRuleLoader(
+    DOMAIN_RULES_LOCATION,
+    default_group=DEFAULT_GROUP,
+    fallback_rules=DEFAULT_DOMAIN_RULES,
+    refresh_seconds=DOMAIN_RULES_REFRESH_SECONDS,
+    known_groups=group_attributes
+)
+domain_rules.get_index()  # Compile at cold start rather than on the first sign-up
+
+# 'inline' initialises attributes during the trigger, alongside the group add.
+# 'queue' only enqueues the initialisation; the queue delivers it back to this
+# Lambda, so sign-up waits on the group add alone. The UI reads
+# custom:first_sign_in at first sign-in, so keep the queue consumer prompt.
+ATTRIBUTE_INIT_MODE = os.environ.get('ATTRIBUTE_INIT_MODE', 'inline')  # 'inline' | 'queue'
+ATTRIBUTE_INIT_QUEUE_URL = os.environ.get('ATTRIBUTE_INIT_QUEUE_URL')
+
+if ATTRIBUTE_INIT_QUEUE_URL:
+    attribute_queue = SqsAttributeQueue(ATTRIBUTE_INIT_QUEUE_URL)
+else:
+    # Nothing would consume an in-process queue, so initialise inline instead
+    attribute_queue = None
+    if ATTRIBUTE_INIT_MODE == 'queue':
+        print('ERROR: ATTRIBUTE_INIT_MODE is queue but ATTRIBUTE_INIT_QUEUE_URL is not set; '
+              'initialising attributes inline.')
+
+# The group add and the attribute update are independent Cognito calls
+executor = ThreadPoolExecutor(max_workers=2)
+
+METRICS_NAMESPACE = 'PDFAccessibility/PostConfirmation'
+
+
+def handler(event, context):
+    # Deferred attribute initialisation delivered by the queue
+    if 'Records' in event:
+        return handle_attribute_init_messages(event)
+
+    started_at = time.perf_counter()
+    timings = {}
+    print('Post Confirmation Trigger Event:', json.dumps(event))
+
+    # Confirming a forgotten password fires this trigger too; it must not reset the user's usage.
+    trigger_source = event.get('triggerSource', 'PostConfirmation_ConfirmSignUp')
+    if trigger_source != 'PostConfirmation_ConfirmSignUp':
+        print(f'Skipping post confirmation setup for trigger source {trigger_source}.')
+        return event
 
     try:
-        cognito_idp = boto3.client('cognito-idp')
         user_pool_id = event['userPoolId']
         username = event['userName']
+        user_email = event['request']['userAttributes'].get('email', '')
+        rules = domain_rules.get_index()
+        assigned_group = rules.lookup(user_email)
+        # Groups without their own defaults (e.g. partner groups) get their tier's
+        user_attributes = group_user_attributes[rules.tier(assigned_group)]
 
-        # Determine the group to assign the user to
-        # For demonstration, we'll assign all users to the Default group
-        # You can implement your own logic here to assign to Amazon or Admin groups
-        assigned_group = DEFAULT_GROUP
+        futures = {
+            'AddToGroupTime': executor.submit(
+                timed, timings, 'AddToGroupTime', cognito_idp.admin_add_user_to_group,
+                UserPoolId=user_pool_id, Username=username, GroupName=assigned_group
+            )
+        }
 
-        # Example logic to assign to AmazonUsers based on email domain
-        user_email = event['request']['userAttributes'].get('email', '')
-        if user_email.endswith('@amazon.com'):
-            assigned_group = AMAZON_GROUP
-        # Example logic to assign to AdminUsers based on a specific condition
-        # elif user_email.endswith('@admin.com'):
-        #     assigned_group = ADMIN_GROUP
-
-        # Add user to the assigned group
-        cognito_idp.admin_add_user_to_group(
-            UserPoolId=user_pool_id,
-            Username=username,
-            GroupName=assigned_group
-        )
-        print(f'User {username} added to group {assigned_group}.')
-
-        # Initialize custom attributes based on the assigned group
-        attributes = group_attributes.get(assigned_group, {})
-        user_attributes = [{'Name': key, 'Value': value} for key, value in attributes.items()]
+        if user_attributes and ATTRIBUTE_INIT_MODE == 'queue' and attribute_queue is not None:
+            try:
+                timed(timings, 'EnqueueTime', attribute_queue.send, {
+                    'userPoolId': user_pool_id,
+                    'userName': username,
+                    'userAttributes': user_attributes
+                })
+                print(f'Queued attribute initialisation for group {assigned_group}.')
+                user_attributes = []
+            except Exception as error:
+                print(f'Error queueing attribute initialisation, applying it inline: {error}')
 
         if user_attributes:
-            cognito_idp.admin_update_user_attributes(
-                UserPoolId=user_pool_id,
-                Username=username,
-                UserAttributes=user_attributes
+            futures['InitAttributesTime'] = executor.submit(
+                timed, timings, 'InitAttributesTime', cognito_idp.admin_update_user_attributes,
+                UserPoolId=user_pool_id, Username=username, UserAttributes=user_attributes
             )
-            print(f'Successfully initialized attributes for group {assigned_group}.')
+
+        for name, future in futures.items():
+            try:
+                future.result()
+            except Exception as error:
+                print(f'Error in post confirmation trigger ({name}): {error}')
+            else:
+                if name == 'AddToGroupTime':
+                    print(f'User {username} added to group {assigned_group}.')
+                else:
+                    print(f'Successfully initialized attributes for group {assigned_group}.')
 
     except Exception as error:
         print(f'Error in post confirmation trigger: {error}')
 
+    timings['BlockingTime'] = elapsed_ms(started_at)
+    emit_metrics(timings)
     return event
+
+
+def handle_attribute_init_messages(event):
+    """
+    Applies attribute initialisations queued by earlier sign-ups. Failed messages are
+    reported individually so that only they are retried.
+    """
+    batch_item_failures = []
+    for record in event['Records']:
+        try:
+            message = json.loads(record['body'])
+            cognito_idp.admin_update_user_attributes(
+                UserPoolId=message['userPoolId'],
+                Username=message['userName'],
+                UserAttributes=message['userAttributes']
+            )
+            print(f"Successfully initialized attributes for user {message['userName']}.")
+        except Exception as error:
+            print(f'Error initializing attributes from queue: {error}')
+            batch_item_failures.append({'itemIdentifier': record.get('messageId')})
+    return {'batchItemFailures': batch_item_failures}
+
+
+def timed(timings, name, call, *args, **kwargs):
+    """
+    Runs call(*args, **kwargs), recording its duration in milliseconds under timings[name].
+    """
+    started_at = time.perf_counter()
+    try:
+        return call(*args, **kwargs)
+    finally:
+        timings[name] = elapsed_ms(started_at)
+
+
+def elapsed_ms(started_at):
+    return round((time.perf_counter() - started_at) * 1000, 2)
+
+
+def emit_metrics(timings):
+    """
+    Logs the timings in CloudWatch Embedded Metric Format, so they become metrics
+    (per ATTRIBUTE_INIT_MODE) without any extra API calls on the sign-up path.
+    """
+    print(json.dumps({
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [['AttributeInitMode']],
+                'Metrics': [{'Name': name, 'Unit': 'Milliseconds'} for name in timings]
+            }]
+        },
+        'AttributeInitMode': ATTRIBUTE_INIT_MODE,
+        **timings
+    }))
@@ -0,0 +1,76 @@
+import importlib.util
+import json
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..', 'shared', 'python'))
+sys.path.insert(0, os.path.join(HERE, '..', '..', 'tools'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.update(DEFAULT_GROUP_NAME='DefaultUsers', AMAZON_GROUP_NAME='AmazonUsers', ADMIN_GROUP_NAME='AdminUsers')
+
+from attribute_queue import LocalAttributeQueue  # noqa: E402
+from local_cognito import LocalCognitoClient  # noqa: E402
+
+# Every Lambda's handler module is named 'index', so load this one under its own name
+_spec = importlib.util.spec_from_file_location('post_confirmation_index', os.path.join(HERE, 'index.py'))
+index = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(index)
+
+
+def sign_up_event(sub, email):
+    return {
+        'triggerSource': 'PostConfirmation_ConfirmSignUp',
+        'userPoolId': 'us-east-1_test',
+        'userName': sub,
+        'request': {'userAttributes': {'email': email}},
+    }
+
+
+@pytest.fixture
+def cognito(monkeypatch):
+    client = LocalCognitoClient({'user-1': {'attributes': {'email': 'someone@amazon.com'}}})
+    monkeypatch.setattr(index, 'cognito_idp', client)
+    return client
+
+
+def test_queue_mode_defers_attribute_initialisation(monkeypatch, cognito):
+    attribute_queue = LocalAttributeQueue()
+    monkeypatch.setattr(index, 'ATTRIBUTE_INIT_MODE', 'queue')
+    monkeypatch.setattr(index, 'attribute_queue', attribute_queue)
+
+    index.handler(sign_up_event('user-1', 'someone@amazon.com'), None)
+    assert cognito.users['user-1']['groups'] == ['AmazonUsers']
+    assert 'custom:max_files_allowed' not in cognito.users['user-1']['attributes']
+
+    assert index.handler(attribute_queue.drain(), None) == {'batchItemFailures': []}
+    assert cognito.users['user-1']['attributes']['custom:max_files_allowed'] == '5'
+
+
+def test_queue_mode_without_a_queue_initialises_inline(monkeypatch, cognito):
+    monkeypatch.setattr(index, 'ATTRIBUTE_INIT_MODE', 'queue')
+    monkeypatch.setattr(index, 'attribute_queue', None)
+
+    index.handler(sign_up_event('user-1', 'someone@amazon.com'), None)
+
+    assert cognito.users['user-1']['groups'] == ['AmazonUsers']
+    assert cognito.users['user-1']['attributes']['custom:max_files_allowed'] == '5'
+
+
+def test_partner_groups_start_with_their_tiers_attributes(monkeypatch, cognito, tmp_path):
+    rules = tmp_path / 'domain-rules.json'
+    rules.write_text(json.dumps({
+        'groups': {'PartnerTier1': {'tier': 'AmazonUsers'}},
+        'rules': [{'domain': 'asu.edu', 'group': 'PartnerTier1'}],
+    }))
+    monkeypatch.setattr(index, 'domain_rules', index.DomainRuleLoader(
+        str(rules), 'DefaultUsers', fallback_rules=[], known_groups=index.group_attributes
+    ))
+
+    index.handler(sign_up_event('user-1', 'someone@asu.edu'), None)
+
+    assert cognito.users['user-1']['groups'] == ['PartnerTier1']
+    assert cognito.users['user-1']['attributes']['custom:max_files_allowed'] == '5'
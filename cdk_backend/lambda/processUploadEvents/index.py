@@ -0,0 +1,169 @@
+import json
+import os
+import time
+from urllib.parse import unquote_plus
+
+from upload_index import DynamoDBUploadIndex, SQLiteUploadIndex, parse_result_key, parse_upload_key
+
+UPLOAD_INDEX_TABLE = os.environ.get('UPLOAD_INDEX_TABLE')
+UPLOAD_INDEX_DB = os.environ.get('UPLOAD_INDEX_DB', ':memory:')  # SQLite stand-in when no table is set
+
+if UPLOAD_INDEX_TABLE:
+    upload_index = DynamoDBUploadIndex(UPLOAD_INDEX_TABLE)
+else:
+    upload_index = SQLiteUploadIndex(UPLOAD_INDEX_DB)
+
+METRICS_NAMESPACE = 'PDFAccessibility/UploadEvents'
+
+
+def handler(event, context):
+    """
+    Records uploads to pdf/ and their results in result/ in the per-user upload
+    index as the objects arrive.
+
+    Accepts a batch of SQS messages whose bodies are EventBridge 'Object Created'
+    events or S3 event notifications, or either of those delivered directly.
+    Objects are grouped by owner, so each owner's count is updated once per batch.
+    The owner is the user sub that claimed the upload key through the quota API,
+    or the sanitised email prefix of the key if no user did. Messages whose owner
+    could not be resolved or updated are reported in batchItemFailures and
+    retried by SQS.
+    """
+    started_at = time.perf_counter()
+
+    if 'Records' in event and event['Records'] and 'body' in event['Records'][0]:
+        messages = [(record.get('messageId'), json.loads(record['body'])) for record in event['Records']]
+    else:
+        messages = [(None, event)]
+
+    # (key prefix, object key) -> (record, is_upload, message ids)
+    objects = {}
+    skipped = 0
+    for message_id, message in messages:
+        for key, size, event_time in extract_created_objects(message):
+            upload = parse_upload_key(key)
+            result = parse_result_key(key) if upload is None else None
+            if upload is not None:
+                record = upload
+                if size is not None:
+                    upload['size'] = size
+            elif result is not None:
+                record = result
+                if event_time:
+                    result['result_at'] = event_time
+            else:
+                print(f'Skipping object that is not a user upload or result: {key}')
+                skipped += 1
+                continue
+            key_owner = record.pop('owner')
+            # The same object can appear twice in a batch when S3 redelivers an event
+            _, _, message_ids = objects.setdefault(
+                (key_owner, key), (record, upload is not None, set())
+            )
+            message_ids.add(message_id)
+
+    failed_message_ids = set()
+    owners = resolve_owners(objects, failed_message_ids)
+
+    uploads_by_owner = {}
+    results_by_owner = {}
+    message_ids_by_owner = {}
+    for (key_owner, key), (record, is_upload, message_ids) in objects.items():
+        if (key_owner, record['object_key']) not in owners:
+            continue
+        owner = owners[(key_owner, record['object_key'])]
+        records_by_owner = uploads_by_owner if is_upload else results_by_owner
+        records_by_owner.setdefault(owner, []).append(record)
+        message_ids_by_owner.setdefault(owner, set()).update(message_ids)
+
+    added = 0
+    for owner in message_ids_by_owner:
+        try:
+            if owner in uploads_by_owner:
+                added += upload_index.record_uploads(owner, uploads_by_owner[owner])
+            if owner in results_by_owner:
+                upload_index.record_results(owner, results_by_owner[owner])
+        except Exception as e:
+            print(f'Error recording objects for {owner}: {e}')
+            failed_message_ids.update(message_ids_by_owner[owner])
+
+    summary = {
+        'Owners': len(message_ids_by_owner),
+        'Uploads': sum(len(uploads) for uploads in uploads_by_owner.values()),
+        'Added': added,
+        'Results': sum(len(results) for results in results_by_owner.values()),
+        'Skipped': skipped,
+        'FailedMessages': len(failed_message_ids),
+    }
+    emit_metrics(summary, round((time.perf_counter() - started_at) * 1000, 2))
+
+    if messages[0][0] is None:
+        if failed_message_ids:
+            raise RuntimeError('Failed to record objects; see the log for details.')
+        return summary
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]}
+
+
+def resolve_owners(objects, failed_message_ids):
+    """
+    Returns {(key prefix, upload key): owner} for the objects collected by handler,
+    where the owner is the sub that claimed the upload, or the key prefix if it
+    is unclaimed. A result belongs to the owner of its upload.
+    Adds the messages of key prefixes whose claims could not be read to
+    'failed_message_ids' and leaves their objects out.
+    """
+    object_keys_by_prefix = {}
+    for (key_owner, _), (record, _, _) in objects.items():
+        object_keys_by_prefix.setdefault(key_owner, set()).add(record['object_key'])
+
+    owners = {}
+    for key_owner, object_keys in object_keys_by_prefix.items():
+        try:
+            claims = upload_index.resolve_owners(key_owner, object_keys)
+        except Exception as e:
+            print(f'Error reading upload claims for {key_owner}: {e}')
+            for (prefix, _), (_, _, message_ids) in objects.items():
+                if prefix == key_owner:
+                    failed_message_ids.update(message_ids)
+            continue
+        for object_key in object_keys:
+            owners[(key_owner, object_key)] = claims.get(object_key, key_owner)
+    return owners
+
+
+def extract_created_objects(message):
+    """
+    Yields (key, size, event_time) for each created object in an EventBridge event
+    or an S3 event notification. S3 notification keys are URL-encoded and are
+    decoded here.
+    """
+    if 'detail' in message:
+        obj = message['detail'].get('object', {})
+        if 'key' in obj:
+            yield obj['key'], obj.get('size'), message.get('time')
+        return
+
+    for record in message.get('Records', []):
+        if not record.get('eventName', '').startswith('ObjectCreated:'):
+            continue
+        obj = record['s3']['object']
+        yield unquote_plus(obj['key']), obj.get('size'), record.get('eventTime')
+
+
+def emit_metrics(summary, duration_ms):
+    """
+    Logs the batch summary in CloudWatch Embedded Metric Format.
+    """
+    print(json.dumps({
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [[]],
+                'Metrics': [{'Name': name, 'Unit': 'Count'} for name in summary]
+                           + [{'Name': 'BatchTime', 'Unit': 'Milliseconds'}]
+            }]
+        },
+        **summary,
+        'BatchTime': duration_ms
+    }))
@@ -0,0 +1,211 @@
+import json
+import os
+import threading
+import time
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+# Rule refreshes run while sign-ups are served, so they give up quickly
+S3_TIMEOUT_SECONDS = 2
+
+
+# ---------------------------------------------------------------------
+#                      Reversed-Label Domain Trie
+# ---------------------------------------------------------------------
+class DomainGroupIndex:
+    """
+    Maps email domains to groups with a trie keyed on reversed domain labels
+    ('cs.asu.edu' is stored as edu -> asu -> cs), so a lookup costs one dict
+    access per label however many rules there are.
+
+    Each rule is {"domain": ..., "group": ...}:
+        - "asu.edu"                      matches only addresses @asu.edu
+        - "*.asu.edu"                    matches subdomains such as @cs.asu.edu
+        - "asu.edu" + "subdomains": true matches both
+    The most specific matching rule wins.
+
+    'group_tiers' maps groups that have no limits of their own (e.g. partner
+    groups) to the group whose limits they get.
+    """
+
+    def __init__(self, rules, default_group, group_tiers=None):
+        self.default_group = default_group
+        self.group_tiers = dict(group_tiers or {})
+        self.root = {}
+        self.rule_count = 0
+        for rule in rules:
+            self.add_rule(rule)
+
+    def add_rule(self, rule):
+        domain = rule['domain'].strip().lower().rstrip('.')
+        group = rule['group']
+        subdomains_only = domain.startswith('*.')
+        if subdomains_only:
+            domain = domain[2:]
+
+        node = self.root
+        for label in reversed(domain.split('.')):
+            node = node.setdefault(label, {})
+
+        # Group assignments are stored under keys that cannot be domain labels.
+        if not subdomains_only:
+            node['@exact'] = group
+        if subdomains_only or rule.get('subdomains'):
+            node['@subtree'] = group
+        self.rule_count += 1
+
+    def lookup(self, email):
+        """
+        Returns the group for an email address (or bare domain), or the default group.
+        """
+        domain = email.rpartition('@')[2].strip().lower().rstrip('.')
+        labels = domain.split('.')
+
+        node = self.root
+        subtree_group = None
+        for depth, label in enumerate(reversed(labels)):
+            node = node.get(label)
+            if node is None:
+                break
+            if depth == len(labels) - 1:
+                return node.get('@exact') or subtree_group or self.default_group
+            # A wildcard applies to strictly deeper domains, so it is recorded before descending.
+            subtree_group = node.get('@subtree', subtree_group)
+
+        return subtree_group or self.default_group
+
+    def tier(self, group):
+        """
+        Returns the group whose limits apply to members of 'group'.
+        """
+        return self.group_tiers.get(group, group)
+
+
+# ---------------------------------------------------------------------
+#                           Rule Loading
+# ---------------------------------------------------------------------
+class DomainRuleLoader:
+    """
+    Loads a rules document and compiles it into a DomainGroupIndex, re-checking the
+    source at most every 'refresh_seconds'. S3 sources are re-fetched with
+    If-None-Match on the cached ETag, so an unchanged document is not downloaded
+    or recompiled; local files use their modification time the same way.
+
+    The document looks like:
+        {"default_group": "DefaultUsers",
+         "groups": {"PartnerTier1": {"tier": "AmazonUsers"}},
+         "rules": [{"domain": "amazon.com", "group": "AmazonUsers"}, ...]}
+    Every group a rule assigns must be one of 'known_groups' (the groups with
+    limits) or be given a known group's limits under "groups"; a document that
+    names any other group is rejected. When the source is unset or missing,
+    'fallback_rules' are used.
+
+    Only the first load blocks. Later refreshes run on a background thread while
+    callers keep getting the cached index.
+    """
+
+    def __init__(self, location, default_group, fallback_rules, refresh_seconds=300, known_groups=None):
+        self.location = location
+        self.default_group = default_group
+        self.fallback_rules = fallback_rules
+        self.refresh_seconds = refresh_seconds
+        self.known_groups = set(known_groups) if known_groups is not None else None
+        self.etag = None
+        self.index = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+        self.s3 = boto3.client('s3', config=Config(
+            connect_timeout=S3_TIMEOUT_SECONDS, read_timeout=S3_TIMEOUT_SECONDS, retries={'max_attempts': 1}
+        )) if location and location.startswith('s3://') else None
+
+    def get_index(self):
+        if self.index is not None and time.monotonic() - self.checked_at < self.refresh_seconds:
+            return self.index
+
+        if self.index is None:
+            with self.lock:
+                if self.index is None:
+                    self._checked_refresh()
+            return self.index
+
+        # Stale: one caller starts a refresh, and everyone keeps the cached rules meanwhile
+        if self.lock.acquire(blocking=False):
+            threading.Thread(target=self._background_refresh, daemon=True).start()
+        return self.index
+
+    def _background_refresh(self):
+        try:
+            self._checked_refresh()
+        finally:
+            self.lock.release()
+
+    def _checked_refresh(self):
+        # Called with the lock held
+        self.checked_at = time.monotonic()
+        try:
+            self._refresh()
+        except Exception as error:
+            # Keep serving the last good rules rather than failing sign-up.
+            print(f'Error loading domain rules from {self.location}: {error}')
+            if self.index is None:
+                self._compile({'rules': self.fallback_rules}, etag=None)
+
+    def _refresh(self):
+        if not self.location:
+            if self.index is None:
+                self._compile({'rules': self.fallback_rules}, etag=None)
+            return
+
+        if self.s3 is not None:
+            bucket, _, key = self.location[len('s3://'):].partition('/')
+            params = {'Bucket': bucket, 'Key': key}
+            if self.etag:
+                params['IfNoneMatch'] = self.etag
+            try:
+                response = self.s3.get_object(**params)
+            except ClientError as e:
+                code = e.response['Error']['Code']
+                if code in ('304', 'NotModified'):
+                    return
+                # Readers are not granted s3:ListBucket, so S3 reports a missing
+                # object as AccessDenied rather than NoSuchKey.
+                if code in ('NoSuchKey', '404', 'AccessDenied', '403'):
+                    if self.etag is not None or self.index is None:
+                        print(f'No domain rules at {self.location}; using built-in rules.')
+                        self._compile({'rules': self.fallback_rules}, etag=None)
+                    return
+                raise
+            self._compile(json.loads(response['Body'].read()), etag=response.get('ETag'))
+            return
+
+        if not os.path.exists(self.location):
+            if self.etag is not None or self.index is None:
+                self._compile({'rules': self.fallback_rules}, etag=None)
+            return
+        mtime = str(os.path.getmtime(self.location))
+        if mtime == self.etag and self.index is not None:
+            return
+        with open(self.location, encoding='utf-8') as f:
+            self._compile(json.load(f), etag=mtime)
+
+    def _compile(self, document, etag):
+        default_group = document.get('default_group', self.default_group)
+        group_tiers = {group: settings['tier'] for group, settings in document.get('groups', {}).items()}
+        rules = document.get('rules', [])
+
+        if self.known_groups is not None:
+            unknown_tiers = sorted(tier for tier in group_tiers.values() if tier not in self.known_groups)
+            if unknown_tiers:
+                raise ValueError(f'Group tiers must be one of {sorted(self.known_groups)}, not {unknown_tiers}.')
+            assigned = {default_group} | {rule['group'] for rule in rules}
+            unknown_groups = sorted(group for group in assigned
+                                    if group not in self.known_groups and group not in group_tiers)
+            if unknown_groups:
+                raise ValueError(f'Rules assign groups without limits or a tier: {unknown_groups}.')
+
+        # Build the new index aside and swap it in, so readers never see a partial one
+        index = DomainGroupIndex(rules, default_group, group_tiers)
+        self.index, self.etag = index, etag
+        print(f'Loaded {index.rule_count} domain rules (etag {etag}).')
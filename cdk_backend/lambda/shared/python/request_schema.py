@@ -0,0 +1,201 @@
+import json
+import os
+import re
+
+# Shared by the API Lambdas through the 'shared' Lambda layer. Schemas are compiled
+# once per container, so validating a request is a handful of dict lookups and
+# precompiled regex matches, and invalid requests never reach Cognito.
+
+_WHITESPACE = re.compile(r'\s+')
+_CONTROL_CHARACTERS = re.compile(r'[\x00-\x1f\x7f]')
+
+
+def _load_region_codes():
+    """
+    Loads the country and subdivision code sets shipped next to this module.
+    """
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'region_codes.json'), encoding='utf-8') as f:
+        data = json.load(f)
+    countries = frozenset(data['countries'])
+    subdivisions = {country: frozenset(codes) for country, codes in data['subdivisions'].items()}
+    return countries, subdivisions
+
+
+COUNTRY_CODES, SUBDIVISION_CODES = _load_region_codes()
+
+
+# ---------------------------------------------------------------------
+#                          Schema Building Blocks
+# ---------------------------------------------------------------------
+class StringField:
+    """
+    A string field with length limits and optional normalisation, format and choice checks.
+    clean() returns (value, None) on success or (None, error) where the error
+    reads after the field name, e.g. "is required". An optional field left blank
+    counts as absent unless 'allow_blank' is False.
+    """
+
+    __slots__ = (
+        'max_length', 'min_length', 'required', 'normalize_whitespace',
+        'uppercase', 'pattern', 'choices', 'choices_error', 'allow_blank'
+    )
+
+    def __init__(self, max_length, min_length=1, required=True, normalize_whitespace=True,
+                 uppercase=False, pattern=None, choices=None, choices_error=None, allow_blank=True):
+        self.max_length = max_length
+        self.min_length = min_length
+        self.required = required
+        self.normalize_whitespace = normalize_whitespace
+        self.uppercase = uppercase
+        self.pattern = re.compile(pattern) if pattern else None
+        self.choices = frozenset(choices) if choices is not None else None
+        self.choices_error = choices_error or (
+            f"must be one of: {', '.join(sorted(self.choices))}" if self.choices is not None else None
+        )
+        self.allow_blank = allow_blank
+
+    def clean(self, value):
+        if value is None:
+            return None, ("is required" if self.required else None)
+        if not isinstance(value, str):
+            return None, "must be a string"
+
+        if self.normalize_whitespace:
+            value = _WHITESPACE.sub(' ', value).strip()
+        if self.uppercase:
+            value = value.upper()
+
+        if not value:
+            if self.required:
+                return None, "is required"
+            return None, (None if self.allow_blank else "must not be empty")
+        if len(value) < self.min_length:
+            return None, f"must be at least {self.min_length} characters"
+        if len(value) > self.max_length:
+            return None, f"must be at most {self.max_length} characters"
+        if _CONTROL_CHARACTERS.search(value):
+            return None, "must not contain control characters"
+        if self.pattern is not None and not self.pattern.fullmatch(value):
+            return None, "has an invalid format"
+        if self.choices is not None and value not in self.choices:
+            return None, self.choices_error
+        return value, None
+
+
+class IntegerField:
+    """
+    An integer field within [minimum, maximum]. Accepts JSON numbers and digit strings.
+    """
+
+    __slots__ = ('minimum', 'maximum', 'required')
+
+    def __init__(self, minimum, maximum, required=True):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.required = required
+
+    def clean(self, value):
+        if value is None or value == '':
+            return None, ("is required" if self.required else None)
+        if isinstance(value, bool):
+            return None, "must be an integer"
+        if isinstance(value, str) and value.strip().isdigit():
+            value = int(value)
+        if not isinstance(value, int):
+            return None, "must be an integer"
+        if not self.minimum <= value <= self.maximum:
+            return None, f"must be between {self.minimum} and {self.maximum}"
+        return value, None
+
+
+class RequestSchema:
+    """
+    A set of named fields plus cross-field validators. validate() returns
+    (cleaned, errors): the normalised values of valid fields, and a dict of
+    field name -> error message. Fields not in the schema are ignored.
+
+    Validators run only when every field is valid, and receive (cleaned, errors)
+    to add errors of their own.
+    """
+
+    def __init__(self, fields, validators=()):
+        self.fields = tuple(fields.items())
+        self.validators = tuple(validators)
+
+    def validate(self, body):
+        if not isinstance(body, dict):
+            return {}, {'body': "must be a JSON object"}
+
+        cleaned = {}
+        errors = {}
+        for name, field in self.fields:
+            value, error = field.clean(body.get(name))
+            if error:
+                errors[name] = error
+            elif value is not None:
+                cleaned[name] = value
+
+        if not errors:
+            for validator in self.validators:
+                validator(cleaned, errors)
+        return cleaned, errors
+
+
+def format_errors(errors):
+    """
+    Joins field errors into one message, e.g. "Invalid request: city is required."
+    """
+    return "Invalid request: " + "; ".join(f"{name} {error}" for name, error in errors.items()) + "."
+
+
+# ---------------------------------------------------------------------
+#                         API Request Schemas
+# ---------------------------------------------------------------------
+# Cognito 'sub' values are UUIDs.
+COGNITO_SUB = StringField(
+    max_length=36,
+    pattern=r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}'
+)
+
+
+def validate_state_of_country(cleaned, errors):
+    """
+    Checks the state against the country's subdivision codes, where they are known.
+    """
+    subdivisions = SUBDIVISION_CODES.get(cleaned['country'])
+    if subdivisions is not None and cleaned['state'] not in subdivisions:
+        errors['state'] = f"is not a recognised state code for country {cleaned['country']}"
+
+
+# POST /update-first-sign-in (updateAttributes)
+FIRST_SIGN_IN_SCHEMA = RequestSchema(
+    {
+        'sub': COGNITO_SUB,
+        'organization': StringField(max_length=256),
+        'country': StringField(
+            max_length=2, min_length=2, uppercase=True,
+            choices=COUNTRY_CODES, choices_error="is not a recognised country code"
+        ),
+        'state': StringField(max_length=10, uppercase=True, pattern=r'[A-Z0-9]+(-[A-Z0-9]+)?'),
+        'city': StringField(max_length=128),
+    },
+    validators=(validate_state_of_country,)
+)
+
+# POST /upload-quota (checkOrIncrementQuota)
+UPLOAD_QUOTA_SCHEMA = RequestSchema({
+    'sub': COGNITO_SUB,
+    'mode': StringField(max_length=9, choices=('check', 'increment')),
+    # Usually the upload's S3 key, so it is kept exactly as sent.
+    'idempotencyKey': StringField(max_length=1024, required=False, normalize_whitespace=False, allow_blank=False),
+})
+
+# POST /upload-history (getUploadHistory)
+UPLOAD_HISTORY_SCHEMA = RequestSchema({
+    'sub': COGNITO_SUB,
+    'limit': IntegerField(minimum=1, maximum=100, required=False),
+    # Opaque value returned as nextCursor by the previous page
+    'cursor': StringField(max_length=2048, required=False, normalize_whitespace=False),
+    # Admins only: whose history to read
+    'email': StringField(max_length=254, required=False),
+})
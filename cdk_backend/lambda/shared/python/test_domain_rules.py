@@ -0,0 +1,159 @@
+import io
+import json
+import os
+import sys
+import threading
+
+import pytest
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from domain_rules import DomainGroupIndex, DomainRuleLoader  # noqa: E402
+
+KNOWN_GROUPS = ['DefaultUsers', 'AmazonUsers', 'AdminUsers']
+
+
+@pytest.fixture
+def index():
+    return DomainGroupIndex([
+        {'domain': 'amazon.com', 'group': 'AmazonUsers'},
+        {'domain': 'asu.edu', 'group': 'PartnerTier1', 'subdomains': True},
+        {'domain': 'cs.asu.edu', 'group': 'PartnerTier2'},
+        {'domain': '*.example.edu', 'group': 'PartnerTier3'},
+    ], 'DefaultUsers', {'PartnerTier1': 'AmazonUsers'})
+
+
+@pytest.mark.parametrize('email, group', [
+    ('someone@amazon.com', 'AmazonUsers'),
+    ('Someone@AMAZON.com.', 'AmazonUsers'),
+    ('someone@aws.amazon.com', 'DefaultUsers'),
+    ('someone@asu.edu', 'PartnerTier1'),
+    ('someone@math.asu.edu', 'PartnerTier1'),
+    ('someone@cs.asu.edu', 'PartnerTier2'),
+    ('someone@lab.cs.asu.edu', 'PartnerTier1'),
+    ('someone@example.edu', 'DefaultUsers'),
+    ('someone@lab.example.edu', 'PartnerTier3'),
+    ('someone@edu', 'DefaultUsers'),
+    ('not an email', 'DefaultUsers'),
+    ('', 'DefaultUsers'),
+])
+def test_lookup(index, email, group):
+    assert index.lookup(email) == group
+
+
+def test_tier(index):
+    assert index.tier('PartnerTier1') == 'AmazonUsers'
+    assert index.tier('AmazonUsers') == 'AmazonUsers'
+
+
+def write_rules(path, document):
+    path.write_text(json.dumps(document))
+    # Modification times can repeat within a test; move it so the change is seen
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def loader_for(path, refresh_seconds=300):
+    return DomainRuleLoader(
+        str(path),
+        default_group='DefaultUsers',
+        fallback_rules=[{'domain': 'amazon.com', 'group': 'AmazonUsers'}],
+        refresh_seconds=refresh_seconds,
+        known_groups=KNOWN_GROUPS
+    )
+
+
+def test_loader_rejects_groups_without_limits(tmp_path):
+    path = tmp_path / 'rules.json'
+    write_rules(path, {'rules': [{'domain': 'asu.edu', 'group': 'PartnerTier1'}]})
+
+    index = loader_for(path).get_index()
+
+    # The document is rejected, so the fallback rules apply
+    assert index.lookup('someone@asu.edu') == 'DefaultUsers'
+    assert index.lookup('someone@amazon.com') == 'AmazonUsers'
+
+
+def test_loader_rejects_unknown_tiers(tmp_path):
+    path = tmp_path / 'rules.json'
+    write_rules(path, {
+        'groups': {'PartnerTier1': {'tier': 'GoldUsers'}},
+        'rules': [{'domain': 'asu.edu', 'group': 'PartnerTier1'}],
+    })
+
+    assert loader_for(path).get_index().lookup('someone@asu.edu') == 'DefaultUsers'
+
+
+def test_loader_keeps_last_good_rules(tmp_path):
+    path = tmp_path / 'rules.json'
+    write_rules(path, {
+        'groups': {'PartnerTier1': {'tier': 'AmazonUsers'}},
+        'rules': [{'domain': 'asu.edu', 'group': 'PartnerTier1'}],
+    })
+    loader = loader_for(path)
+    loader._checked_refresh()
+    assert loader.get_index().lookup('someone@asu.edu') == 'PartnerTier1'
+
+    write_rules(path, {'rules': [{'domain': 'asu.edu', 'group': 'Unknown'}]})
+    loader._checked_refresh()
+
+    assert loader.get_index().lookup('someone@asu.edu') == 'PartnerTier1'
+    assert loader.get_index().tier('PartnerTier1') == 'AmazonUsers'
+
+
+def test_stale_refresh_does_not_block(tmp_path):
+    path = tmp_path / 'rules.json'
+    write_rules(path, {'rules': [{'domain': 'asu.edu', 'group': 'AmazonUsers'}]})
+    loader = loader_for(path, refresh_seconds=0)
+    first = loader.get_index()
+
+    refresh_started = threading.Event()
+    release_refresh = threading.Event()
+    refresh = loader._refresh
+
+    def slow_refresh():
+        refresh_started.set()
+        release_refresh.wait(5)
+        refresh()
+
+    loader._refresh = slow_refresh
+    write_rules(path, {'rules': [{'domain': 'asu.edu', 'group': 'AdminUsers'}]})
+
+    # The refresh runs in the background while callers get the cached rules
+    assert loader.get_index() is first
+    assert refresh_started.wait(5)
+    assert loader.get_index() is first
+
+    release_refresh.set()
+    with loader.lock:
+        pass
+    assert loader.get_index().lookup('someone@asu.edu') == 'AdminUsers'
+
+
+class RulesS3:
+    """
+    Serves a rules document until it is deleted. Like S3 to a caller without
+    s3:ListBucket, reports the deleted object as AccessDenied.
+    """
+
+    def __init__(self, document):
+        self.document = document
+
+    def get_object(self, **params):
+        if self.document is None:
+            raise ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'Access Denied'}}, 'GetObject')
+        return {'Body': io.BytesIO(json.dumps(self.document).encode('utf-8')), 'ETag': '"1"'}
+
+
+def test_deleted_s3_rules_without_list_access_revert_to_the_fallback():
+    s3 = RulesS3({'rules': [{'domain': 'asu.edu', 'group': 'AdminUsers'}]})
+    loader = loader_for('s3://bucket/config/domain-rules.json')
+    loader.s3 = s3
+    assert loader.get_index().lookup('someone@asu.edu') == 'AdminUsers'
+
+    s3.document = None
+    loader._checked_refresh()
+
+    assert loader.get_index().lookup('someone@asu.edu') == 'DefaultUsers'
+    assert loader.get_index().lookup('someone@amazon.com') == 'AmazonUsers'
@@ -0,0 +1,104 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from request_schema import (  # noqa: E402
+    FIRST_SIGN_IN_SCHEMA, UPLOAD_HISTORY_SCHEMA, UPLOAD_QUOTA_SCHEMA,
+    IntegerField, RequestSchema, StringField, format_errors
+)
+
+SUB = '0f8fad5b-d9cb-469f-a165-70867728950e'
+
+
+def first_sign_in(**overrides):
+    body = {'sub': SUB, 'organization': 'ASU', 'country': 'us', 'state': 'az', 'city': 'Tempe'}
+    body.update(overrides)
+    return body
+
+
+def test_first_sign_in_normalises_fields():
+    cleaned, errors = FIRST_SIGN_IN_SCHEMA.validate(first_sign_in(organization='  Arizona \n State  '))
+
+    assert errors == {}
+    assert cleaned == {'sub': SUB, 'organization': 'Arizona State', 'country': 'US', 'state': 'AZ', 'city': 'Tempe'}
+
+
+@pytest.mark.parametrize('overrides, field, error', [
+    ({'sub': None}, 'sub', 'is required'),
+    ({'sub': 'not-a-uuid'}, 'sub', 'has an invalid format'),
+    ({'organization': '   '}, 'organization', 'is required'),
+    ({'organization': 12}, 'organization', 'must be a string'),
+    ({'organization': 'x' * 257}, 'organization', 'must be at most 256 characters'),
+    ({'city': 'Tempe\x00'}, 'city', 'must not contain control characters'),
+    ({'country': 'ZZ'}, 'country', 'is not a recognised country code'),
+    ({'country': 'USA'}, 'country', 'must be at most 2 characters'),
+    ({'state': 'A Z'}, 'state', 'has an invalid format'),
+    ({'state': 'ZZ'}, 'state', 'is not a recognised state code for country US'),
+])
+def test_first_sign_in_errors(overrides, field, error):
+    _, errors = FIRST_SIGN_IN_SCHEMA.validate(first_sign_in(**overrides))
+    assert errors == {field: error}
+
+
+def test_state_is_only_checked_where_subdivisions_are_known():
+    _, errors = FIRST_SIGN_IN_SCHEMA.validate(first_sign_in(country='FR', state='IDF'))
+    assert errors == {}
+
+
+def test_validators_wait_for_valid_fields():
+    # An invalid country would otherwise make the state check look up the wrong codes
+    _, errors = FIRST_SIGN_IN_SCHEMA.validate(first_sign_in(country='ZZ', state='ZZ'))
+    assert errors == {'country': 'is not a recognised country code'}
+
+
+def test_body_must_be_an_object():
+    assert FIRST_SIGN_IN_SCHEMA.validate(['not', 'an', 'object']) == ({}, {'body': 'must be a JSON object'})
+
+
+def test_upload_quota_mode_choices():
+    _, errors = UPLOAD_QUOTA_SCHEMA.validate({'sub': SUB, 'mode': 'reset'})
+    assert errors == {'mode': 'must be one of: check, increment'}
+
+
+@pytest.mark.parametrize('key, cleaned_key, error', [
+    (None, None, None),
+    (' pdf/a b.pdf ', ' pdf/a b.pdf ', None),
+    ('', None, 'must not be empty'),
+    ('k' * 1025, None, 'must be at most 1024 characters'),
+])
+def test_upload_quota_idempotency_key(key, cleaned_key, error):
+    cleaned, errors = UPLOAD_QUOTA_SCHEMA.validate({'sub': SUB, 'mode': 'increment', 'idempotencyKey': key})
+
+    assert cleaned.get('idempotencyKey') == cleaned_key
+    assert errors.get('idempotencyKey') == error
+
+
+@pytest.mark.parametrize('limit, cleaned_limit, error', [
+    (None, None, None),
+    ('', None, None),
+    (25, 25, None),
+    ('25', 25, None),
+    (0, None, 'must be between 1 and 100'),
+    (101, None, 'must be between 1 and 100'),
+    (True, None, 'must be an integer'),
+    (2.5, None, 'must be an integer'),
+    ('ten', None, 'must be an integer'),
+])
+def test_upload_history_limit(limit, cleaned_limit, error):
+    cleaned, errors = UPLOAD_HISTORY_SCHEMA.validate({'sub': SUB, 'limit': limit})
+
+    assert cleaned.get('limit') == cleaned_limit
+    assert errors.get('limit') == error
+
+
+def test_optional_blank_fields_are_absent_by_default():
+    schema = RequestSchema({'note': StringField(max_length=10, required=False), 'count': IntegerField(0, 5, False)})
+    assert schema.validate({'note': '  ', 'count': None}) == ({}, {})
+
+
+def test_format_errors():
+    assert format_errors({'city': 'is required', 'state': 'has an invalid format'}) == \
+        'Invalid request: city is required; state has an invalid format.'
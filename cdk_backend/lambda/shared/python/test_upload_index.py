@@ -0,0 +1,273 @@
+import os
+import re
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import upload_index  # noqa: E402
+from upload_index import (  # noqa: E402
+    CLAIM_PREFIX, SUMMARY_KEY, DynamoDBUploadIndex, SQLiteUploadIndex, decode_cursor, encode_cursor,
+    format_upload_time, parse_result_key, parse_upload_key, upload_owner_for_email
+)
+
+OWNER = 'someone_example_com'
+
+
+def upload_key(n):
+    return f'pdf/{OWNER}_2025010112304512{n}_report{n}.pdf'
+
+
+@pytest.fixture
+def index():
+    return SQLiteUploadIndex()
+
+
+def test_parse_upload_key():
+    assert parse_upload_key('pdf/a_b_x_com_20250101123045123_my_report.pdf') == {
+        'owner': 'a_b_x_com',
+        'uploaded_at': '20250101123045123',
+        'file_name': 'my_report.pdf',
+        'object_key': 'pdf/a_b_x_com_20250101123045123_my_report.pdf',
+    }
+
+
+@pytest.mark.parametrize('key', [
+    'pdf/someone_example_com_2025010112304_report.pdf',
+    'result/COMPLIANT_someone_example_com_20250101123045123_report.pdf',
+    'temp/someone_example_com_20250101123045123_report.pdf',
+])
+def test_parse_upload_key_rejects_other_keys(key):
+    assert parse_upload_key(key) is None
+
+
+def test_parse_result_key():
+    result_key = 'result/COMPLIANT_someone_example_com_20250101123045123_report.pdf'
+    assert parse_result_key(result_key) == {
+        'owner': 'someone_example_com',
+        'object_key': 'pdf/someone_example_com_20250101123045123_report.pdf',
+        'file_name': 'report.pdf',
+        'result_key': result_key,
+    }
+    assert parse_result_key('pdf/someone_example_com_20250101123045123_report.pdf') is None
+
+
+def test_emails_can_share_a_key_prefix():
+    assert upload_owner_for_email('a.b@x.com') == upload_owner_for_email('a_b@x.com') == 'a_b_x_com'
+
+
+def test_format_upload_time():
+    assert format_upload_time('20250101123045123') == '2025-01-01T12:30:45.123Z'
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(upload_key(1))) == upload_key(1)
+
+
+@pytest.mark.parametrize('cursor', [
+    'not base64!',
+    encode_cursor('result/COMPLIANT_someone_example_com_20250101123045121_report1.pdf'),
+    encode_cursor(SUMMARY_KEY),
+])
+def test_invalid_cursors(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_history_pages_end_without_an_empty_page(index):
+    index.record_uploads(OWNER, [parse_upload_key(upload_key(n)) for n in range(4)])
+
+    first, after_key = index.list_history(OWNER, limit=2)
+    second, last_key = index.list_history(OWNER, limit=2, after_key=after_key)
+
+    assert [item['object_key'] for item in first + second] == [upload_key(n) for n in (3, 2, 1, 0)]
+    assert last_key is None
+
+
+def test_claims_keep_the_first_user(index):
+    assert index.claim_upload(upload_key(1), 'sub-a')
+    assert index.claim_upload(upload_key(1), 'sub-a')
+    assert not index.claim_upload(upload_key(1), 'sub-b')
+    index.claim_upload(upload_key(2), 'sub-b')
+
+    owners = index.resolve_owners(OWNER, [upload_key(1), upload_key(2), upload_key(3)])
+
+    assert owners == {upload_key(1): 'sub-a', upload_key(2): 'sub-b'}
+
+
+def test_reservations_count_towards_the_limit(index):
+    assert index.reserve(OWNER, upload_key(1), limit=2) == 1
+    assert index.reserve(OWNER, upload_key(2), limit=2) == 2
+    assert index.reserve(OWNER, upload_key(3), limit=2) is None
+    assert index.usage(OWNER) == (0, 2)
+
+
+def test_reserving_a_key_again_takes_no_extra_slot(index):
+    assert index.reserve(OWNER, upload_key(1), limit=1) == 1
+    assert index.reserve(OWNER, upload_key(1), limit=1) == 1
+
+
+def test_arrival_turns_a_reservation_into_an_upload(index):
+    index.reserve(OWNER, upload_key(1), limit=2)
+    index.reserve(OWNER, upload_key(2), limit=2)
+
+    assert index.record_uploads(OWNER, [parse_upload_key(upload_key(1))]) == 1
+
+    assert index.usage(OWNER) == (1, 1)
+    assert index.reserve(OWNER, upload_key(3), limit=2) is None
+
+
+def test_the_floor_counts_uploads_from_before_the_index(index):
+    assert index.reserve(OWNER, upload_key(1), limit=3, floor=2) == 3
+    assert index.reserve(OWNER, upload_key(2), limit=3, floor=2) is None
+
+
+def test_expired_reservations_free_their_slot():
+    index = SQLiteUploadIndex(reservation_ttl_seconds=-1)
+    assert index.reserve(OWNER, upload_key(1), limit=1) == 1
+    assert index.usage(OWNER) == (0, 0)
+    assert index.reserve(OWNER, upload_key(2), limit=1) == 1
+
+
+# Reserved words from the DynamoDB developer guide; attribute names that are
+# reserved must go through ExpressionAttributeNames.
+RESERVED_WORDS = frozenset("""
+ABORT ABSOLUTE ACTION ADD AFTER AGENT AGGREGATE ALL ALLOCATE ALTER ANALYZE AND ANY ARCHIVE ARE ARRAY AS ASC
+ASCII ASENSITIVE ASSERTION ASYMMETRIC AT ATOMIC ATTACH ATTRIBUTE AUTH AUTHORIZATION AUTHORIZE AUTO AVG BACK
+BACKUP BASE BATCH BEFORE BEGIN BETWEEN BIGINT BINARY BIT BLOB BLOCK BOOLEAN BOTH BREADTH BUCKET BULK BY BYTE
+CALL CALLED CALLING CAPACITY CASCADE CASCADED CASE CAST CATALOG CHAR CHARACTER CHECK CLASS CLOB CLOSE CLUSTER
+CLUSTERED CLUSTERING CLUSTERS COALESCE COLLATE COLLATION COLLECTION COLUMN COLUMNS COMBINE COMMENT COMMIT
+COMPACT COMPILE COMPRESS CONDITION CONFLICT CONNECT CONNECTION CONSISTENCY CONSISTENT CONSTRAINT CONSTRAINTS
+CONSTRUCTOR CONSUMED CONTINUE CONVERT COPY CORRESPONDING COUNT COUNTER CREATE CROSS CUBE CURRENT CURSOR CYCLE
+DATA DATABASE DATE DATETIME DAY DEALLOCATE DEC DECIMAL DECLARE DEFAULT DEFERRABLE DEFERRED DEFINE DEFINED
+DEFINITION DELETE DELIMITED DEPTH DEREF DESC DESCRIBE DESCRIPTOR DETACH DETERMINISTIC DIAGNOSTICS DIRECTORIES
+DISABLE DISCONNECT DISTINCT DISTRIBUTE DO DOMAIN DOUBLE DROP DUMP DURATION DYNAMIC EACH ELEMENT ELSE ELSEIF
+EMPTY ENABLE END EQUAL EQUALS ERROR ESCAPE ESCAPED EVAL EVALUATE EXCEEDED EXCEPT EXCEPTION EXCEPTIONS
+EXCLUSIVE EXEC EXECUTE EXISTS EXIT EXPLAIN EXPLODE EXPORT EXPRESSION EXTENDED EXTERNAL EXTRACT FAIL FALSE
+FAMILY FETCH FIELDS FILE FILTER FILTERING FINAL FINISH FIRST FIXED FLATTERN FLOAT FOR FORCE FOREIGN FORMAT
+FORWARD FOUND FREE FROM FULL FUNCTION FUNCTIONS GENERAL GENERATE GET GLOB GLOBAL GO GOTO GRANT GREATER GROUP
+GROUPING HANDLER HASH HAVE HAVING HEAP HIDDEN HOLD HOUR IDENTIFIED IDENTITY IF IGNORE IMMEDIATE IMPORT IN
+INCLUDING INCLUSIVE INCREMENT INCREMENTAL INDEX INDEXED INDEXES INDICATOR INFINITE INITIALLY INLINE INNER
+INNTER INOUT INPUT INSENSITIVE INSERT INSTEAD INT INTEGER INTERSECT INTERVAL INTO INVALIDATE IS ISOLATION
+ITEM ITEMS ITERATE JOIN KEY KEYS LAG LANGUAGE LARGE LAST LATERAL LEAD LEADING LEAVE LEFT LENGTH LESS LEVEL
+LIKE LIMIT LIMITED LINES LIST LOAD LOCAL LOCALTIME LOCALTIMESTAMP LOCATION LOCATOR LOCK LOCKS LOG LOGED LONG
+LOOP LOWER MAP MATCH MATERIALIZED MAX MAXLEN MEMBER MERGE METHOD METRICS MIN MINUS MINUTE MISSING MOD MODE
+MODIFIES MODIFY MODULE MONTH MULTI MULTISET NAME NAMES NATIONAL NATURAL NCHAR NCLOB NEW NEXT NO NONE NOT NULL
+NULLIF NUMBER NUMERIC OBJECT OF OFFLINE OFFSET OLD ON ONLINE ONLY OPAQUE OPEN OPERATOR OPTION OR ORDER
+ORDINALITY OTHER OTHERS OUT OUTER OUTPUT OVER OVERLAPS OVERRIDE OWNER PAD PARALLEL PARAMETER PARAMETERS
+PARTIAL PARTITION PARTITIONED PARTITIONS PATH PERCENT PERCENTILE PERMISSION PERMISSIONS PIPE PIPELINED PLAN
+POOL POSITION PRECISION PREPARE PRESERVE PRIMARY PRIOR PRIVATE PRIVILEGES PROCEDURE PROCESSED PROJECT
+PROJECTION PROPERTY PROVISIONING PUBLIC PUT QUERY QUIT QUORUM RAISE RANDOM RANGE RANK RAW READ READS REAL
+REBUILD RECORD RECURSIVE REDUCE REF REFERENCE REFERENCES REFERENCING REGEXP REGION REINDEX RELATIVE RELEASE
+REMAINDER RENAME REPEAT REPLACE REQUEST RESET RESIGNAL RESOURCE RESPONSE RESTORE RESTRICT RESULT RETURN
+RETURNING RETURNS REVERSE REVOKE RIGHT ROLE ROLES ROLLBACK ROLLUP ROUTINE ROW ROWS RULE RULES SAMPLE
+SATISFIES SAVE SAVEPOINT SCAN SCHEMA SCOPE SCROLL SEARCH SECOND SECTION SEGMENT SEGMENTS SELECT SELF SEMI
+SENSITIVE SEPARATE SEQUENCE SERIALIZABLE SESSION SET SETS SHARD SHARE SHARED SHORT SHOW SIGNAL SIMILAR SIZE
+SKEWED SMALLINT SNAPSHOT SOME SOURCE SPACE SPACES SPARSE SPECIFIC SPECIFICTYPE SPLIT SQL SQLCODE SQLERROR
+SQLEXCEPTION SQLSTATE SQLWARNING START STATE STATIC STATUS STORAGE STORE STORED STREAM STRING STRUCT STYLE
+SUB SUBMULTISET SUBPARTITION SUBSTRING SUBTYPE SUM SUPER SYMMETRIC SYNONYM SYSTEM TABLE TABLESAMPLE TEMP
+TEMPORARY TERMINATED TEXT THAN THEN THROUGHPUT TIME TIMESTAMP TIMEZONE TINYINT TO TOKEN TOTAL TOUCH TRAILING
+TRANSACTION TRANSFORM TRANSLATE TRANSLATION TREAT TRIGGER TRIM TRUE TRUNCATE TTL TUPLE TYPE UNDER UNDO UNION
+UNIQUE UNIT UNKNOWN UNLOGGED UNNEST UNPROCESSED UNSIGNED UNTIL UPDATE UPPER URL USAGE USE USER USERS USING
+UUID VACUUM VALUE VALUED VALUES VARCHAR VARIABLE VARIANCE VARINT VARYING VIEW VIEWS VIRTUAL VOID WAIT WHEN
+WHENEVER WHERE WHILE WINDOW WITH WITHIN WITHOUT WORK WRAPPED WRITE YEAR ZONE
+""".split())
+EXPRESSION_KEYWORDS = {'SET', 'ADD', 'REMOVE', 'DELETE', 'AND', 'OR', 'NOT', 'BETWEEN', 'IN'}
+EXPRESSIONS = ('UpdateExpression', 'ConditionExpression', 'KeyConditionExpression', 'ProjectionExpression')
+
+
+class RecordingTable:
+    """
+    Stands in for both the boto3 Table and its client, recording each call's parameters.
+    """
+
+    name = 'UploadIndex'
+
+    def __init__(self):
+        self.meta = SimpleNamespace(client=self)
+        self.calls = []
+        self.summary = {}
+        self.items = []
+
+    def _record(self, params, response=None):
+        self.calls.append(params)
+        return response or {}
+
+    def get_item(self, **params):
+        return self._record(params, {'Item': self.summary})
+
+    def update_item(self, **params):
+        return self._record(params)
+
+    def put_item(self, **params):
+        return self._record(params)
+
+    def query(self, **params):
+        return self._record(params, {'Items': self.items[:params['Limit']]})
+
+    def transact_write_items(self, TransactItems):
+        for item in TransactItems:
+            self._record(item['Update'])
+
+    def batch_get_item(self, RequestItems):
+        self._record(RequestItems[self.name])
+        return {'Responses': {self.name: [{'object_key': CLAIM_PREFIX + upload_key(1), 'owner_sub': 'sub-a'}]}}
+
+
+@pytest.fixture
+def table(monkeypatch):
+    table = RecordingTable()
+    monkeypatch.setattr(upload_index, 'boto3', SimpleNamespace(resource=lambda service: SimpleNamespace(
+        Table=lambda name: table
+    )))
+    return table
+
+
+def check_expressions(params):
+    names = params.get('ExpressionAttributeNames', {})
+    values = params.get('ExpressionAttributeValues', {})
+    used_names, used_values = set(), set()
+    for expression in (params.get(name) for name in EXPRESSIONS):
+        for token in re.findall(r'[#:]?[A-Za-z_][A-Za-z0-9_]*\(?', expression or ''):
+            if token.startswith('#'):
+                used_names.add(token)
+            elif token.startswith(':'):
+                used_values.add(token)
+            elif not token.endswith('(') and token not in EXPRESSION_KEYWORDS:
+                assert token.upper() not in RESERVED_WORDS, f'{token!r} is reserved in {expression!r}'
+    # DynamoDB also rejects placeholders that are defined but not used
+    assert used_names == set(names)
+    assert used_values == set(values)
+
+
+def test_dynamodb_expressions_avoid_reserved_words(table):
+    index = DynamoDBUploadIndex('UploadIndex')
+    uploads = [parse_upload_key(upload_key(1)), dict(parse_upload_key(upload_key(2)), size=1024)]
+    result = dict(parse_result_key(f'result/COMPLIANT_{OWNER}_20250101123045121_report1.pdf'), result_at='now')
+
+    index.claim_upload(upload_key(1), 'sub-a')
+    index.resolve_owners(OWNER, [upload_key(1), upload_key(2)])
+    index.reserve(OWNER, upload_key(1), limit=5)
+    table.summary = {'upload_count': 1, 'reservation_version': 2, 'reservations': {upload_key(2): 0}}
+    index.reserve(OWNER, upload_key(3), limit=5)
+    index.record_uploads(OWNER, uploads)
+    index.record_results(OWNER, [result])
+    index.list_history(OWNER, limit=2, after_key=upload_key(3))
+
+    assert len(table.calls) >= 9
+    for params in table.calls:
+        check_expressions(params)
+
+
+def test_dynamodb_history_queries_one_extra_item(table):
+    index = DynamoDBUploadIndex('UploadIndex')
+    table.items = [{'object_key': upload_key(n)} for n in (3, 2, 1)]
+
+    assert index.list_history(OWNER, limit=3) == (table.items, None)
+    items, last_key = index.list_history(OWNER, limit=2)
+
+    assert [item['object_key'] for item in items] == [upload_key(3), upload_key(2)]
+    assert last_key == upload_key(2)
+    assert table.calls[-1]['Limit'] == 3
@@ -0,0 +1,214 @@
+import importlib.util
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+from botocore.exceptions import ClientError
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import usage_counters  # noqa: E402
+from usage_counters import PENDING_SHARDS, DynamoDBUsageCounterStore, LocalUsageCounterStore, pending_key  # noqa: E402
+
+# Every Lambda's handler module is named 'index', so load this one under its own name
+_spec = importlib.util.spec_from_file_location(
+    'sync_usage_counters_index', os.path.join(HERE, '..', '..', 'syncUsageCounters', 'index.py')
+)
+sync = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(sync)
+
+
+def client_error(code, operation='UpdateItem'):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+
+class RecordingTable:
+    """
+    Stands in for the boto3 Table, recording each call's parameters. 'errors'
+    holds error codes to raise from the next update_item calls.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.errors = []
+        self.pending = {}
+
+    def update_item(self, **params):
+        self.calls.append(params)
+        if self.errors:
+            raise client_error(self.errors.pop(0))
+        return {'Attributes': {'upload_count': 4}}
+
+    def query(self, **params):
+        self.calls.append(params)
+        key = params['ExpressionAttributeValues'][':pending']
+        return {'Items': [{'user_sub': sub, 'upload_count': 1} for sub in self.pending.get(key, [])]}
+
+
+@pytest.fixture
+def table(monkeypatch):
+    table = RecordingTable()
+    monkeypatch.setattr(usage_counters, 'boto3', SimpleNamespace(resource=lambda service: SimpleNamespace(
+        Table=lambda name: table
+    )))
+    return table
+
+
+def test_pending_keys_spread_users_over_the_shards():
+    keys = {pending_key(f'user-{n}') for n in range(200)}
+
+    assert len(keys) == PENDING_SHARDS
+    assert pending_key('user-1') == pending_key('user-1')
+
+
+def test_dynamodb_increment_seeds_new_users_below_the_limit(table):
+    store = DynamoDBUsageCounterStore('UsageCounters')
+
+    assert store.increment('user-1', limit=5, seed=3) == 4
+
+    params = table.calls[-1]
+    assert params['Key'] == {'user_sub': 'user-1'}
+    assert params['UpdateExpression'].startswith('SET upload_count = if_not_exists(upload_count, :seed) + :one')
+    assert params['ConditionExpression'] == \
+        '(attribute_not_exists(upload_count) AND :seed < :limit) OR upload_count < :limit'
+    assert params['ExpressionAttributeValues'] == {
+        ':seed': 3, ':one': 1, ':limit': 5, ':pending': pending_key('user-1')
+    }
+
+
+def test_dynamodb_increment_at_the_limit(table):
+    store = DynamoDBUsageCounterStore('UsageCounters')
+
+    table.errors = ['ConditionalCheckFailedException']
+    assert store.increment('user-1', limit=5) is None
+
+    table.errors = ['ProvisionedThroughputExceededException']
+    with pytest.raises(ClientError):
+        store.increment('user-1', limit=5)
+
+
+def test_dynamodb_pending_reads_every_shard(table):
+    store = DynamoDBUsageCounterStore('UsageCounters')
+    table.pending = {pending_key('user-1'): ['user-1'], pending_key('user-2'): ['user-2']}
+
+    assert sorted(store.pending()) == [('user-1', 1), ('user-2', 1)]
+    assert len(table.calls) == PENDING_SHARDS
+
+
+def test_dynamodb_mark_synced_is_superseded_by_a_newer_count(table):
+    store = DynamoDBUsageCounterStore('UsageCounters')
+
+    assert store.mark_synced('user-1', 4)
+    assert table.calls[-1]['ConditionExpression'] == 'upload_count = :count'
+
+    table.errors = ['ConditionalCheckFailedException']
+    assert not store.mark_synced('user-1', 4)
+
+
+def test_local_increment_seeds_new_users_and_stops_at_the_limit():
+    store = LocalUsageCounterStore()
+
+    assert store.increment('user-1', limit=3, seed=2) == 3
+    assert store.increment('user-1', limit=3, seed=2) is None
+    assert store.increment('user-2', limit=3, seed=3) is None
+    assert store.get('user-2') is None
+
+
+def test_local_mark_synced_is_superseded_by_a_newer_count():
+    store = LocalUsageCounterStore()
+    store.increment('user-1', limit=5)
+    store.increment('user-1', limit=5)
+
+    assert not store.mark_synced('user-1', 1)
+    assert list(store.pending()) == [('user-1', 2)]
+    assert store.mark_synced('user-1', 2)
+    assert list(store.pending()) == []
+
+
+class FakeCognito:
+    """
+    Records attribute updates; 'errors' maps a sub to the error code its updates raise.
+    """
+
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.updated = {}
+
+    def admin_update_user_attributes(self, UserPoolId, Username, UserAttributes):
+        if Username in self.errors:
+            raise client_error(self.errors[Username], 'AdminUpdateUserAttributes')
+        self.updated[Username] = UserAttributes[0]['Value']
+
+
+class Context:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = list(remaining_ms)
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms.pop(0) if len(self.remaining_ms) > 1 else self.remaining_ms[0]
+
+
+def counters(*subs):
+    store = LocalUsageCounterStore()
+    for sub in subs:
+        store.increment(sub, limit=5)
+    return store
+
+
+def test_sync_copies_counts_and_clears_them(monkeypatch):
+    cognito = FakeCognito()
+    monkeypatch.setattr(sync, 'cognito_client', cognito)
+    store = counters('user-1', 'user-2')
+
+    summary = sync.sync_pending_counters(store, Context([60000]))
+
+    assert summary == {'synced': 2, 'superseded': 0, 'failed': 0, 'remaining': False}
+    assert cognito.updated == {'user-1': '1', 'user-2': '1'}
+    assert list(store.pending()) == []
+
+
+def test_sync_stops_when_time_runs_low(monkeypatch):
+    monkeypatch.setattr(sync, 'cognito_client', FakeCognito())
+    store = counters('user-1', 'user-2', 'user-3')
+
+    summary = sync.sync_pending_counters(store, Context([60000, sync.TIME_RESERVE_MS - 1]))
+
+    assert summary == {'synced': 1, 'superseded': 0, 'failed': 0, 'remaining': True}
+    assert len(list(store.pending())) == 2
+
+
+def test_sync_drops_users_that_no_longer_exist(monkeypatch):
+    monkeypatch.setattr(sync, 'cognito_client', FakeCognito({'user-1': 'UserNotFoundException'}))
+    store = counters('user-1')
+
+    assert sync.sync_pending_counters(store)['synced'] == 1
+    assert list(store.pending()) == []
+
+
+def test_sync_keeps_failed_updates_pending(monkeypatch):
+    monkeypatch.setattr(sync, 'cognito_client', FakeCognito({'user-1': 'InternalErrorException'}))
+    store = counters('user-1', 'user-2')
+
+    summary = sync.sync_pending_counters(store)
+
+    assert summary == {'synced': 1, 'superseded': 0, 'failed': 1, 'remaining': False}
+    assert list(store.pending()) == [('user-1', 1)]
+
+
+def test_sync_leaves_counts_that_change_meanwhile_pending(monkeypatch):
+    store = counters('user-1')
+    cognito = FakeCognito()
+    update = cognito.admin_update_user_attributes
+
+    def upload_during_update(**kwargs):
+        update(**kwargs)
+        store.increment('user-1', limit=5)
+
+    cognito.admin_update_user_attributes = upload_during_update
+    monkeypatch.setattr(sync, 'cognito_client', cognito)
+
+    assert sync.sync_pending_counters(store)['superseded'] == 1
+    assert list(store.pending()) == [('user-1', 2)]
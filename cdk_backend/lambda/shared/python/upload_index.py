@@ -0,0 +1,490 @@
+import base64
+import json
+import re
+import sqlite3
+import threading
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+# Upload keys are built by UploadSection.jsx as
+#   pdf/{sanitizedEmail}_{timestamp}_{sanitizedFileName}
+# where the timestamp is the ISO time with separators removed (17 digits).
+UPLOAD_KEY_PATTERN = re.compile(r'^pdf/(.+?)_(\d{17})_(.+)$')
+# The remediation pipeline writes each result as result/COMPLIANT_{upload file name}.
+RESULT_KEY_PATTERN = re.compile(r'^result/COMPLIANT_((.+?)_(\d{17})_(.+))$')
+_NON_ALPHANUMERIC = re.compile(r'[^a-zA-Z0-9]')
+
+# Sort key of each owner's summary item; upload items use their object key.
+SUMMARY_KEY = '#summary'
+# Sort key prefix of claims, which record the user sub that asked to upload a key
+CLAIM_PREFIX = '#claim#'
+# DynamoDB transactions hold at most 100 items; one is the summary update.
+MAX_UPLOADS_PER_TRANSACTION = 99
+MAX_KEYS_PER_BATCH_GET = 100
+# Seconds a reservation holds an upload slot if its object never arrives
+RESERVATION_TTL_SECONDS = 900
+# Attempts at a reservation when concurrent requests change the summary first
+RESERVE_ATTEMPTS = 5
+
+
+def upload_owner_for_email(email):
+    """
+    Returns the key prefix that UploadSection.jsx derives from a user's email.
+    Different emails can share a prefix (a.b@x.com and a_b@x.com), so the
+    prefix only identifies uploads that no user has claimed.
+    """
+    return _NON_ALPHANUMERIC.sub('_', email or 'user')
+
+
+def parse_upload_key(key):
+    """
+    Splits an upload key into {'owner', 'uploaded_at', 'file_name', 'object_key'},
+    or returns None for keys that UploadSection.jsx did not build.
+    """
+    match = UPLOAD_KEY_PATTERN.match(key)
+    if not match:
+        return None
+    owner, uploaded_at, file_name = match.groups()
+    return {'owner': owner, 'uploaded_at': uploaded_at, 'file_name': file_name, 'object_key': key}
+
+
+def parse_result_key(key):
+    """
+    Splits a result key into {'owner', 'object_key', 'file_name', 'result_key'}, where
+    'object_key' is the upload the result belongs to, or returns None for other keys.
+    """
+    match = RESULT_KEY_PATTERN.match(key)
+    if not match:
+        return None
+    upload_name, owner, _, file_name = match.groups()
+    return {'owner': owner, 'object_key': f'pdf/{upload_name}', 'file_name': file_name, 'result_key': key}
+
+
+def format_upload_time(uploaded_at):
+    """
+    Turns a key timestamp such as '20250101123045123' back into ISO 8601.
+    """
+    t = uploaded_at
+    return f'{t[0:4]}-{t[4:6]}-{t[6:8]}T{t[8:10]}:{t[10:12]}:{t[12:14]}.{t[14:17]}Z'
+
+
+def encode_cursor(object_key):
+    return base64.urlsafe_b64encode(json.dumps({'k': object_key}).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Returns the upload key a history cursor continues after, or raises ValueError
+    if the cursor is malformed. A cursor only positions a query within the caller's
+    own uploads, so it needs no owner check.
+    """
+    try:
+        object_key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))['k']
+    except Exception:
+        raise ValueError('invalid cursor')
+    if not isinstance(object_key, str) or parse_upload_key(object_key) is None:
+        raise ValueError('invalid cursor')
+    return object_key
+
+
+# ---------------------------------------------------------------------
+#                          DynamoDB Index
+# ---------------------------------------------------------------------
+class DynamoDBUploadIndex:
+    """
+    Per-user index of uploads and their results in a DynamoDB table.
+
+    Table layout: partition key 'owner', sort key 'object_key'. The owner of an
+    upload is the Cognito sub that claimed its key through the quota API, or
+    for unclaimed uploads the sanitised email prefix of the key. Claims are kept
+    under the key prefix as '#claim#<object key>' items holding 'owner_sub'.
+    Each upload is one item, which gains a 'result_key'
+    when its result is written; the '#summary' item holds the owner's
+    'upload_count' and 'last_uploaded_at', so usage is a single read. Upload keys
+    embed their timestamp, so an owner's items sort by upload time.
+
+    The summary also holds 'reservations', a map of object key -> expiry time for
+    uploads allowed but not yet arrived, and 'reservation_version', which every
+    reservation bumps so that concurrent reservations cannot both take the last slot.
+    """
+
+    def __init__(self, table_name, reservation_ttl_seconds=RESERVATION_TTL_SECONDS):
+        self.table = boto3.resource('dynamodb').Table(table_name)
+        # The resource's client accepts plain Python values, like the Table methods.
+        self.client = self.table.meta.client
+        self.reservation_ttl_seconds = reservation_ttl_seconds
+
+    def claim_upload(self, object_key, user_sub):
+        """
+        Records that 'user_sub' is uploading 'object_key', so the upload is indexed
+        under their sub when it arrives. Returns False if another user claimed the
+        key first.
+        """
+        try:
+            self.table.put_item(
+                Item={
+                    'owner': parse_upload_key(object_key)['owner'],
+                    'object_key': CLAIM_PREFIX + object_key,
+                    'owner_sub': user_sub,
+                },
+                ConditionExpression='attribute_not_exists(owner_sub) OR owner_sub = :sub',
+                ExpressionAttributeValues={':sub': user_sub}
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def resolve_owners(self, key_owner, object_keys):
+        """
+        Returns {object key: user sub} for the claimed keys among 'object_keys',
+        all of which have the key prefix 'key_owner'.
+        """
+        owners = {}
+        object_keys = list(object_keys)
+        for start in range(0, len(object_keys), MAX_KEYS_PER_BATCH_GET):
+            request = {self.table.name: {
+                'Keys': [
+                    {'owner': key_owner, 'object_key': CLAIM_PREFIX + object_key}
+                    for object_key in object_keys[start:start + MAX_KEYS_PER_BATCH_GET]
+                ],
+                'ProjectionExpression': 'object_key, owner_sub',
+                'ConsistentRead': True,
+            }}
+            while request:
+                response = self.client.batch_get_item(RequestItems=request)
+                for item in response.get('Responses', {}).get(self.table.name, []):
+                    owners[item['object_key'][len(CLAIM_PREFIX):]] = item['owner_sub']
+                request = response.get('UnprocessedKeys')
+        return owners
+
+    def _summary(self, owner, consistent=False):
+        return self.table.get_item(
+            Key={'owner': owner, 'object_key': SUMMARY_KEY}, ConsistentRead=consistent
+        ).get('Item') or {}
+
+    def count(self, owner):
+        """
+        Returns the owner's number of uploads, or None if the index has none.
+        """
+        item = self._summary(owner)
+        return int(item['upload_count']) if 'upload_count' in item else None
+
+    def usage(self, owner):
+        """
+        Returns (uploads, reservations): the owner's number of uploads and of
+        unexpired reservations.
+        """
+        item = self._summary(owner, consistent=True)
+        now = time.time()
+        active = [key for key, expires_at in item.get('reservations', {}).items() if expires_at > now]
+        return int(item.get('upload_count', 0)), len(active)
+
+    def reserve(self, owner, reservation_key, limit, floor=0):
+        """
+        Takes one of the owner's 'limit' upload slots for an upload on its way to S3,
+        so that requests made before earlier objects arrive still see them. Usage is
+        the larger of the upload count and 'floor' (uploads counted elsewhere), plus
+        unexpired reservations. record_uploads clears the reservation of each upload
+        it indexes; others expire after reservation_ttl_seconds. Reserving a key
+        again only extends it.
+
+        Returns the usage including the reservation, or None if the limit has been reached.
+        """
+        for attempt in range(RESERVE_ATTEMPTS):
+            item = self._summary(owner, consistent=True)
+            now = int(time.time())
+            reservations = item.get('reservations', {})
+            expired = [key for key, expires_at in reservations.items() if expires_at <= now and key != reservation_key]
+            active = len(reservations) - len(expired) - (1 if reservation_key in reservations else 0)
+            used = max(int(item.get('upload_count', 0)), floor) + active
+            if used >= limit:
+                return None
+
+            expires_at = now + self.reservation_ttl_seconds
+            names = {}
+            values = {':one': 1}
+            if 'reservations' in item:
+                names['#key'] = reservation_key
+                values[':expires_at'] = expires_at
+                expression = 'SET reservations.#key = :expires_at'
+            else:
+                values[':reservations'] = {reservation_key: expires_at}
+                expression = 'SET reservations = :reservations'
+            expression += ' ADD reservation_version :one'
+            if expired:
+                names.update({f'#expired{index}': key for index, key in enumerate(expired)})
+                expression += ' REMOVE ' + ', '.join(f'reservations.#expired{index}' for index in range(len(expired)))
+
+            # Fails if an upload arrived or another reservation was made since the read
+            conditions = []
+            for attribute in ('upload_count', 'reservation_version'):
+                if attribute in item:
+                    conditions.append(f'{attribute} = :{attribute}')
+                    values[f':{attribute}'] = item[attribute]
+                else:
+                    conditions.append(f'attribute_not_exists({attribute})')
+
+            params = {
+                'Key': {'owner': owner, 'object_key': SUMMARY_KEY},
+                'UpdateExpression': expression,
+                'ConditionExpression': ' AND '.join(conditions),
+                'ExpressionAttributeValues': values,
+            }
+            if names:
+                params['ExpressionAttributeNames'] = names
+            try:
+                self.table.update_item(**params)
+                return used + 1
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException' \
+                        or attempt == RESERVE_ATTEMPTS - 1:
+                    raise
+
+    def record_uploads(self, owner, uploads):
+        """
+        Adds uploads (as returned by parse_upload_key, plus optional 'size') for one
+        owner and increases their count by the number that are new. S3 may deliver an
+        event more than once, so uploads already in the index are skipped. Each chunk
+        of uploads and the count update are written in one transaction.
+
+        Returns the number of uploads added.
+        """
+        added = 0
+        for start in range(0, len(uploads), MAX_UPLOADS_PER_TRANSACTION):
+            chunk = uploads[start:start + MAX_UPLOADS_PER_TRANSACTION]
+            added += self._record_chunk(owner, chunk)
+            # Also after a redelivery, in case an earlier attempt stopped before this
+            self._clear_reservations(owner, [upload['object_key'] for upload in chunk])
+        return added
+
+    def _record_chunk(self, owner, uploads):
+        while uploads:
+            items = [self._upload_update(owner, upload) for upload in uploads]
+            items.append({
+                'Update': {
+                    'TableName': self.table.name,
+                    'Key': {'owner': owner, 'object_key': SUMMARY_KEY},
+                    'UpdateExpression': 'ADD upload_count :n SET last_uploaded_at = :last',
+                    'ExpressionAttributeValues': {
+                        ':n': len(uploads),
+                        ':last': max(upload['uploaded_at'] for upload in uploads),
+                    },
+                }
+            })
+            try:
+                self.client.transact_write_items(TransactItems=items)
+                return len(uploads)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'TransactionCanceledException':
+                    raise
+                reasons = e.response.get('CancellationReasons', [])
+                duplicates = {
+                    index for index, reason in enumerate(reasons[:len(uploads)])
+                    if reason.get('Code') == 'ConditionalCheckFailed'
+                }
+                if not duplicates:
+                    raise
+                # Drop the uploads that are already indexed and retry the rest.
+                uploads = [upload for index, upload in enumerate(uploads) if index not in duplicates]
+        return 0
+
+    def _clear_reservations(self, owner, object_keys):
+        names = {f'#key{index}': key for index, key in enumerate(object_keys)}
+        try:
+            self.table.update_item(
+                Key={'owner': owner, 'object_key': SUMMARY_KEY},
+                UpdateExpression='REMOVE ' + ', '.join(f'reservations.{name}' for name in names),
+                ConditionExpression='attribute_exists(reservations)',
+                ExpressionAttributeNames=names
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+    def _upload_update(self, owner, upload):
+        # An update rather than a put, so a result indexed before its upload is kept
+        expression = 'SET uploaded_at = :uploaded_at, file_name = :file_name'
+        values = {':uploaded_at': upload['uploaded_at'], ':file_name': upload['file_name']}
+        if upload.get('size') is not None:
+            # 'size' is a DynamoDB reserved word
+            expression += ', #size = :size'
+            values[':size'] = upload['size']
+        update = {
+            'TableName': self.table.name,
+            'Key': {'owner': owner, 'object_key': upload['object_key']},
+            'UpdateExpression': expression,
+            'ConditionExpression': 'attribute_not_exists(uploaded_at)',
+            'ExpressionAttributeValues': values,
+        }
+        if upload.get('size') is not None:
+            update['ExpressionAttributeNames'] = {'#size': 'size'}
+        return {'Update': update}
+
+    def record_results(self, owner, results):
+        """
+        Attaches results (as returned by parse_result_key, plus optional 'result_at')
+        to their uploads. Returns the number of results recorded.
+        """
+        for result in results:
+            expression = 'SET result_key = :result_key, file_name = if_not_exists(file_name, :file_name)'
+            values = {':result_key': result['result_key'], ':file_name': result['file_name']}
+            if result.get('result_at'):
+                expression += ', result_at = :result_at'
+                values[':result_at'] = result['result_at']
+            self.table.update_item(
+                Key={'owner': owner, 'object_key': result['object_key']},
+                UpdateExpression=expression,
+                ExpressionAttributeValues=values
+            )
+        return len(results)
+
+    def list_history(self, owner, limit, after_key=None):
+        """
+        Returns (items, last_key): up to 'limit' of the owner's uploads, newest first,
+        starting after the object key 'after_key'. 'last_key' is None on the last page.
+        """
+        params = {
+            'KeyConditionExpression': '#owner = :owner AND begins_with(object_key, :prefix)',
+            'ExpressionAttributeNames': {'#owner': 'owner'},
+            'ExpressionAttributeValues': {':owner': owner, ':prefix': 'pdf/'},
+            'ScanIndexForward': False,
+            # One extra item tells whether there is another page, as LastEvaluatedKey
+            # is also set when the page ends exactly at the last item.
+            'Limit': limit + 1,
+        }
+        if after_key:
+            params['ExclusiveStartKey'] = {'owner': owner, 'object_key': after_key}
+        items = self.table.query(**params).get('Items', [])
+        return items[:limit], items[limit - 1]['object_key'] if len(items) > limit else None
+
+
+# ---------------------------------------------------------------------
+#                          SQLite Index
+# ---------------------------------------------------------------------
+class SQLiteUploadIndex:
+    """
+    Stand-in for DynamoDBUploadIndex backed by SQLite, for local runs and tests.
+    The default database lives in memory; pass a file path to keep the index.
+    """
+
+    def __init__(self, path=':memory:', reservation_ttl_seconds=RESERVATION_TTL_SECONDS):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        self.reservation_ttl_seconds = reservation_ttl_seconds
+        with self.lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS uploads ('
+                ' owner TEXT NOT NULL, object_key TEXT NOT NULL, uploaded_at TEXT, file_name TEXT,'
+                ' size INTEGER, result_key TEXT, result_at TEXT, PRIMARY KEY (owner, object_key))'
+            )
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS claims (object_key TEXT PRIMARY KEY, owner_sub TEXT NOT NULL)'
+            )
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS reservations ('
+                ' owner TEXT NOT NULL, object_key TEXT NOT NULL, expires_at REAL NOT NULL,'
+                ' PRIMARY KEY (owner, object_key))'
+            )
+
+    def count(self, owner):
+        with self.lock:
+            (count,) = self.connection.execute(
+                'SELECT COUNT(*) FROM uploads WHERE owner = ? AND uploaded_at IS NOT NULL', (owner,)
+            ).fetchone()
+        return count or None
+
+    def claim_upload(self, object_key, user_sub):
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR IGNORE INTO claims (object_key, owner_sub) VALUES (?, ?)', (object_key, user_sub)
+            )
+            (owner_sub,) = self.connection.execute(
+                'SELECT owner_sub FROM claims WHERE object_key = ?', (object_key,)
+            ).fetchone()
+        return owner_sub == user_sub
+
+    def resolve_owners(self, key_owner, object_keys):
+        object_keys = list(object_keys)
+        with self.lock:
+            rows = self.connection.execute(
+                f'SELECT object_key, owner_sub FROM claims WHERE object_key IN ({", ".join("?" * len(object_keys))})',
+                object_keys
+            ).fetchall() if object_keys else []
+        return {row['object_key']: row['owner_sub'] for row in rows}
+
+    def _usage(self, owner, now, exclude_key=None):
+        # Called with the lock held
+        (uploads,) = self.connection.execute(
+            'SELECT COUNT(*) FROM uploads WHERE owner = ? AND uploaded_at IS NOT NULL', (owner,)
+        ).fetchone()
+        (reservations,) = self.connection.execute(
+            'SELECT COUNT(*) FROM reservations WHERE owner = ? AND expires_at > ? AND object_key IS NOT ?',
+            (owner, now, exclude_key)
+        ).fetchone()
+        return uploads, reservations
+
+    def usage(self, owner):
+        with self.lock:
+            return self._usage(owner, time.time())
+
+    def reserve(self, owner, reservation_key, limit, floor=0):
+        now = time.time()
+        with self.lock, self.connection:
+            uploads, reservations = self._usage(owner, now, exclude_key=reservation_key)
+            used = max(uploads, floor) + reservations
+            if used >= limit:
+                return None
+            self.connection.execute('DELETE FROM reservations WHERE owner = ? AND expires_at <= ?', (owner, now))
+            self.connection.execute(
+                'INSERT OR REPLACE INTO reservations (owner, object_key, expires_at) VALUES (?, ?, ?)',
+                (owner, reservation_key, now + self.reservation_ttl_seconds)
+            )
+        return used + 1
+
+    def record_uploads(self, owner, uploads):
+        added = 0
+        with self.lock, self.connection:
+            for upload in uploads:
+                self.connection.execute(
+                    'DELETE FROM reservations WHERE owner = ? AND object_key = ?', (owner, upload['object_key'])
+                )
+                self.connection.execute(
+                    'INSERT OR IGNORE INTO uploads (owner, object_key) VALUES (?, ?)', (owner, upload['object_key'])
+                )
+                added += self.connection.execute(
+                    'UPDATE uploads SET uploaded_at = ?, file_name = ?, size = ?'
+                    ' WHERE owner = ? AND object_key = ? AND uploaded_at IS NULL',
+                    (upload['uploaded_at'], upload['file_name'], upload.get('size'), owner, upload['object_key'])
+                ).rowcount
+        return added
+
+    def record_results(self, owner, results):
+        with self.lock, self.connection:
+            for result in results:
+                self.connection.execute(
+                    'INSERT OR IGNORE INTO uploads (owner, object_key) VALUES (?, ?)', (owner, result['object_key'])
+                )
+                self.connection.execute(
+                    'UPDATE uploads SET result_key = ?, result_at = COALESCE(?, result_at),'
+                    ' file_name = COALESCE(file_name, ?) WHERE owner = ? AND object_key = ?',
+                    (result['result_key'], result.get('result_at'), result['file_name'], owner, result['object_key'])
+                )
+        return len(results)
+
+    def list_history(self, owner, limit, after_key=None):
+        query = 'SELECT * FROM uploads WHERE owner = ?'
+        params = [owner]
+        if after_key:
+            query += ' AND object_key < ?'
+            params.append(after_key)
+        query += ' ORDER BY object_key DESC LIMIT ?'
+        params.append(limit + 1)
+        with self.lock:
+            rows = self.connection.execute(query, params).fetchall()
+        items = [{key: row[key] for key in row.keys() if row[key] is not None} for row in rows[:limit]]
+        return items, items[-1]['object_key'] if len(rows) > limit else None
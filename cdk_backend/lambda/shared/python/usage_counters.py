@@ -0,0 +1,159 @@
+import threading
+import zlib
+
+import boto3
+from botocore.exceptions import ClientError
+
+# Items whose count has not yet been copied to Cognito carry 'sync_pending'. It
+# is the key of a sparse index, so the sync job reads only those items. The value
+# is one of PENDING_SHARDS keys chosen by user, so that increments spread over
+# as many index partitions rather than all writing to one.
+PENDING_SHARDS = 16
+
+
+def pending_key(user_sub, shards=PENDING_SHARDS):
+    """
+    Returns the 'sync_pending' value of a user's counter, e.g. '16-05'.
+    """
+    return f'{shards}-{zlib.crc32(user_sub.encode("utf-8")) % shards:02d}'
+
+
+# ---------------------------------------------------------------------
+#                          DynamoDB Store
+# ---------------------------------------------------------------------
+class DynamoDBUsageCounterStore:
+    """
+    Authoritative per-user upload counters in a DynamoDB table.
+
+    Table layout: partition key 'user_sub'; attributes 'upload_count',
+    'synced_count' (last value written to Cognito) and 'sync_pending'
+    (see pending_key), which is indexed by the sparse GSI 'PendingSyncIndex'.
+    """
+
+    def __init__(self, table_name, pending_index_name='PendingSyncIndex', pending_shards=PENDING_SHARDS):
+        self.table = boto3.resource('dynamodb').Table(table_name)
+        self.pending_index_name = pending_index_name
+        self.pending_shards = pending_shards
+
+    def get(self, user_sub):
+        """
+        Returns the user's count, or None if the store has not seen the user yet.
+        """
+        item = self.table.get_item(Key={'user_sub': user_sub}, ConsistentRead=True).get('Item')
+        return int(item['upload_count']) if item and 'upload_count' in item else None
+
+    def increment(self, user_sub, limit, seed=0):
+        """
+        Atomically adds one upload if the count is below 'limit'. A user new to the store
+        starts from 'seed' (their current Cognito count). Returns the new count, or
+        None if the limit has been reached.
+        """
+        try:
+            response = self.table.update_item(
+                Key={'user_sub': user_sub},
+                UpdateExpression='SET upload_count = if_not_exists(upload_count, :seed) + :one, sync_pending = :pending',
+                ConditionExpression='(attribute_not_exists(upload_count) AND :seed < :limit) OR upload_count < :limit',
+                ExpressionAttributeValues={
+                    ':seed': seed, ':one': 1, ':limit': limit, ':pending': pending_key(user_sub, self.pending_shards)
+                },
+                ReturnValues='UPDATED_NEW'
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return None
+            raise
+        return int(response['Attributes']['upload_count'])
+
+    def add(self, user_sub, amount, seed=0):
+        """
+        Adds 'amount' uploads without a limit check. Returns the new count.
+        """
+        response = self.table.update_item(
+            Key={'user_sub': user_sub},
+            UpdateExpression='SET upload_count = if_not_exists(upload_count, :seed) + :amount, sync_pending = :pending',
+            ExpressionAttributeValues={
+                ':seed': seed, ':amount': amount, ':pending': pending_key(user_sub, self.pending_shards)
+            },
+            ReturnValues='UPDATED_NEW'
+        )
+        return int(response['Attributes']['upload_count'])
+
+    def pending(self):
+        """
+        Yields (user_sub, count) for every counter not yet copied to Cognito,
+        querying each pending key's index partition in turn.
+        """
+        for shard in range(self.pending_shards):
+            params = {
+                'IndexName': self.pending_index_name,
+                'KeyConditionExpression': 'sync_pending = :pending',
+                'ExpressionAttributeValues': {':pending': f'{self.pending_shards}-{shard:02d}'},
+            }
+            while True:
+                response = self.table.query(**params)
+                for item in response.get('Items', []):
+                    yield item['user_sub'], int(item['upload_count'])
+                if 'LastEvaluatedKey' not in response:
+                    break
+                params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def mark_synced(self, user_sub, count):
+        """
+        Records that 'count' was written to Cognito. If the counter moved on in the
+        meantime it stays pending, so the next sync picks up the newer value.
+        """
+        try:
+            self.table.update_item(
+                Key={'user_sub': user_sub},
+                UpdateExpression='SET synced_count = :count REMOVE sync_pending',
+                ConditionExpression='upload_count = :count',
+                ExpressionAttributeValues={':count': count}
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+
+# ---------------------------------------------------------------------
+#                      Local (in-process) Store
+# ---------------------------------------------------------------------
+class LocalUsageCounterStore:
+    """
+    In-process stand-in for DynamoDBUsageCounterStore, for local runs and tests.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.synced = {}
+        self.lock = threading.Lock()
+
+    def get(self, user_sub):
+        with self.lock:
+            return self.counts.get(user_sub)
+
+    def increment(self, user_sub, limit, seed=0):
+        with self.lock:
+            current = self.counts.get(user_sub, seed)
+            if current >= limit:
+                return None
+            self.counts[user_sub] = current + 1
+            return current + 1
+
+    def add(self, user_sub, amount, seed=0):
+        with self.lock:
+            self.counts[user_sub] = self.counts.get(user_sub, seed) + amount
+            return self.counts[user_sub]
+
+    def pending(self):
+        with self.lock:
+            items = [(sub, count) for sub, count in self.counts.items() if self.synced.get(sub) != count]
+        yield from items
+
+    def mark_synced(self, user_sub, count):
+        with self.lock:
+            if self.counts.get(user_sub) != count:
+                return False
+            self.synced[user_sub] = count
+            return True
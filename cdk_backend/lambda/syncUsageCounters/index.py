@@ -0,0 +1,100 @@
+import json
+import os
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+from usage_counters import DynamoDBUsageCounterStore, LocalUsageCounterStore
+
+# Initialize Cognito client
+cognito_client = boto3.client('cognito-idp')
+
+USER_POOL_ID = os.environ.get('USER_POOL_ID')
+USAGE_COUNTER_TABLE = os.environ.get('USAGE_COUNTER_TABLE')
+
+MAX_RETRIES = 5  # Maximum number of retries for throttling
+BASE_DELAY = 1   # Base delay in seconds for exponential backoff
+# Stop picking up users this long before the Lambda times out; the rest stay pending.
+TIME_RESERVE_MS = int(os.environ.get('TIME_RESERVE_MS', '10000'))
+
+if USAGE_COUNTER_TABLE:
+    usage_store = DynamoDBUsageCounterStore(USAGE_COUNTER_TABLE)
+else:
+    usage_store = LocalUsageCounterStore()
+
+
+def handler(event, context):
+    """
+    Scheduled job that copies write-behind usage counters (see checkOrIncrementQuota,
+    USAGE_COUNTER_MODE='write_behind') to each user's custom:total_files_uploaded
+    attribute. Only counters changed since the last sync are read, and each user
+    costs one Cognito call however many uploads they made in between.
+
+    Returns a summary of synced, superseded (changed again during the sync) and failed users.
+    """
+    print("Received event:", json.dumps(event))
+    summary = sync_pending_counters(usage_store, context)
+    print("Usage counter sync summary:", json.dumps(summary))
+    return summary
+
+
+def sync_pending_counters(store, context=None):
+    """
+    Writes every pending counter in 'store' to Cognito and marks it synced.
+    """
+    summary = {'synced': 0, 'superseded': 0, 'failed': 0, 'remaining': False}
+
+    for user_sub, count in store.pending():
+        if context is not None and context.get_remaining_time_in_millis() < TIME_RESERVE_MS:
+            summary['remaining'] = True
+            break
+
+        if not update_usage_attribute_with_retry(user_sub, count):
+            summary['failed'] += 1
+            continue
+
+        if store.mark_synced(user_sub, count):
+            summary['synced'] += 1
+        else:
+            summary['superseded'] += 1
+
+    return summary
+
+
+def update_usage_attribute_with_retry(user_sub, count):
+    """
+    Sets custom:total_files_uploaded for a user, with exponential backoff on throttling.
+    A user who no longer exists counts as synced, so they do not stay pending forever.
+    """
+    retries = 0
+
+    while True:
+        try:
+            cognito_client.admin_update_user_attributes(
+                UserPoolId=USER_POOL_ID,
+                Username=user_sub,
+                UserAttributes=[
+                    {
+                        'Name': 'custom:total_files_uploaded',
+                        'Value': str(count)
+                    }
+                ]
+            )
+            return True
+        except ClientError as e:
+            error_code = e.response['Error']['Code']
+            if error_code in ['TooManyRequestsException', 'ThrottlingException'] and retries < MAX_RETRIES:
+                delay = BASE_DELAY * (2 ** retries)
+                print(f"Throttled. Retrying in {delay} seconds...")
+                time.sleep(delay)
+                retries += 1
+                continue
+            if error_code == 'UserNotFoundException':
+                print(f"User '{user_sub}' no longer exists; dropping their pending count.")
+                return True
+            print(f"ClientError while syncing usage for user '{user_sub}': {e}")
+            return False
+        except Exception as e:
+            print(f"Unexpected error while syncing usage for user '{user_sub}': {e}")
+            return False
@@ -2,6 +2,8 @@ import json
 import os
 import boto3
 
+from request_schema import FIRST_SIGN_IN_SCHEMA, format_errors
+
 # Initialize Cognito client
 cognito_client = boto3.client('cognito-idp')
 
@@ -12,10 +14,13 @@ def handler(event, context):
     Expects a POST request with a JSON body containing:
     - sub: User's unique identifier in Cognito
     - organization: User's organization name
-    - country: User's country
-    - state: User's state
+    - country: User's country (ISO 3166-1 alpha-2 code)
+    - state: User's state (subdivision code)
     - city: User's city
 
+    Fields are validated against FIRST_SIGN_IN_SCHEMA from the shared layer;
+    invalid requests get a 400 with per-field 'errors' without calling Cognito.
+
     Returns a JSON response indicating success or error details.
     """
     try:
@@ -50,27 +55,10 @@ def handler(event, context):
                 "body": json.dumps({"message": "Invalid JSON in request body."}),
             }
 
-        # Extract fields
-        user_sub = body.get("sub")
-        organization = body.get("organization")
-        country = body.get("country")
-        state = body.get("state")
-        city = body.get("city")
-
-        print("Extracted fields - sub:", user_sub, "organization:", organization, "country:", country, "state:", state, "city:", city)
-
-        # Validate required fields
-        required_fields = {
-            "sub": user_sub,
-            "organization": organization,
-            "country": country,
-            "state": state,
-            "city": city
-        }
-
-        missing_fields = [field for field, value in required_fields.items() if not value]
-        if missing_fields:
-            print("Missing required fields:", ", ".join(missing_fields))
+        # Validate and normalise the fields locally, so that bad values never reach Cognito
+        fields, errors = FIRST_SIGN_IN_SCHEMA.validate(body)
+        if errors:
+            print("Invalid request fields:", errors)
             return {
                 "statusCode": 400,
                 "headers": {
@@ -79,10 +67,18 @@ def handler(event, context):
                     "Access-Control-Allow-Headers": "Content-Type,Authorization",
                 },
                 "body": json.dumps({
-                    "message": f"Missing required fields: {', '.join(missing_fields)}"
+                    "message": format_errors(errors),
+                    "errors": errors
                 }),
             }
 
+        user_sub = fields["sub"]
+        organization = fields["organization"]
+        country = fields["country"]
+        state = fields["state"]
+        city = fields["city"]
+
+        print("Validated fields - sub:", user_sub, "organization:", organization, "country:", country, "state:", state, "city:", city)
 
         # Retrieve User Pool ID from environment variables
         user_pool_id = os.environ.get("USER_POOL_ID")
@@ -7,6 +7,9 @@ import * as lambda from 'aws-cdk-lib/aws-lambda';
 import * as cognito from 'aws-cdk-lib/aws-cognito';
 import * as iam from 'aws-cdk-lib/aws-iam';
 import * as apigateway from 'aws-cdk-lib/aws-apigateway';
+import * as dynamodb from 'aws-cdk-lib/aws-dynamodb';
+import * as sqs from 'aws-cdk-lib/aws-sqs';
+import * as lambdaEventSources from 'aws-cdk-lib/aws-lambda-event-sources';
 
 import * as events from 'aws-cdk-lib/aws-events';
 import * as targets from 'aws-cdk-lib/aws-events-targets';
@@ -105,20 +108,58 @@ export class CdkBackendStack extends cdk.Stack {
       })
     );
 
+    // Attribute initialisation deferred off the sign-up path when ATTRIBUTE_INIT_MODE is 'queue'
+    const attributeInitQueue = new sqs.Queue(this, 'AttributeInitQueue', {
+      visibilityTimeout: cdk.Duration.seconds(60),
+    });
+
+    // Shared Python modules for the Lambdas (request schemas, region code sets, domain rules)
+    const sharedLayer = new lambda.LayerVersion(this, 'SharedPythonLayer', {
+      code: lambda.Code.fromAsset('lambda/shared/', { exclude: ['**/test_*.py'] }),
+      compatibleRuntimes: [lambda.Runtime.PYTHON_3_9],
+      description: 'Shared Python modules for the PDF UI Lambdas',
+    });
+
+    const domainRulesLocation = `s3://${bucket.bucketName}/config/domain-rules.json`;
+
     // Create the Lambda with the role
     const postConfirmationFn = new lambda.Function(this, 'PostConfirmationLambda', {
       runtime: lambda.Runtime.PYTHON_3_9,
       handler: 'index.handler',
-      code: lambda.Code.fromAsset('lambda/postConfirmation/'),
+      code: lambda.Code.fromAsset('lambda/postConfirmation/', { exclude: ['test_*.py'] }),
       timeout: cdk.Duration.seconds(30),
       role: postConfirmationLambdaRole,
+      layers: [sharedLayer],
       environment: {
         DEFAULT_GROUP_NAME: Default_Group,
         AMAZON_GROUP_NAME: Amazon_Group,
         ADMIN_GROUP_NAME: Admin_Group,
+        ATTRIBUTE_INIT_MODE: 'inline', // 'queue' shortens sign-up to the group add alone
+        ATTRIBUTE_INIT_QUEUE_URL: attributeInitQueue.queueUrl,
+        // Optional email domain -> group rules; built-in rules apply while the object is absent.
+        // UpdateAttributesGroups reads the partner group tiers from the same document.
+        DOMAIN_RULES_LOCATION: domainRulesLocation,
       },
     });
 
+    postConfirmationLambdaRole.addToPolicy(
+      new iam.PolicyStatement({
+        effect: iam.Effect.ALLOW,
+        actions: ['s3:GetObject'],
+        resources: [bucket.arnForObjects('config/*')],
+      })
+    );
+    // No s3:ListBucket, which would let sign-ups list every user's uploads; a missing
+    // rules object reads as AccessDenied, which the loader treats as no rules.
+
+    // The sign-up path enqueues the deferred initialisation when ATTRIBUTE_INIT_MODE is 'queue'
+    attributeInitQueue.grantSendMessages(postConfirmationLambdaRole);
+
+    postConfirmationFn.addEventSource(new lambdaEventSources.SqsEventSource(attributeInitQueue, {
+      batchSize: 10,
+      reportBatchItemFailures: true,
+    }));
+
     // ------------------- Cognito: User Pool, Domain, Client -------------------
     const userPool = new cognito.UserPool(this, 'PDF-Accessability-User-Pool', {
       userPoolName: 'PDF-Accessability-User-Pool',
@@ -278,6 +319,7 @@ export class CdkBackendStack extends cdk.Stack {
       code: lambda.Code.fromAsset('lambda/updateAttributes/'),
       timeout: cdk.Duration.seconds(30),
       role: postConfirmationLambdaRole,
+      layers: [sharedLayer],
       environment: {
         USER_POOL_ID: userPool.userPoolId, // used in index.py
       },
@@ -299,17 +341,174 @@ export class CdkBackendStack extends cdk.Stack {
       ],
     }));
 
+    // Completed 'increment' requests by idempotency key, so retries are not charged twice
+    const quotaIdempotencyTable = new dynamodb.Table(this, 'QuotaIdempotencyTable', {
+      partitionKey: { name: 'idempotency_key', type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      timeToLiveAttribute: 'expires_at',
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+    });
+    quotaIdempotencyTable.grantReadWriteData(checkUploadQuotaLambdaRole);
+
+    // Write-behind upload counters (USAGE_COUNTER_MODE=write_behind). Counters not yet
+    // copied to Cognito carry 'sync_pending', which keys the sparse PendingSyncIndex.
+    // Its value is one of 16 keys chosen by user, so increments spread over the index.
+    const usageCounterTable = new dynamodb.Table(this, 'UsageCounterTable', {
+      partitionKey: { name: 'user_sub', type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+    });
+    usageCounterTable.addGlobalSecondaryIndex({
+      indexName: 'PendingSyncIndex',
+      partitionKey: { name: 'sync_pending', type: dynamodb.AttributeType.STRING },
+    });
+    usageCounterTable.grantReadWriteData(checkUploadQuotaLambdaRole);
+
+    // Uploads to pdf/ and their results by owner, written as the objects arrive. Claimed
+    // uploads are keyed by the sub of the user who claimed them; unclaimed ones stay under
+    // the key's email prefix. Each owner's '#summary' item holds their upload count.
+    const uploadIndexTable = new dynamodb.Table(this, 'UploadIndexTable', {
+      partitionKey: { name: 'owner', type: dynamodb.AttributeType.STRING },
+      sortKey: { name: 'object_key', type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+    });
+    // Reads usage, and in object_arrival mode reserves upload slots on the summary items
+    uploadIndexTable.grantReadWriteData(checkUploadQuotaLambdaRole);
+
     // 3) Create the Lambda function
     const checkOrIncrementQuotaFn = new lambda.Function(this, 'checkOrIncrementQuotaFn', {
       runtime: lambda.Runtime.PYTHON_3_9,
-      code: lambda.Code.fromAsset('lambda/checkOrIncrementQuota'),  
+      code: lambda.Code.fromAsset('lambda/checkOrIncrementQuota', { exclude: ['test_*.py'] }),
       handler: 'index.handler',
       timeout: cdk.Duration.seconds(30),
       role: checkUploadQuotaLambdaRole,
+      layers: [sharedLayer],
+      environment: {
+        USER_POOL_ID: userPool.userPoolId,
+        IDEMPOTENCY_TABLE: quotaIdempotencyTable.tableName,
+        USAGE_COUNTER_MODE: 'cognito', // 'cognito' | 'write_behind' | 'object_arrival'
+        USAGE_COUNTER_TABLE: usageCounterTable.tableName,
+        UPLOAD_INDEX_TABLE: uploadIndexTable.tableName,
+      }
+    });
+
+    // ------------------- Upload events (pdf/ and result/ ObjectCreated) -------------------
+    // S3 delivers 'Object Created' events to EventBridge (enable "Amazon EventBridge"
+    // notifications on the bucket); they are queued so that each invocation
+    // handles a batch. A direct S3 notification could clash with the remediation
+    // pipeline's notifications on the same prefix.
+    const uploadEventsDlq = new sqs.Queue(this, 'UploadEventsDLQ', {
+      retentionPeriod: cdk.Duration.days(14),
+    });
+    const uploadEventsQueue = new sqs.Queue(this, 'UploadEventsQueue', {
+      visibilityTimeout: cdk.Duration.seconds(180),
+      deadLetterQueue: { queue: uploadEventsDlq, maxReceiveCount: 5 },
+    });
+
+    const uploadCreatedRule = new events.Rule(this, 'UploadCreatedRule', {
+      eventPattern: {
+        source: ['aws.s3'],
+        detailType: ['Object Created'],
+        detail: {
+          bucket: { name: [bucket.bucketName] },
+          object: { key: [{ prefix: 'pdf/' }, { prefix: 'result/' }] },
+        },
+      },
+    });
+    uploadCreatedRule.addTarget(new targets.SqsQueue(uploadEventsQueue));
+
+    const processUploadEventsFn = new lambda.Function(this, 'ProcessUploadEventsFn', {
+      runtime: lambda.Runtime.PYTHON_3_9,
+      code: lambda.Code.fromAsset('lambda/processUploadEvents'),
+      handler: 'index.handler',
+      timeout: cdk.Duration.seconds(30),
+      layers: [sharedLayer],
       environment: {
-        USER_POOL_ID: userPool.userPoolId  
+        UPLOAD_INDEX_TABLE: uploadIndexTable.tableName,
       }
     });
+    uploadIndexTable.grantReadWriteData(processUploadEventsFn);
+    processUploadEventsFn.addEventSource(new lambdaEventSources.SqsEventSource(uploadEventsQueue, {
+      batchSize: 100,
+      maxBatchingWindow: cdk.Duration.seconds(10),
+      reportBatchItemFailures: true,
+    }));
+
+    // Copies write-behind counters to custom:total_files_uploaded every few minutes
+    const syncUsageCountersFn = new lambda.Function(this, 'SyncUsageCountersFn', {
+      runtime: lambda.Runtime.PYTHON_3_9,
+      code: lambda.Code.fromAsset('lambda/syncUsageCounters'),
+      handler: 'index.handler',
+      timeout: cdk.Duration.minutes(5),
+      layers: [sharedLayer],
+      environment: {
+        USER_POOL_ID: userPool.userPoolId,
+        USAGE_COUNTER_TABLE: usageCounterTable.tableName,
+      }
+    });
+    usageCounterTable.grantReadWriteData(syncUsageCountersFn);
+    syncUsageCountersFn.addToRolePolicy(new iam.PolicyStatement({
+      actions: ['cognito-idp:AdminUpdateUserAttributes'],
+      resources: [userPool.userPoolArn],
+    }));
+
+    const syncUsageCountersRule = new events.Rule(this, 'SyncUsageCountersRule', {
+      schedule: events.Schedule.rate(cdk.Duration.minutes(5)),
+    });
+    syncUsageCountersRule.addTarget(new targets.LambdaFunction(syncUsageCountersFn));
+
+    // ------------------- Accessibility report digests -------------------
+    // Summarises each before/after report as it lands and stores the summary next to it
+    const digestReportsFn = new lambda.Function(this, 'DigestReportsFn', {
+      runtime: lambda.Runtime.PYTHON_3_9,
+      code: lambda.Code.fromAsset('lambda/digestReports', { exclude: ['test_*.py'] }),
+      handler: 'index.handler',
+      timeout: cdk.Duration.minutes(2),
+      memorySize: 256,
+    });
+    digestReportsFn.addToRolePolicy(new iam.PolicyStatement({
+      actions: ['s3:GetObject', 's3:PutObject'],
+      resources: [bucket.arnForObjects('temp/*')],
+    }));
+    // write_comparison lists the other summary's key to see whether it exists yet
+    digestReportsFn.addToRolePolicy(new iam.PolicyStatement({
+      actions: ['s3:ListBucket'],
+      resources: [bucket.bucketArn],
+      conditions: { StringLike: { 's3:prefix': ['temp/*'] } },
+    }));
+
+    const reportCreatedRule = new events.Rule(this, 'ReportCreatedRule', {
+      eventPattern: {
+        source: ['aws.s3'],
+        detailType: ['Object Created'],
+        detail: {
+          bucket: { name: [bucket.bucketName] },
+          object: { key: [{ wildcard: 'temp/*/accessability-report/*_accessibility_report_*_remidiation.json' }] },
+        },
+      },
+    });
+    reportCreatedRule.addTarget(new targets.LambdaFunction(digestReportsFn));
+
+    // Paginated upload history, read from the upload index
+    const getUploadHistoryFn = new lambda.Function(this, 'GetUploadHistoryFn', {
+      runtime: lambda.Runtime.PYTHON_3_9,
+      code: lambda.Code.fromAsset('lambda/getUploadHistory'),
+      handler: 'index.handler',
+      timeout: cdk.Duration.seconds(30),
+      layers: [sharedLayer],
+      environment: {
+        USER_POOL_ID: userPool.userPoolId,
+        UPLOAD_INDEX_TABLE: uploadIndexTable.tableName,
+        ADMIN_GROUP_NAME: Admin_Group,
+      }
+    });
+    uploadIndexTable.grantReadData(getUploadHistoryFn);
+    // Finds the sub behind an admin's 'email' lookup
+    getUploadHistoryFn.addToRolePolicy(new iam.PolicyStatement({
+      actions: ['cognito-idp:ListUsers'],
+      resources: [userPool.userPoolArn],
+    }));
 
     const updateAttributesApi = new apigateway.RestApi(this, 'UpdateAttributesApi', {
       restApiName: 'UpdateAttributesApi',
@@ -329,6 +528,7 @@ export class CdkBackendStack extends cdk.Stack {
     // 4) Add Resource & Method
     const UpdateFirstSignIn = updateAttributesApi.root.addResource('update-first-sign-in');
     const quotaResource = updateAttributesApi.root.addResource('upload-quota');
+    const historyResource = updateAttributesApi.root.addResource('upload-history');
     // We attach the Cognito authorizer and set the authorizationType to COGNITO
     UpdateFirstSignIn.addMethod('POST', new apigateway.LambdaIntegration(updateAttributesFn), {
       authorizer: userPoolAuthorizer,
@@ -340,6 +540,11 @@ export class CdkBackendStack extends cdk.Stack {
       authorizationType: apigateway.AuthorizationType.COGNITO,
     });
 
+    historyResource.addMethod('POST', new apigateway.LambdaIntegration(getUploadHistoryFn), {
+      authorizer: userPoolAuthorizer,
+      authorizationType: apigateway.AuthorizationType.COGNITO,
+    });
+
 
     // const hostedUiDomain = `https://pdf-ui-auth.auth.${this.region}.amazoncognito.com/login/continue?client_id=${userPoolClient.userPoolClientId}&redirect_uri=https%3A%2F%2Fmain.${amplifyApp.appId}.amplifyapp.com&response_type=code&scope=email+openid+phone+profile`
     const Authority = `cognito-idp.${this.region}.amazonaws.com/${userPool.userPoolId}`;
@@ -374,6 +579,7 @@ export class CdkBackendStack extends cdk.Stack {
       effect: iam.Effect.ALLOW,
       actions: [
         'cognito-idp:ListUsersInGroup',
+        'cognito-idp:ListUsers',
         'cognito-idp:AdminGetUser',
         'cognito-idp:AdminUpdateUserAttributes',
         'cognito-idp:AdminListGroupsForUser',
@@ -393,9 +599,46 @@ export class CdkBackendStack extends cdk.Stack {
     const updateAttributesGroupsFn = new lambda.Function(this, 'UpdateAttributesGroupsFn', {
       runtime: lambda.Runtime.PYTHON_3_9,
       handler: 'index.handler',
-      code: lambda.Code.fromAsset('lambda/UpdateAttributesGroups/'), // Ensure this path is correct
+      code: lambda.Code.fromAsset('lambda/UpdateAttributesGroups/', { exclude: ['test_*.py'] }), // Ensure this path is correct
       timeout: cdk.Duration.seconds(900),
       role: updateAttributesGroupsLambdaRole,
+      layers: [sharedLayer],
+      // Shard workers run as async invokes; a retry would apply a shard's updates twice
+      retryAttempts: 0,
+      environment: {
+        RESULTS_BUCKET: bucket.bucketName, // shard reports for orchestrated pool-wide runs
+        EXECUTION_MODE: 'sync', // 'async' issues independent Cognito calls concurrently on asyncio
+        DOMAIN_RULES_LOCATION: domainRulesLocation, // partner group tiers
+      },
+    });
+
+    updateAttributesGroupsLambdaRole.addToPolicy(new iam.PolicyStatement({
+      effect: iam.Effect.ALLOW,
+      actions: ['s3:GetObject'],
+      resources: [bucket.arnForObjects('config/*')],
+    }));
+
+    // Orchestrated runs fan out by invoking this function asynchronously once per shard.
+    // A separate policy avoids a circular dependency between the function and its role.
+    new iam.Policy(this, 'UpdateAttributesGroupsOrchestratorPolicy', {
+      roles: [updateAttributesGroupsLambdaRole],
+      statements: [
+        new iam.PolicyStatement({
+          effect: iam.Effect.ALLOW,
+          actions: ['lambda:InvokeFunction'],
+          resources: [updateAttributesGroupsFn.functionArn],
+        }),
+        new iam.PolicyStatement({
+          effect: iam.Effect.ALLOW,
+          actions: ['s3:GetObject', 's3:PutObject'],
+          resources: [bucket.arnForObjects('jobs/update-attributes-groups/*')],
+        }),
+        new iam.PolicyStatement({
+          effect: iam.Effect.ALLOW,
+          actions: ['s3:ListBucket'],
+          resources: [bucket.bucketArn],
+        }),
+      ],
     });
 
 
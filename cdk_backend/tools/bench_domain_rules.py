@@ -0,0 +1,80 @@
+"""
+Micro-benchmark for the post-confirmation domain -> group index.
+
+Compiles rule sets of growing size and times lookups against the trie and
+against an equivalent linear endswith() scan. Trie lookups should stay flat as
+the rule count grows, while the scan grows linearly.
+
+Usage (from cdk_backend/):
+    python tools/bench_domain_rules.py [--sizes 10 100 1000 10000] [--lookups 20000]
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda', 'shared', 'python'))
+
+from domain_rules import DomainGroupIndex  # noqa: E402
+
+
+def random_label(rng, length=8):
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(length))
+
+
+def build_rules(rng, count):
+    tlds = ['edu', 'org', 'com', 'gov', 'ac.uk']
+    return [
+        {'domain': f'{random_label(rng)}.{rng.choice(tlds)}', 'group': f'Tier{i % 5}', 'subdomains': i % 2 == 0}
+        for i in range(count)
+    ]
+
+
+def linear_lookup(rules, email):
+    domain = email.rpartition('@')[2]
+    for rule in rules:
+        if domain == rule['domain'] or (rule['subdomains'] and domain.endswith('.' + rule['domain'])):
+            return rule['group']
+    return 'DefaultUsers'
+
+
+def time_per_lookup(lookup, emails):
+    started_at = time.perf_counter()
+    for email in emails:
+        lookup(email)
+    return (time.perf_counter() - started_at) / len(emails) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'rules':>8} {'trie ns/lookup':>16} {'linear ns/lookup':>18}")
+    for size in args.sizes:
+        rules = build_rules(rng, size)
+        index = DomainGroupIndex(rules, 'DefaultUsers')
+
+        # Half hits (some on subdomains), half misses.
+        emails = []
+        for i in range(args.lookups):
+            if i % 2:
+                emails.append(f'user@{random_label(rng)}.example.com')
+            else:
+                rule = rng.choice(rules)
+                prefix = f'{random_label(rng, 3)}.' if rule['subdomains'] and i % 4 == 0 else ''
+                emails.append(f'user@{prefix}{rule["domain"]}')
+
+        trie_ns = time_per_lookup(index.lookup, emails)
+        linear_emails = emails[:max(100, args.lookups * 100 // max(size, 1))]
+        linear_ns = time_per_lookup(lambda email: linear_lookup(rules, email), linear_emails)
+        print(f'{size:>8} {trie_ns:>16.0f} {linear_ns:>18.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+In-memory, thread-safe stand-in for the boto3 'cognito-idp' client, covering the
+calls the Lambda handlers make. Used by replay_events.py.
+
+Users are {'attributes': {name: value}, 'groups': [group names]} keyed by sub.
+With auto_create, users that the replayed events mention but the stand-in has
+never seen are created on first use, with the default group's attributes, so
+replays of production traffic do the same work as in production.
+"""
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+DEFAULT_ATTRIBUTES = {
+    'custom:first_sign_in': 'false',
+    'custom:total_files_uploaded': '0',
+    'custom:max_files_allowed': '3',
+    'custom:max_pages_allowed': '10',
+    'custom:max_size_allowed_MB': '25',
+}
+
+
+class UserNotFoundException(ClientError):
+    pass
+
+
+class _Exceptions:
+    """
+    Mirrors boto3's client.exceptions, so 'except client.exceptions.X' works.
+    """
+    UserNotFoundException = UserNotFoundException
+    ClientError = ClientError
+
+
+class LocalCognitoClient:
+    """
+    'latency' is the simulated round trip, in seconds, of every call. 'calls'
+    counts the calls made per operation.
+    """
+
+    exceptions = _Exceptions
+
+    def __init__(self, users=None, latency=0.0, auto_create=True, default_group='DefaultUsers'):
+        self.users = {
+            sub: {'attributes': dict(user.get('attributes', {})), 'groups': list(user.get('groups', []))}
+            for sub, user in (users or {}).items()
+        }
+        self.latency = latency
+        self.auto_create = auto_create
+        self.default_group = default_group
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def _round_trip(self, operation):
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _get_user(self, operation, username):
+        # Called with the lock held
+        user = self.users.get(username)
+        if user is None:
+            if not self.auto_create:
+                raise UserNotFoundException(
+                    {'Error': {'Code': 'UserNotFoundException', 'Message': 'User does not exist.'}},
+                    operation
+                )
+            user = self.users[username] = {
+                'attributes': dict(DEFAULT_ATTRIBUTES, email=f'{username}@example.com'),
+                'groups': [self.default_group],
+            }
+        return user
+
+    def ensure_user(self, username, attributes=None):
+        with self.lock:
+            user = self._get_user('EnsureUser', username)
+            user['attributes'].update(attributes or {})
+
+    def set_group_membership(self, username, group, member):
+        """
+        Applies a group change without counting it as a call, e.g. the change an
+        EventBridge group event reports.
+        """
+        with self.lock:
+            groups = self._get_user('SetGroupMembership', username)['groups']
+            if member and group not in groups:
+                groups.append(group)
+            elif not member and group in groups:
+                groups.remove(group)
+
+    # --------------------------- Cognito API ---------------------------
+    def admin_get_user(self, UserPoolId, Username):
+        self._round_trip('AdminGetUser')
+        with self.lock:
+            attributes = dict(self._get_user('AdminGetUser', Username)['attributes'], sub=Username)
+        return {'Username': Username, 'UserAttributes': [{'Name': k, 'Value': v} for k, v in attributes.items()]}
+
+    def admin_update_user_attributes(self, UserPoolId, Username, UserAttributes, **kwargs):
+        self._round_trip('AdminUpdateUserAttributes')
+        with self.lock:
+            user = self._get_user('AdminUpdateUserAttributes', Username)
+            for attribute in UserAttributes:
+                user['attributes'][attribute['Name']] = attribute['Value']
+        return {}
+
+    def admin_add_user_to_group(self, UserPoolId, Username, GroupName):
+        self._round_trip('AdminAddUserToGroup')
+        with self.lock:
+            groups = self._get_user('AdminAddUserToGroup', Username)['groups']
+            if GroupName not in groups:
+                groups.append(GroupName)
+        return {}
+
+    def admin_list_groups_for_user(self, UserPoolId, Username, **kwargs):
+        self._round_trip('AdminListGroupsForUser')
+        with self.lock:
+            groups = list(self._get_user('AdminListGroupsForUser', Username)['groups'])
+        return {'Groups': [{'GroupName': group} for group in groups]}
+
+    def list_users_in_group(self, UserPoolId, GroupName, Limit=60, NextToken=None):
+        self._round_trip('ListUsersInGroup')
+        with self.lock:
+            members = [sub for sub, user in self.users.items() if GroupName in user['groups']]
+        return self._page(members, Limit, NextToken, 'NextToken')
+
+    def list_users(self, UserPoolId, Limit=60, PaginationToken=None, Filter=None, **kwargs):
+        self._round_trip('ListUsers')
+        # Only the 'sub ^= "prefix"' filter used by UpdateAttributesGroups is supported
+        prefix = Filter.split('"')[1] if Filter else ''
+        with self.lock:
+            subs = sorted(sub for sub in self.users if sub.startswith(prefix))
+        return self._page(subs, Limit, PaginationToken, 'PaginationToken')
+
+    @staticmethod
+    def _page(subs, limit, token, token_name):
+        start = int(token) if token else 0
+        response = {
+            'Users': [
+                {'Username': sub, 'Attributes': [{'Name': 'sub', 'Value': sub}]}
+                for sub in subs[start:start + limit]
+            ]
+        }
+        if start + limit < len(subs):
+            response[token_name] = str(start + limit)
+        return response
@@ -0,0 +1,456 @@
+"""
+Deterministic replay of recorded Lambda events against the handlers, in process.
+
+Reads events from JSONL and drives the checkOrIncrementQuota, updateAttributes,
+postConfirmation and UpdateAttributesGroups handlers against an in-memory Cognito
+stand-in (local_cognito.py), at a fixed rate and concurrency. Reports latency and
+throughput per handler and per event type, and can compare a run against a
+saved report, e.g. before and after a change.
+
+Each input line is one of:
+    - a raw event, as the handler receives it
+    - {"handler": "<handler name>", "event": {...}} to choose the handler explicitly
+    - a CloudWatch Logs export record ({"message": ...} or {"@message": ...}) whose
+      message is a "Received event: {...}" or "Post Confirmation Trigger Event: {...}"
+      dump, or the EventBridge payload printed by UpdateAttributesGroups
+Lines that are not events are counted and skipped. Events are dispatched in file
+order, and no request leaves the process: the stores that would use DynamoDB or
+SQS fall back to their local stand-ins.
+
+Usage (from cdk_backend/):
+    python tools/replay_events.py events.jsonl [--rate 50] [--concurrency 8]
+        [--repeat 3] [--cognito-latency-ms 30] [--env USAGE_COUNTER_MODE=write_behind]
+        [--output after.json] [--baseline before.json]
+"""
+import argparse
+import ast
+import asyncio
+import contextlib
+import functools
+import importlib.util
+import io
+import json
+import math
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_DIR = os.path.join(TOOLS_DIR, '..', 'lambda')
+sys.path.insert(0, os.path.join(LAMBDA_DIR, 'shared', 'python'))
+
+from local_cognito import LocalCognitoClient  # noqa: E402
+
+LOCAL_POOL_ID = 'us-east-1_replay'
+
+# Handler name -> (directory under lambda/, module attribute holding the Cognito client).
+# UpdateAttributesGroups also builds an AsyncCognitoClient when EXECUTION_MODE is
+# 'async'; load_handlers replaces it with LocalAsyncCognitoClient.
+HANDLERS = {
+    'checkOrIncrementQuota': ('checkOrIncrementQuota', 'cognito_client'),
+    'updateAttributes': ('updateAttributes', 'cognito_client'),
+    'postConfirmation': ('postConfirmation', 'cognito_idp'),
+    'UpdateAttributesGroups': ('UpdateAttributesGroups', 'cognito_client'),
+}
+
+# Log prefixes the handlers print before the event
+LOG_MARKERS = ('Received event:', 'Post Confirmation Trigger Event:')
+
+# Settings that would send the handlers to AWS; removed so the local stand-ins are used
+AWS_BACKED_SETTINGS = (
+    'IDEMPOTENCY_TABLE', 'USAGE_COUNTER_TABLE', 'UPLOAD_INDEX_TABLE',
+    'ATTRIBUTE_INIT_QUEUE_URL', 'DOMAIN_RULES_LOCATION', 'RESULTS_BUCKET',
+)
+
+
+# ---------------------------------------------------------------------
+#                          Reading Events
+# ---------------------------------------------------------------------
+def parse_payload(text):
+    """
+    Parses a logged event: JSON, or the Python repr that print(event) produces.
+    """
+    text = text.strip()
+    try:
+        return json.loads(text)
+    except ValueError:
+        return ast.literal_eval(text)
+
+
+def event_from_record(record):
+    """
+    Returns (handler or None, event) for one input record, or None if it holds no event.
+    """
+    if 'event' in record and isinstance(record['event'], dict):
+        return record.get('handler'), record['event']
+
+    message = record.get('message', record.get('@message'))
+    if not isinstance(message, str):
+        return None, record
+
+    for marker in LOG_MARKERS:
+        if marker in message:
+            message = message.split(marker, 1)[1]
+            break
+    else:
+        if not message.lstrip().startswith('{'):
+            return None
+    try:
+        event = parse_payload(message)
+    except (ValueError, SyntaxError):
+        return None
+    return (None, event) if isinstance(event, dict) else None
+
+
+def classify(event):
+    """
+    Returns (handler, event type) for an event, or (None, reason) if it cannot be replayed.
+    """
+    if 'triggerSource' in event:
+        return 'postConfirmation', event['triggerSource']
+
+    if 'detail' in event and isinstance(event['detail'], dict):
+        return 'UpdateAttributesGroups', event['detail'].get('eventName') or event.get('detail-type', 'EventBridge')
+
+    if 'httpMethod' in event:
+        path = event.get('resource') or event.get('path') or ''
+        event_type = f"{event['httpMethod']} {path}"
+        if path.endswith('/upload-quota'):
+            try:
+                event_type += f" mode={json.loads(event.get('body') or '{}').get('mode')}"
+            except (ValueError, AttributeError):
+                pass
+            return 'checkOrIncrementQuota', event_type
+        if path.endswith('/update-first-sign-in'):
+            return 'updateAttributes', event_type
+        return None, f'unknown API path {path!r}'
+
+    if event.get('Records') and 'body' in event['Records'][0]:
+        return 'postConfirmation', 'SQS attribute init'
+
+    if 'mode' in event:
+        # Orchestrated jobs invoke Lambda and S3, so they cannot run in process
+        return None, f"UpdateAttributesGroups mode {event['mode']!r}"
+    return None, 'unrecognised event'
+
+
+def load_events(path):
+    """
+    Reads a JSONL file. Returns (events, skipped): events as (handler, type, event)
+    in file order, and a count of skipped lines by reason.
+    """
+    events = []
+    skipped = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                parsed = event_from_record(json.loads(line))
+            except ValueError:
+                parsed = None
+            if parsed is None:
+                skipped['not an event'] = skipped.get('not an event', 0) + 1
+                continue
+
+            handler, event = parsed
+            detected, event_type = classify(event)
+            handler = handler or detected
+            if handler not in HANDLERS:
+                skipped[event_type] = skipped.get(event_type, 0) + 1
+                continue
+            events.append((handler, event_type, event))
+    return events, skipped
+
+
+# ---------------------------------------------------------------------
+#                        Preparing Handlers
+# ---------------------------------------------------------------------
+class ReplayContext:
+    """
+    The parts of the Lambda context object the handlers use.
+    """
+
+    def __init__(self, function_name, timeout_seconds=30):
+        self.function_name = function_name
+        self.aws_request_id = str(uuid.uuid4())
+        self.deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - time.monotonic()) * 1000))
+
+
+class LocalAsyncCognitoClient:
+    """
+    Async view of a LocalCognitoClient, standing in for UpdateAttributesGroups'
+    AsyncCognitoClient so that async runs use the same users and call counts.
+    Like AsyncCognitoClient without aiobotocore, each call runs on a thread pool
+    of 'max_workers' threads, so simulated latency overlaps as it would in Lambda.
+    """
+
+    def __init__(self, cognito, region_name=None, max_workers=10):
+        self.cognito = cognito
+        self.max_workers = max_workers
+        self._executor = None
+
+    async def __aenter__(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._executor.shutdown(wait=False)
+        self._executor = None
+
+    def __getattr__(self, operation):
+        if operation.startswith('_'):
+            raise AttributeError(operation)
+        method = getattr(self.cognito, operation)
+
+        async def call(**kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(method, **kwargs))
+
+        return call
+
+
+def load_handlers(cognito, env_overrides):
+    """
+    Imports each handler module under its own name, with its Cognito client
+    replaced by the stand-in.
+    """
+    for name in AWS_BACKED_SETTINGS:
+        os.environ.pop(name, None)
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ.update({
+        'USER_POOL_ID': LOCAL_POOL_ID,
+        'DEFAULT_GROUP_NAME': 'DefaultUsers',
+        'AMAZON_GROUP_NAME': 'AmazonUsers',
+        'ADMIN_GROUP_NAME': 'AdminUsers',
+    })
+    os.environ.update(env_overrides)
+
+    modules = {}
+    for name, (directory, client_attribute) in HANDLERS.items():
+        handler_dir = os.path.join(LAMBDA_DIR, directory)
+        sys.path.insert(0, handler_dir)
+        spec = importlib.util.spec_from_file_location(f'replay_{name}', os.path.join(handler_dir, 'index.py'))
+        module = importlib.util.module_from_spec(spec)
+        with contextlib.redirect_stdout(io.StringIO()):
+            spec.loader.exec_module(module)
+        setattr(module, client_attribute, cognito)
+        modules[name] = module
+
+    # UpdateAttributesGroups has its pool ID in code; replayed events are rewritten to match
+    modules['UpdateAttributesGroups'].USER_POOL_ID = LOCAL_POOL_ID
+    modules['UpdateAttributesGroups'].AsyncCognitoClient = functools.partial(LocalAsyncCognitoClient, cognito)
+    return modules
+
+
+def prepare_event(cognito, handler, event):
+    """
+    Returns a copy of the event pointed at the local pool. For group change events,
+    the change itself is applied to the stand-in first, as it was in production.
+    """
+    event = json.loads(json.dumps(event, default=str))
+    if 'userPoolId' in event:
+        event['userPoolId'] = LOCAL_POOL_ID
+
+    if handler == 'UpdateAttributesGroups':
+        detail = event['detail']
+        parameters = detail.setdefault('requestParameters', {})
+        parameters['userPoolId'] = LOCAL_POOL_ID
+        sub = detail.get('additionalEventData', {}).get('sub')
+        if sub and parameters.get('groupName'):
+            member = detail.get('eventName') == 'AdminAddUserToGroup'
+            cognito.set_group_membership(sub, parameters['groupName'], member)
+
+    if handler == 'postConfirmation' and event.get('request', {}).get('userAttributes'):
+        attributes = event['request']['userAttributes']
+        cognito.ensure_user(event.get('userName'), {'email': attributes.get('email', '')})
+    return event
+
+
+# ---------------------------------------------------------------------
+#                             Replaying
+# ---------------------------------------------------------------------
+def response_status(response):
+    """
+    Returns the status of a handler response: its statusCode, or 200.
+    """
+    if isinstance(response, dict) and isinstance(response.get('statusCode'), int):
+        return response['statusCode']
+    return 200
+
+
+def replay(events, modules, cognito, rate, concurrency, verbose=False):
+    """
+    Runs the events through their handlers, starting one every 1/rate seconds
+    (as fast as possible if rate is 0) with at most 'concurrency' in flight.
+    Returns (samples, wall seconds); each sample is (handler, type, ms, status, lag ms).
+    """
+    samples = []
+    samples_lock = threading.Lock()
+
+    def run(index, handler, event_type, event, scheduled_at):
+        lag_ms = max(0.0, (time.perf_counter() - scheduled_at) * 1000)
+        started_at = time.perf_counter()
+        try:
+            status = response_status(modules[handler].handler(event, ReplayContext(handler)))
+        except Exception as e:
+            print(f'{handler} raised {type(e).__name__}: {e}', file=sys.stderr)
+            status = 'exception'
+        elapsed_ms = (time.perf_counter() - started_at) * 1000
+        with samples_lock:
+            samples.append((index, handler, event_type, elapsed_ms, status, lag_ms))
+
+    prepared = [(handler, event_type, prepare_event(cognito, handler, event)) for handler, event_type, event in events]
+    interval = 1.0 / rate if rate else 0.0
+
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with output, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        started_at = time.perf_counter()
+        for index, (handler, event_type, event) in enumerate(prepared):
+            scheduled_at = started_at + index * interval
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(run, index, handler, event_type, event, scheduled_at)
+        executor.shutdown(wait=True)
+        wall_seconds = time.perf_counter() - started_at
+
+    samples.sort()
+    return [sample[1:] for sample in samples], wall_seconds
+
+
+# ---------------------------------------------------------------------
+#                             Reporting
+# ---------------------------------------------------------------------
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def summarise(samples, wall_seconds):
+    """
+    Groups the samples per handler and per (handler, event type). Returns
+    {row name: {count, errors, rejected, statuses, mean_ms, p50_ms, p90_ms, p99_ms,
+    max_ms, max_lag_ms, throughput_per_s}}, where 'errors' counts exceptions and
+    5xx responses and 'rejected' counts 4xx responses.
+    """
+    groups = {}
+    for handler, event_type, elapsed_ms, status, lag_ms in samples:
+        for name in ('ALL', handler, f'{handler} | {event_type}'):
+            groups.setdefault(name, []).append((elapsed_ms, status, lag_ms))
+
+    report = {}
+    for name, rows in sorted(groups.items(), key=lambda item: (item[0] != 'ALL', item[0])):
+        latencies = sorted(row[0] for row in rows)
+        statuses = {}
+        for _, status, _ in rows:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        report[name] = {
+            'count': len(rows),
+            'errors': sum(1 for _, status, _ in rows if status == 'exception' or status >= 500),
+            'rejected': sum(1 for _, status, _ in rows if status != 'exception' and 400 <= status < 500),
+            'statuses': statuses,
+            'mean_ms': round(sum(latencies) / len(latencies), 3),
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p90_ms': round(percentile(latencies, 0.90), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'max_ms': round(latencies[-1], 3),
+            'max_lag_ms': round(max(row[2] for row in rows), 3),
+            'throughput_per_s': round(len(rows) / wall_seconds, 2) if wall_seconds else 0.0,
+        }
+    return report
+
+
+def print_report(report, baseline=None):
+    width = max(len(name) for name in report)
+    header = f"{'':<{width}} {'count':>6} {'errors':>6} {'4xx':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9} {'req/s':>8}"
+    if baseline:
+        header += f" {'Δp50':>8} {'Δp99':>8}"
+    print(header)
+    for name, row in report.items():
+        line = (
+            f"{name:<{width}} {row['count']:>6} {row['errors']:>6} {row['rejected']:>6} {row['p50_ms']:>9.2f} {row['p90_ms']:>9.2f}"
+            f" {row['p99_ms']:>9.2f} {row['max_ms']:>9.2f} {row['throughput_per_s']:>8.1f}"
+        )
+        if baseline:
+            before = baseline.get(name)
+            if before:
+                line += f" {percent_change(before['p50_ms'], row['p50_ms']):>8} {percent_change(before['p99_ms'], row['p99_ms']):>8}"
+            else:
+                line += f" {'new':>8} {'new':>8}"
+        print(line)
+
+
+def percent_change(before, after):
+    if not before:
+        return 'n/a'
+    return f'{(after - before) / before * 100:+.0f}%'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('events', help='JSONL file of recorded events')
+    parser.add_argument('--rate', type=float, default=0.0, help='events started per second (0: as fast as possible)')
+    parser.add_argument('--concurrency', type=int, default=4, help='maximum events in flight')
+    parser.add_argument('--repeat', type=int, default=1, help='replay the file this many times')
+    parser.add_argument('--cognito-latency-ms', type=float, default=0.0, help='simulated Cognito round trip')
+    parser.add_argument('--users', help='JSON file of {sub: {"attributes": {...}, "groups": [...]}} to seed Cognito')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help='handler setting to apply before loading, e.g. USAGE_COUNTER_MODE=write_behind')
+    parser.add_argument('--output', help='write the report as JSON to this file')
+    parser.add_argument('--baseline', help='report JSON of an earlier run to compare against')
+    parser.add_argument('--verbose', action='store_true', help="show the handlers' own output")
+    args = parser.parse_args()
+
+    events, skipped = load_events(args.events)
+    events *= args.repeat
+    if not events:
+        sys.exit(f'No replayable events in {args.events} (skipped: {skipped}).')
+
+    users = None
+    if args.users:
+        with open(args.users, encoding='utf-8') as f:
+            users = json.load(f)
+    cognito = LocalCognitoClient(users=users, latency=args.cognito_latency_ms / 1000)
+    env_overrides = dict(setting.split('=', 1) for setting in args.env)
+    modules = load_handlers(cognito, env_overrides)
+
+    samples, wall_seconds = replay(events, modules, cognito, args.rate, args.concurrency, args.verbose)
+    report = summarise(samples, wall_seconds)
+
+    print(f'Replayed {len(samples)} events in {wall_seconds:.2f}s '
+          f'(rate {args.rate or "unlimited"}, concurrency {args.concurrency}).')
+    if skipped:
+        print('Skipped:', ', '.join(f'{reason} ({count})' for reason, count in sorted(skipped.items())))
+    print('Cognito calls:', ', '.join(f'{name} {count}' for name, count in sorted(cognito.calls.items())))
+    print()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['report']
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'events': args.events,
+                'rate': args.rate,
+                'concurrency': args.concurrency,
+                'cognito_latency_ms': args.cognito_latency_ms,
+                'env': env_overrides,
+                'wall_seconds': round(wall_seconds, 3),
+                'report': report,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
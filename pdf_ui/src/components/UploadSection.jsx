@@ -113,6 +113,15 @@ function UploadSection({ onUploadComplete, awsCredentials, currentUsage, maxFile
     const idToken = auth.user?.id_token;
     setIsUploading(true);
 
+    // The S3 key doubles as the idempotency key, so a retried increment is not charged twice
+    const timestamp = new Date().toISOString().replace(/[-:.TZ]/g, ''); // YYYYMMDDTHHMMSS format
+    const userEmail = auth.user?.profile?.email || 'user'; // Use email for unique filename, fallback to 'user'
+    const sanitizedEmail = userEmail.replace(/[^a-zA-Z0-9]/g, '_'); // Replace non-alphanumerics with underscores
+    const sanitizedFileName = sanitizeFilename(selectedFile.name) || 'default.pdf'; // Fallback to 'default.pdf' if sanitization fails 
+    const uniqueFilename = `${sanitizedEmail}_${timestamp}_${sanitizedFileName}`; // Combined unique filename
+    // const uniqueFilename = `${sanitizedEmail}_${timestamp}_${selectedFile.name}`; // Sanitized and unique filename
+    const objectKey = `pdf/${uniqueFilename}`;
+
     try {
       // **4. Call the Usage API to Increment**
       const usageRes = isDemoMode ? { ok: true, json: async () => ({ newCount: currentUsage + 1 }) } : await fetch(CheckAndIncrementQuota, {
@@ -121,7 +130,7 @@ function UploadSection({ onUploadComplete, awsCredentials, currentUsage, maxFile
           'Content-Type': 'application/json',
           Authorization: `Bearer ${idToken}`
         },
-        body: JSON.stringify({ sub: userSub, mode: 'increment' }),
+        body: JSON.stringify({ sub: userSub, mode: 'increment', idempotencyKey: objectKey }),
       });
 
       if (!usageRes.ok) {
@@ -157,16 +166,9 @@ function UploadSection({ onUploadComplete, awsCredentials, currentUsage, maxFile
         });
       }
 
-      const timestamp = new Date().toISOString().replace(/[-:.TZ]/g, ''); // YYYYMMDDTHHMMSS format
-      const userEmail = auth.user?.profile?.email || 'user'; // Use email for unique filename, fallback to 'user'
-      const sanitizedEmail = userEmail.replace(/[^a-zA-Z0-9]/g, '_'); // Replace non-alphanumerics with underscores
-      const sanitizedFileName = sanitizeFilename(selectedFile.name) || 'default.pdf'; // Fallback to 'default.pdf' if sanitization fails 
-      const uniqueFilename = `${sanitizedEmail}_${timestamp}_${sanitizedFileName}`; // Combined unique filename
-      // const uniqueFilename = `${sanitizedEmail}_${timestamp}_${selectedFile.name}`; // Sanitized and unique filename
-
       const params = {
         Bucket,
-        Key: `pdf/${uniqueFilename}`,
+        Key: objectKey,
         Body: selectedFile,
       };
 